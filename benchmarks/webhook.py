@@ -0,0 +1,323 @@
+"""
+Offline load test of the WhatsApp webhook path.
+Synthetic conversations are replayed against /webhook/incoming with signature-valid requests,
+the agents are replaced by a deterministic fake Runner and Twilio by a recording transport,
+so the numbers measure our own queueing, session and delivery code without any API costs.
+
+    python -m benchmarks.webhook --conversations 200 --turns 6 --concurrency 50
+
+Results are written as JSON tagged with the git commit, and --compare prints the change
+against an earlier result file.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+import uuid
+from types import SimpleNamespace
+
+BENCH_AUTH_TOKEN = "benchmark-auth-token"
+BENCH_HOST = "bench.local"
+WEBHOOK_PATH = "/webhook/incoming"
+RESULTS_DIR = "benchmarks/results"
+
+USER_MESSAGES = [
+    "Hola, busco un auto usado",
+    "Quiero un Volkswagen Jetta de 2018 o más nuevo",
+    "¿Cuánto pagaría al mes a 48 meses con 50000 de enganche?",
+    "¿Tienen algo con CarPlay por menos de 300000?",
+    "¿Cómo funciona la garantía de Kavak?",
+    "¿Puedo dar mi auto a cuenta?",
+    "¿Dónde están sus sucursales en Monterrey?",
+    "Compárame los planes de 36 y 60 meses",
+    "¿Qué documentos necesito para el crédito?",
+    "Gracias, eso es todo",
+]
+SALES_KEYWORDS = ("auto", "jetta", "carplay", "mes", "planes", "crédito", "enganche")
+ERROR_REPLY_PREFIXES = ("An error occurred", "Sorry, I can't respond")
+REPLY_WORDS = ["claro", "te", "ayudo", "con", "eso", "tenemos", "varias", "opciones", "para", "ti"]
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class FakeRunner:
+    """Deterministic stand-in for agents.Runner with configurable latency and reply size."""
+
+    def __init__(self, bot, latency_seconds: float, jitter_seconds: float, output_tokens: int, seed: int):
+        self.bot = bot
+        self.latency_seconds = latency_seconds
+        self.jitter_seconds = jitter_seconds
+        self.output_tokens = output_tokens
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.input_tokens = 0
+
+    async def run(self, agent, input, context=None, run_config=None):
+        self.calls += 1
+        self.input_tokens += sum(len(str(item.get("content", "")).split()) for item in input)
+        await asyncio.sleep(self.latency_seconds + self.random.uniform(0, self.jitter_seconds))
+
+        if agent is self.bot.triage_agent:
+            text = str(input[-1].get("content", "")).lower()
+            is_sales = any(keyword in text for keyword in SALES_KEYWORDS)
+            agent = self.bot.car_sales_agent if is_sales else self.bot.customer_success_agent
+
+        message = " ".join(REPLY_WORDS[i % len(REPLY_WORDS)] for i in range(self.output_tokens))
+        history = list(input) + [{"role": "assistant", "content": message}]
+        return SimpleNamespace(
+            final_output=SimpleNamespace(message=message, needsTriage=False),
+            last_agent=agent,
+            new_items=[],
+            to_input_list=lambda: history
+        )
+
+class FakeBot:
+    """Only the parts of src.bot.main.Bot the API touches, with name-only agents."""
+
+    def __init__(self, triage_name: str, car_sales_name: str, customer_success_name: str):
+        self.triage_agent = SimpleNamespace(name=triage_name)
+        self.car_sales_agent = SimpleNamespace(name=car_sales_name)
+        self.customer_success_agent = SimpleNamespace(name=customer_success_name)
+        self.agents = {
+            agent.name: agent
+            for agent in (self.triage_agent, self.car_sales_agent, self.customer_success_agent)
+        }
+
+    def agent(self, name: str | None):
+        return self.agents.get(name, self.triage_agent)
+
+    def routed_agent(self, name: str | None):
+        return self.agent(name)
+
+class RecordingTransport:
+    """Fake Twilio transport that wakes up the conversation waiting on each reply."""
+
+    def __init__(self, latency_seconds: float):
+        self.latency_seconds = latency_seconds
+        self.waiters: dict[str, asyncio.Future] = {}
+        self.sent = 0
+
+    def expect(self, to: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[to] = future
+        return future
+
+    async def send(self, to: str, body: str) -> str:
+        await asyncio.sleep(self.latency_seconds)
+        self.sent += 1
+        future = self.waiters.pop(to, None)
+        if future is not None and not future.done():
+            future.set_result((time.perf_counter(), body))
+        return f"SMbench{self.sent:08d}"
+
+    async def close(self):
+        pass
+
+def configure_environment(args):
+    """The API reads its settings at import time, so they are set before importing it."""
+    os.environ["TWILIO_AUTH_TOKEN"] = BENCH_AUTH_TOKEN
+    os.environ["OUTBOUND_TRANSPORT"] = "local"
+    os.environ["OUTBOUND_WORKERS"] = str(args.outbound_workers)
+    os.environ["MESSAGE_DEBOUNCE_SECONDS"] = str(args.debounce)
+    os.environ["BOT_REFRESH_INTERVAL_SECONDS"] = "0"
+    os.environ["ROUTING_LOG_PATH"] = ""
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("KB_URL", "https://example.invalid/kb")
+
+async def run_benchmark(args) -> dict:
+    configure_environment(args)
+    import httpx
+    from agents import set_trace_processors
+    from twilio.request_validator import RequestValidator
+    import src.api.main as api
+    import src.bot.main as bot_main
+    from src.bot.main import TRIAGE_AGENT_NAME, CAR_SALES_AGENT_NAME, CUSTOMER_SUCCESS_AGENT_NAME
+
+    bot = FakeBot(TRIAGE_AGENT_NAME, CAR_SALES_AGENT_NAME, CUSTOMER_SUCCESS_AGENT_NAME)
+    runner = FakeRunner(bot, args.llm_latency, args.llm_jitter, args.output_tokens, args.seed)
+    transport = RecordingTransport(args.twilio_latency)
+
+    async def fake_warm_up():
+        return bot
+
+    bot_main.Runner = runner
+    api.warm_up = fake_warm_up
+    api.outbound_dispatcher.transport = transport
+    # Keep our own span processing in the measurement but don't export traces to OpenAI.
+    set_trace_processors([api.turn_tracer])
+
+    validator = RequestValidator(BENCH_AUTH_TOKEN)
+    url = f"https://{BENCH_HOST}{WEBHOOK_PATH}"
+    message_counter = 0
+    # The SQLite dedupe table outlives the run, so message ids must not repeat across runs.
+    run_id = uuid.uuid4().hex[:8]
+    latencies: list[float] = []
+    failures = 0
+    error_replies: list[str] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def converse(client: httpx.AsyncClient, index: int):
+        nonlocal message_counter, failures
+        phone_number = f"+5255{index:08d}"
+        conversation_random = random.Random(args.seed + index)
+        async with semaphore:
+            for turn in range(args.turns):
+                message_counter += 1
+                params = {
+                    "From": f"whatsapp:{phone_number}",
+                    "Body": USER_MESSAGES[(index + turn) % len(USER_MESSAGES)],
+                    "SmsMessageSid": f"SM{run_id}{message_counter:010d}"
+                }
+                reply = transport.expect(phone_number)
+                started = time.perf_counter()
+                response = await client.post(WEBHOOK_PATH, data=params, headers={
+                    "X-Twilio-Signature": validator.compute_signature(url, params),
+                    "X-Forwarded-Proto": "https",
+                    "X-Forwarded-Host": BENCH_HOST
+                })
+                if response.status_code != 200:
+                    failures += 1
+                    continue
+                try:
+                    replied, body = await asyncio.wait_for(reply, args.timeout)
+                except asyncio.TimeoutError:
+                    failures += 1
+                    continue
+                # A turn that failed is still answered, with the error reply.
+                if body.startswith(ERROR_REPLY_PREFIXES):
+                    failures += 1
+                    error_replies.append(body)
+                    continue
+                latencies.append(replied - started)
+                if args.think_time:
+                    await asyncio.sleep(conversation_random.uniform(0, args.think_time))
+
+    await api.app.router.startup()
+    if args.memory:
+        tracemalloc.start()
+    memory_before = tracemalloc.get_traced_memory()[0] if args.memory else 0
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=api.app), base_url=f"https://{BENCH_HOST}"
+    ) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(converse(client, index) for index in range(args.conversations)))
+        elapsed = time.perf_counter() - started
+
+    memory_after = tracemalloc.get_traced_memory()[0] if args.memory else 0
+    if args.memory:
+        tracemalloc.stop()
+    session_stats = api.session_store.stats()
+    queue_stats = api.conversation_queue.stats()
+    await api.app.router.shutdown()
+
+    sessions = session_stats["sessions"] or 1
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "parameters": {
+            key: getattr(args, key)
+            for key in (
+                "conversations", "turns", "concurrency", "llm_latency", "llm_jitter", "output_tokens",
+                "twilio_latency", "debounce", "think_time", "outbound_workers", "seed"
+            )
+        },
+        "messages": len(latencies),
+        "failures": failures,
+        "error_replies": error_replies[:5],
+        "elapsed_seconds": round(elapsed, 3),
+        "messages_per_second": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(max(latencies, default=0.0) * 1000, 2)
+        },
+        "memory": {
+            "traced_growth_bytes": memory_after - memory_before,
+            "bytes_per_session": (memory_after - memory_before) // sessions,
+            "history_bytes_per_session": session_stats["live_history_bytes"] // sessions
+        } if args.memory else None,
+        "runner": {"calls": runner.calls, "input_tokens": runner.input_tokens},
+        "queue": queue_stats,
+        "sessions": session_stats
+    }
+
+def print_results(results: dict, baseline: dict | None = None):
+    def line(label: str, value: float, base: float | None, unit: str = ""):
+        change = ""
+        if base:
+            change = f"  ({(value - base) / base * 100:+.1f}% vs {baseline.get('commit') or 'baseline'})"
+        print(f"{label:<22}{value:>12}{unit}{change}")
+
+    base_latency = baseline["latency_ms"] if baseline else {}
+    print(f"commit {results['commit']}, {results['messages']} messages, {results['failures']} failures")
+    for body in results.get("error_replies", []):
+        print(f"error reply: {body}")
+    line("messages/sec", results["messages_per_second"], baseline and baseline["messages_per_second"])
+    for key in ("p50", "p95", "p99", "max"):
+        line(f"latency {key}", results["latency_ms"][key], base_latency.get(key), " ms")
+    if results["memory"]:
+        base_memory = (baseline or {}).get("memory") or {}
+        line("memory per session", results["memory"]["bytes_per_session"], base_memory.get("bytes_per_session"), " B")
+        line("history per session", results["memory"]["history_bytes_per_session"], base_memory.get("history_bytes_per_session"), " B")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test of the WhatsApp webhook path")
+    parser.add_argument("--conversations", type=int, default=200, help="Synthetic conversations to replay")
+    parser.add_argument("--turns", type=int, default=6, help="User messages per conversation")
+    parser.add_argument("--concurrency", type=int, default=50, help="Conversations in flight at once")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Fake agent run latency in seconds")
+    parser.add_argument("--llm-jitter", type=float, default=0.1, help="Extra random agent latency in seconds")
+    parser.add_argument("--output-tokens", type=int, default=60, help="Words in every fake agent reply")
+    parser.add_argument("--twilio-latency", type=float, default=0.05, help="Fake Twilio send latency in seconds")
+    parser.add_argument("--debounce", type=float, default=0.0, help="MESSAGE_DEBOUNCE_SECONDS for the run")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Max random pause between a reply and the next message")
+    parser.add_argument("--outbound-workers", type=int, default=4, help="OUTBOUND_WORKERS for the run")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for a reply before counting a failure")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="Skip tracemalloc, it slows the run down")
+    parser.add_argument("--output", help=f"Result file, defaults to {RESULTS_DIR}/<commit>.json")
+    parser.add_argument("--compare", help="Earlier result file to compare against")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = asyncio.run(run_benchmark(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as blob:
+            baseline = json.load(blob)
+    print_results(results, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{results['commit'] or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as blob:
+        json.dump(results, blob, indent=2)
+    print(f"Results written to {output}")
+    return 0 if not results["failures"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Per-conversation work queue for incoming WhatsApp messages.
+Each phone number gets a single consumer so its turns run in order, and messages that
+arrive in a quick burst are coalesced into one agent turn.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+
+class ConversationQueue:
+    """Ordered, coalescing message queue with one consumer task per phone number."""
+
+    def __init__(
+        self,
+        handler: Callable[[str, str], Awaitable],
+        debounce_seconds: float = 1.5,
+        max_batch_size: int = 10,
+        on_turn_done: Optional[Callable[[list[str]], None]] = None
+    ):
+        self.handler = handler
+        self.on_turn_done = on_turn_done
+        self.debounce_seconds = debounce_seconds
+        self.max_batch_size = max_batch_size
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self.consumers: Dict[str, asyncio.Task] = {}
+        self.received_messages = 0
+        self.processed_turns = 0
+        self.coalesced_messages = 0
+
+    def submit(self, phone_number: str, message_content: str, message_id: Optional[str] = None):
+        """Enqueue a message, starting the consumer for this conversation if needed."""
+        queue = self.queues.get(phone_number)
+        if queue is None:
+            queue = self.queues[phone_number] = asyncio.Queue()
+        queue.put_nowait((message_content, message_id))
+        self.received_messages += 1
+
+        if phone_number not in self.consumers:
+            self.consumers[phone_number] = asyncio.create_task(self._consume(phone_number, queue))
+
+    async def _next_batch(self, queue: asyncio.Queue) -> list[tuple[str, Optional[str]]]:
+        """Take the next message plus anything arriving within the debounce window."""
+        messages = [queue.get_nowait()]
+        while len(messages) < self.max_batch_size:
+            try:
+                messages.append(await asyncio.wait_for(queue.get(), self.debounce_seconds))
+            except asyncio.TimeoutError:
+                break
+        return messages
+
+    async def _consume(self, phone_number: str, queue: asyncio.Queue):
+        try:
+            while not queue.empty():
+                messages = await self._next_batch(queue)
+                self.processed_turns += 1
+                self.coalesced_messages += len(messages) - 1
+                try:
+                    await self.handler(phone_number, "\n".join(content for content, _ in messages))
+                except Exception as e:
+                    print(f"Error handling messages from {phone_number}: {e}")
+                if self.on_turn_done:
+                    self.on_turn_done([message_id for _, message_id in messages if message_id])
+        finally:
+            # No awaits between the empty check and the cleanup, so a message submitted
+            # meanwhile either is seen by the loop above or starts a new consumer.
+            self.consumers.pop(phone_number, None)
+            if queue.empty():
+                self.queues.pop(phone_number, None)
+
+    async def close(self):
+        """Cancel all consumers, dropping any pending messages."""
+        consumers = list(self.consumers.values())
+        for consumer in consumers:
+            consumer.cancel()
+        await asyncio.gather(*consumers, return_exceptions=True)
+        self.queues.clear()
+
+    def stats(self) -> dict:
+        return {
+            "active_conversations": len(self.consumers),
+            "pending_messages": sum(queue.qsize() for queue in self.queues.values()),
+            "received_messages": self.received_messages,
+            "processed_turns": self.processed_turns,
+            "coalesced_messages": self.coalesced_messages
+        }
@@ -0,0 +1,103 @@
+"""
+Idempotent webhook handling.
+Twilio retries webhooks it considers slow or failed, so incoming messages are tracked by
+SmsMessageSid while queued or being answered and for a while after that. With several
+workers the claims are kept in the shared SQLite database, so a retry is suppressed
+whichever worker it reaches.
+"""
+import sqlite3
+import time
+from collections import OrderedDict
+
+class MessageDeduplicator:
+    """Time-bounded seen-set plus in-flight tracking of webhook message ids."""
+
+    def __init__(self, ttl_seconds: float = 3600, max_entries: int = 100000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.in_flight: set[str] = set()
+        self.seen: OrderedDict[str, float] = OrderedDict()
+        self.suppressed_duplicates = 0
+
+    def _expire(self, now: float):
+        while self.seen:
+            message_id, seen_at = next(iter(self.seen.items()))
+            if now - seen_at <= self.ttl_seconds and len(self.seen) <= self.max_entries:
+                break
+            self.seen.popitem(last=False)
+
+    def claim(self, message_id: str) -> bool:
+        """Return True the first time a message id is seen, False for a retried delivery."""
+        if not message_id:
+            return True
+        self._expire(time.monotonic())
+        if message_id in self.in_flight or message_id in self.seen:
+            self.suppressed_duplicates += 1
+            return False
+        self.in_flight.add(message_id)
+        return True
+
+    def complete(self, message_ids: list[str]):
+        """Move answered message ids from in-flight to the seen-set."""
+        now = time.monotonic()
+        for message_id in message_ids:
+            self.in_flight.discard(message_id)
+            self.seen[message_id] = now
+            self.seen.move_to_end(message_id)
+        self._expire(now)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self.in_flight),
+            "seen": len(self.seen),
+            "suppressed_duplicates": self.suppressed_duplicates
+        }
+
+class SQLiteMessageDeduplicator(MessageDeduplicator):
+    """Message id claims shared by worker processes through a SQLite table.
+
+    A claim is an INSERT OR IGNORE, so exactly one worker wins it. Claims stay until they
+    expire, whether the message is still being answered or not.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = 3600, expire_every: int = 1000, busy_timeout_seconds: float = 5):
+        super().__init__(ttl_seconds=ttl_seconds)
+        self.expire_every = expire_every
+        self.claims = 0
+        self.connection = sqlite3.connect(path, timeout=busy_timeout_seconds, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS message_claims (message_id TEXT PRIMARY KEY, claimed_at REAL NOT NULL)"
+        )
+
+    def claim(self, message_id: str) -> bool:
+        if not message_id:
+            return True
+        # Wall clock time, monotonic clocks aren't comparable across processes.
+        now = time.time()
+        self.claims += 1
+        if self.claims % self.expire_every == 0:
+            self.connection.execute("DELETE FROM message_claims WHERE claimed_at < ?", (now - self.ttl_seconds,))
+        inserted = self.connection.execute(
+            "INSERT OR IGNORE INTO message_claims (message_id, claimed_at) VALUES (?, ?)", (message_id, now)
+        ).rowcount
+        if not inserted:
+            self.suppressed_duplicates += 1
+            return False
+        self.in_flight.add(message_id)
+        return True
+
+    def complete(self, message_ids: list[str]):
+        for message_id in message_ids:
+            self.in_flight.discard(message_id)
+
+    def close(self):
+        self.connection.close()
+
+    def stats(self) -> dict:
+        (seen,) = self.connection.execute("SELECT COUNT(*) FROM message_claims").fetchone()
+        return {
+            "in_flight": len(self.in_flight),
+            "seen": seen,
+            "suppressed_duplicates": self.suppressed_duplicates
+        }
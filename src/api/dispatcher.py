@@ -0,0 +1,134 @@
+"""
+Consistent-hash front dispatcher for running several API workers.
+It starts the workers on local ports and proxies every request to one of them, pinning each
+phone number to the same worker so its conversation queue, debounce window and in-process
+caches keep working. Workers share the SQLite session store, so a worker restart or a
+change in the worker count only moves conversations, it doesn't lose them.
+
+    python -m src.api.dispatcher --workers 4 --port 8000
+"""
+import argparse
+import bisect
+import hashlib
+import itertools
+import os
+import subprocess
+import sys
+import time
+from urllib.parse import parse_qs
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "upgrade", "host", "content-length"}
+
+def ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+class HashRing:
+    """Consistent hash ring with virtual nodes, adding a node only moves about 1/N of the keys."""
+
+    def __init__(self, nodes: list[str], replicas: int = 100):
+        self.points = sorted((ring_hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self.hashes = [point for point, _ in self.points]
+
+    def node(self, key: str) -> str:
+        index = bisect.bisect(self.hashes, ring_hash(key)) % len(self.points)
+        return self.points[index][1]
+
+def routing_key(request: Request, body: bytes) -> str | None:
+    """The phone number a request belongs to, if any."""
+    if request.url.path == "/webhook/incoming":
+        sender = parse_qs(body.decode("utf-8", errors="replace")).get("From", [""])[0]
+        return sender.replace("whatsapp:", "") or None
+    if "phone_number" in request.query_params:
+        return request.query_params["phone_number"]
+    if request.url.path.startswith("/api/sessions/"):
+        return request.url.path.rsplit("/", 1)[-1]
+    return None
+
+def create_app(worker_urls: list[str]) -> FastAPI:
+    app = FastAPI(title="Kavak WhatsApp Bot Dispatcher")
+    ring = HashRing(worker_urls)
+    round_robin = itertools.cycle(worker_urls)
+    clients = {
+        url: httpx.AsyncClient(base_url=url, timeout=httpx.Timeout(120.0, connect=5.0))
+        for url in worker_urls
+    }
+
+    @app.on_event("shutdown")
+    async def close_clients():
+        for client in clients.values():
+            await client.aclose()
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+    async def proxy(request: Request, path: str):
+        body = await request.body()
+        key = routing_key(request, body)
+        worker_url = ring.node(key) if key else next(round_robin)
+
+        headers = {name: value for name, value in request.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS}
+        # Workers rebuild the public URL from these to validate Twilio signatures.
+        headers.setdefault("x-forwarded-host", request.url.hostname or "")
+
+        client = clients[worker_url]
+        upstream = await client.send(
+            client.build_request(request.method, f"/{path}", params=request.query_params, headers=headers, content=body),
+            stream=True
+        )
+        response_headers = {
+            name: value for name, value in upstream.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS
+        }
+        # Streamed through so the SSE endpoint keeps working behind the dispatcher.
+        return StreamingResponse(
+            upstream.aiter_raw(),
+            status_code=upstream.status_code,
+            headers=response_headers,
+            background=BackgroundTask(upstream.aclose)
+        )
+
+    return app
+
+def start_workers(count: int, base_port: int) -> list[subprocess.Popen]:
+    """Start the API workers, sharing the SQLite session store unless configured otherwise."""
+    env = dict(os.environ)
+    env.setdefault("SESSION_BACKEND", "sqlite")
+    return [
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "src.api.main:app", "--host", "127.0.0.1", "--port", str(base_port + i)],
+            env=env
+        )
+        for i in range(count)
+    ]
+
+def stop_workers(workers: list[subprocess.Popen], timeout: float = 10):
+    for worker in workers:
+        worker.terminate()
+    deadline = time.monotonic() + timeout
+    for worker in workers:
+        try:
+            worker.wait(max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            worker.kill()
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Run several API workers behind a phone number pinning dispatcher")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--worker-base-port", type=int, default=8100)
+    args = parser.parse_args(argv)
+
+    workers = start_workers(args.workers, args.worker_base_port)
+    worker_urls = [f"http://127.0.0.1:{args.worker_base_port + i}" for i in range(args.workers)]
+    print(f"Dispatching to {args.workers} workers: {', '.join(worker_urls)}")
+    try:
+        uvicorn.run(create_app(worker_urls), host=args.host, port=args.port)
+    finally:
+        stop_workers(workers)
+
+if __name__ == "__main__":
+    main()
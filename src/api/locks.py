@@ -0,0 +1,72 @@
+"""
+Per-conversation locks across worker processes.
+When several workers share the session database, two messages of one user can reach
+different workers, so each turn holds its phone number's lock while it reads, runs and
+writes back the session.
+"""
+import asyncio
+import errno
+import fcntl
+import hashlib
+import os
+import time
+from contextlib import asynccontextmanager
+
+class PhoneLocks:
+    """Phone number locks shared by the worker processes of one host.
+
+    Phone numbers are hashed onto single byte ranges of a lock file locked with fcntl, so
+    the OS releases them if a worker dies. Record locks belong to the whole process, so
+    coroutines of the same process are serialized per slot with an asyncio.Lock first.
+    """
+
+    def __init__(self, path: str, slots: int = 4096, poll_seconds: float = 0.02):
+        self.path = path
+        self.slots = slots
+        self.poll_seconds = poll_seconds
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.local_locks: dict[int, asyncio.Lock] = {}
+        self.acquired = 0
+        self.contended = 0
+        self.wait_seconds = 0.0
+
+    def slot(self, phone_number: str) -> int:
+        digest = hashlib.blake2b(phone_number.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") % self.slots
+
+    def _try_lock(self, slot: int) -> bool:
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, slot)
+            return True
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            return False
+
+    @asynccontextmanager
+    async def hold(self, phone_number: str):
+        """Hold the phone number's lock, polling without blocking the event loop."""
+        slot = self.slot(phone_number)
+        local_lock = self.local_locks.setdefault(slot, asyncio.Lock())
+        started = time.monotonic()
+        async with local_lock:
+            if not self._try_lock(slot):
+                self.contended += 1
+                while not self._try_lock(slot):
+                    await asyncio.sleep(self.poll_seconds)
+            self.acquired += 1
+            self.wait_seconds += time.monotonic() - started
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, slot)
+
+    def close(self):
+        os.close(self.fd)
+
+    def stats(self) -> dict:
+        return {
+            "acquired": self.acquired,
+            "contended": self.contended,
+            "wait_seconds": round(self.wait_seconds, 3)
+        }
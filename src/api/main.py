@@ -2,15 +2,34 @@
 WhatsApp API integration for the Kavak Bot.
 This module provides API endpoints to integrate the Kavak Bot with WhatsApp using Twilio's API.
 """
-from agents import Runner
-from typing import Dict
-from fastapi import FastAPI, Request, Response, Depends, HTTPException, BackgroundTasks
+import asyncio
+import json
+from contextlib import nullcontext
+from agents import add_trace_processor, custom_span, trace
+from fastapi import FastAPI, Request, Response, Depends, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
-from twilio.rest import Client
 from twilio.request_validator import RequestValidator
 from src.bot.main import (
-    triage_agent
+    TRIAGE_AGENT_NAME,
+    warm_up,
+    refresh_bot,
+    collect_stale_stores,
+    is_ready,
+    car_inventory,
+    reload_inventory,
+    llm_scheduler,
+    intent_router,
+    TurnOutcome,
+    run_turn,
+    turn_events
 )
+from src.api.conversation_queue import ConversationQueue
+from src.api.dedupe import MessageDeduplicator, SQLiteMessageDeduplicator
+from src.api.outbound import OutboundDispatcher, TwilioTransport, LocalTransport
+from src.api.locks import PhoneLocks
+from src.api.sessions import SessionStore, SQLiteSessionStore
+from src.api.telemetry import Metrics, TurnTracer
 from src.api.models import (
     Settings,
     Message,
@@ -22,93 +41,315 @@ load_dotenv()
 
 settings = Settings()
 
-twilio_client = None
-if settings.twilio_account_sid and settings.twilio_auth_token:
-    twilio_client = Client(settings.twilio_account_sid, settings.twilio_auth_token)
+if settings.outbound_transport == "local":
+    outbound_transport = LocalTransport()
+else:
+    outbound_transport = TwilioTransport(
+        settings.twilio_account_sid,
+        settings.twilio_auth_token,
+        settings.twilio_phone_number
+    )
+
+outbound_dispatcher = OutboundDispatcher(
+    outbound_transport,
+    workers=settings.outbound_workers,
+    max_retries=settings.outbound_max_retries
+)
 
 app = FastAPI(title="Kavak WhatsApp Bot API")
 
-conversation_sessions: Dict[str, Dict] = {}
-    
+metrics = Metrics()
+
+turn_tracer = TurnTracer(
+    metrics,
+    slow_trace_path=settings.slow_trace_path,
+    slow_trace_seconds=settings.slow_trace_seconds,
+    slow_trace_sample_rate=settings.slow_trace_sample_rate
+)
+add_trace_processor(turn_tracer)
+
+if settings.session_backend == "sqlite":
+    session_store = SQLiteSessionStore(
+        settings.session_db_path,
+        default_agent=TRIAGE_AGENT_NAME,
+        ttl_seconds=settings.session_ttl_seconds,
+        max_sessions=settings.max_sessions,
+        sweep_interval_seconds=settings.session_sweep_interval_seconds
+    )
+    phone_locks = PhoneLocks(f"{settings.session_db_path}.lock")
+else:
+    session_store = SessionStore(
+        default_agent=TRIAGE_AGENT_NAME,
+        ttl_seconds=settings.session_ttl_seconds,
+        max_sessions=settings.max_sessions,
+        compress_after_seconds=settings.session_compress_after_seconds,
+        sweep_interval_seconds=settings.session_sweep_interval_seconds
+    )
+    phone_locks = None
+
 def validate_twilio_request(request_data, signature, url):
     """Validate that the request is coming from Twilio."""
     validator = RequestValidator(settings.twilio_auth_token)
     return validator.validate(url, request_data, signature)
 
-def get_or_create_conversation_session(phone_number: str):
+def conversation_lock(phone_number: str):
+    """Serialize the turns of a conversation across workers, only needed with a shared store."""
+    if phone_locks is None:
+        return nullcontext()
+    return phone_locks.hold(phone_number)
+
+async def run_store_call(method, *args):
+    """Shared store calls can wait on other workers' writes, so they run in a thread."""
+    if session_store.blocking:
+        return await asyncio.to_thread(method, *args)
+    return method(*args)
+
+async def get_or_create_conversation_session(phone_number: str):
     """Get or create a conversation session for a specific phone number."""
-    if phone_number not in conversation_sessions:
-        conversation_sessions[phone_number] = {
-            "conversation_history": [],
-            "last_agent": triage_agent,
-            "context": {}
-        }
-    return conversation_sessions[phone_number]
+    return await run_store_call(session_store.get_or_create, phone_number)
 
 async def process_message(phone_number: str, message_content: str):
     """Process a message using the bot and return a response."""
-    session = get_or_create_conversation_session(phone_number)
-    
-    session["conversation_history"].append({"content": message_content, "role": "user"})
+    session = await get_or_create_conversation_session(phone_number)
     
     try:
-        result = await Runner.run(
-            session["last_agent"], 
-            input=session["conversation_history"],
-            context=session["context"]
+        bot = await warm_up()
+        outcome = await run_turn(
+            bot,
+            bot.agent(session["last_agent"]),
+            session["conversation_history"],
+            message_content,
+            session["context"],
+            conversation_id=phone_number
         )
+        await commit_turn(phone_number, session, outcome)
         
-        if result.final_output.needsTriage:
-            print("Transferring to another agent...")
-            session["last_agent"] = triage_agent
-            result = await Runner.run(
-                session["last_agent"],
-                input=session["conversation_history"],
-                context=session["context"]
-            )
-        
-        session["conversation_history"] = result.to_input_list()
-        session["last_agent"] = result.last_agent
-        
-        print("Current agent:", f"{session["last_agent"].name}")
-        
-        if hasattr(result.final_output, "message"):
-            return result.final_output.message
-        return "I'm processing your request but couldn't generate a response."
+        return outcome.message
     
     except Exception as e:
-        if "tripwire" in str(e).lower():
-            return "Sorry, I can't respond to that, please rephrase."
-        return f"An error occurred: {str(e)}"
+        return turn_error_message(e)
 
-async def send_whatsapp_message(to: str, message_content: str):
-    """Send a WhatsApp message using Twilio."""
+async def commit_turn(phone_number: str, session: dict, outcome: TurnOutcome):
+    """Store the agent that answered and the compacted history once a turn is done."""
+    if outcome.reran_triage:
+        metrics.inc("kavak_triage_reruns_total", "Turns re-routed after needsTriage", agent=outcome.triage_requested_by)
+    for decision in outcome.decisions:
+        metrics.inc("kavak_routing_decisions_total", "Turns routed locally or left to triage", route=decision.agent or "triage")
+    
+    session["last_agent"] = outcome.last_agent.name
+    session["conversation_history"] = outcome.history
+    
+    await run_store_call(session_store.save, phone_number, session)
+    
+    print("Current agent:", session["last_agent"])
+
+def turn_error_message(e: Exception) -> str:
+    if "tripwire" in str(e).lower():
+        return "Sorry, I can't respond to that, please rephrase."
+    return f"An error occurred: {str(e)}"
+
+async def stream_message(phone_number: str, message_content: str):
+    """Process a message with streamed agent runs, yielding (event, data) pairs as they arrive.
+    
+    Events are "agent" when an agent takes over, "needs_triage" with the reply's flag, "delta"
+    for reply text, which only follows a "false" flag, "reset" when the text streamed so far
+    is replaced by a re-routed run, then "done" with the full reply or "error" with the error
+    message.
+    """
+    session = await get_or_create_conversation_session(phone_number)
+    
     try:
-        message = twilio_client.messages.create(
-            body=message_content,
-            from_=f"whatsapp:{settings.twilio_phone_number}",
-            to=f"whatsapp:{to}"
-        )
-        return {"status": "sent", "sid": message.sid}
+        bot = await warm_up()
+        async for event, data in turn_events(
+            bot,
+            bot.agent(session["last_agent"]),
+            session["conversation_history"],
+            message_content,
+            session["context"],
+            conversation_id=phone_number,
+            stream=True
+        ):
+            if event == "outcome":
+                await commit_turn(phone_number, session, data)
+                yield "done", data.message
+            else:
+                yield event, data
+    
     except Exception as e:
-        return {"status": "error", "message": str(e)}
+        yield "error", turn_error_message(e)
+
+async def process_message_progressively(phone_number: str, message_content: str) -> str:
+    """Stream a turn, delivering an acknowledgement or the first paragraph before it ends.
+    
+    Returns whatever part of the reply still has to be sent.
+    """
+    delivered = ""
+    
+    async def stream_turn() -> str:
+        nonlocal delivered
+        streamed = ""
+        needs_triage = None
+        async for event, data in stream_message(phone_number, message_content):
+            if event == "reset":
+                streamed = ""
+                needs_triage = None
+            elif event == "needs_triage":
+                needs_triage = data == "true"
+            elif event == "delta" and settings.whatsapp_progressive_mode == "paragraph" and not delivered:
+                # A reply flagged for triage is thrown away, so none of it may reach the user.
+                if needs_triage is not False:
+                    continue
+                streamed += data
+                paragraph, separator, rest = streamed.partition("\n\n")
+                # Only worth an extra message if more text is coming after the paragraph.
+                if separator and rest.strip():
+                    delivered = paragraph.strip()
+                    await send_whatsapp_message(phone_number, delivered)
+            elif event in ("done", "error"):
+                return data
+        return ""
+    
+    turn = asyncio.create_task(stream_turn())
+    
+    if settings.whatsapp_progressive_mode == "ack":
+        done, _ = await asyncio.wait({turn}, timeout=settings.whatsapp_ack_after_seconds)
+        if not done:
+            await send_whatsapp_message(phone_number, settings.whatsapp_ack_message)
+    
+    response_message = await turn
+    # The delivered paragraph was stripped, so the reply is too before comparing them.
+    if delivered and response_message.strip().startswith(delivered):
+        return response_message.strip()[len(delivered):].strip()
+    return response_message
+
+async def send_whatsapp_message(to: str, message_content: str):
+    """Send a WhatsApp message through the outbound delivery pipeline."""
+    return await outbound_dispatcher.send(to, message_content)
     
 async def handle_message(phone_number: str, message_content: str):
     """Handle a message and send the response back via WhatsApp."""
     
-    response_message = await process_message(phone_number, message_content)
+    async with conversation_lock(phone_number):
+        with trace("WhatsApp turn", group_id=phone_number):
+            if settings.whatsapp_progressive_mode == "off":
+                response_message = await process_message(phone_number, message_content)
+            else:
+                response_message = await process_message_progressively(phone_number, message_content)
+            
+            with custom_span("twilio_delivery"):
+                result = await send_whatsapp_message(phone_number, response_message)
     
-    await send_whatsapp_message(phone_number, response_message)
+    metrics.inc("kavak_outbound_messages_total", "Replies handed to the delivery pipeline", status=result["status"])
+
+if settings.session_backend == "sqlite":
+    message_deduplicator = SQLiteMessageDeduplicator(settings.session_db_path, ttl_seconds=settings.message_dedupe_ttl_seconds)
+else:
+    message_deduplicator = MessageDeduplicator(ttl_seconds=settings.message_dedupe_ttl_seconds)
+
+conversation_queue = ConversationQueue(
+    handle_message,
+    debounce_seconds=settings.message_debounce_seconds,
+    on_turn_done=message_deduplicator.complete
+)
+
+metrics.gauge("kavak_conversation_queue_pending_messages", "Messages waiting for their conversation's consumer",
+              lambda: conversation_queue.stats()["pending_messages"])
+metrics.gauge("kavak_conversation_queue_active_conversations", "Conversations with a running consumer",
+              lambda: conversation_queue.stats()["active_conversations"])
+metrics.gauge("kavak_outbound_queued_messages", "Replies waiting for an outbound worker",
+              lambda: outbound_dispatcher.stats()["queued_messages"])
+# Refreshed by the /metrics endpoint before rendering, reading the store can block on SQLite.
+scraped_session_stats: dict = {}
+
+def session_counts() -> dict:
+    return {
+        (("state", "live"),): scraped_session_stats.get("live_sessions", 0),
+        (("state", "compressed"),): scraped_session_stats.get("compressed_sessions", 0)
+    }
+
+metrics.gauge("kavak_sessions", "Conversation sessions in the session store", session_counts)
+metrics.gauge("kavak_dedupe_in_flight_messages", "Webhook message ids being answered",
+              lambda: len(message_deduplicator.in_flight))
+metrics.gauge("kavak_llm_queued_requests", "Model requests waiting for the scheduler", lambda: {
+    (("priority", priority),): count for priority, count in llm_scheduler.stats()["queued"].items()
+})
+metrics.gauge("kavak_llm_in_flight_requests", "Model requests in progress", lambda: llm_scheduler.in_flight)
+metrics.gauge("kavak_llm_concurrency_limit", "Current adaptive limit of concurrent model requests", lambda: llm_scheduler.limit)
+metrics.gauge("kavak_llm_rate_limited_total", "Model requests that got a 429", lambda: llm_scheduler.rate_limited)
+llm_scheduler.on_wait = lambda priority, seconds: metrics.observe(
+    "kavak_llm_queue_seconds", "Time model requests waited in the scheduler", seconds, priority=priority.name.lower()
+)
+metrics.gauge("kavak_bot_ready", "Whether the bot's stores and agents are built", lambda: int(is_ready()))
+
+bot_tasks: list[asyncio.Task] = []
+bot_warm_up_error: str | None = None
+
+async def warm_up_bot():
+    """Build the bot in the background so the server starts answering right away."""
+    global bot_warm_up_error
+    try:
+        await warm_up()
+        bot_warm_up_error = None
+        print("Bot is ready")
+    except Exception as e:
+        bot_warm_up_error = str(e)
+        print(f"Bot warmup failed, it will be retried on the next message: {e}")
+
+async def refresh_bot_periodically():
+    """Rebuild the bot's stores and index, swapping them in without dropping traffic."""
+    while True:
+        await asyncio.sleep(settings.bot_refresh_interval_seconds)
+        try:
+            await refresh_bot()
+            print("Bot resources refreshed")
+            await asyncio.sleep(settings.stale_store_grace_seconds)
+            await collect_stale_stores()
+        except Exception as e:
+            print(f"Bot refresh failed, keeping the current resources: {e}")
+
+async def watch_inventory():
+    """Apply stock snapshots dropped in place of the current one."""
+    while True:
+        await asyncio.sleep(settings.inventory_watch_interval_seconds)
+        if not car_inventory.changed_on_disk():
+            continue
+        try:
+            if await reload_inventory():
+                # Turns in flight may still search the replaced car stock store.
+                await asyncio.sleep(settings.stale_store_grace_seconds)
+                await collect_stale_stores()
+        except Exception as e:
+            print(f"Inventory reload failed, keeping version {car_inventory.version}: {e}")
+
+@app.on_event("startup")
+async def start_background_workers():
+    session_store.start()
+    outbound_dispatcher.start()
+    bot_tasks.append(asyncio.create_task(warm_up_bot()))
+    if settings.bot_refresh_interval_seconds > 0:
+        bot_tasks.append(asyncio.create_task(refresh_bot_periodically()))
+    if settings.inventory_watch_interval_seconds > 0:
+        bot_tasks.append(asyncio.create_task(watch_inventory()))
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    for task in bot_tasks:
+        task.cancel()
+    await asyncio.gather(*bot_tasks, return_exceptions=True)
+    await conversation_queue.close()
+    await session_store.stop()
+    await outbound_dispatcher.stop()
+    if phone_locks is not None:
+        phone_locks.close()
+    if isinstance(message_deduplicator, SQLiteMessageDeduplicator):
+        message_deduplicator.close()
 
 """
 Webhook endpoints needed for Twilio integration
 """
 
 @app.post("/webhook/incoming")
-async def incoming_message(
-    request: Request,
-    background_tasks: BackgroundTasks
-):
+async def incoming_message(request: Request):
     """Webhook endpoint for incoming WhatsApp messages from Twilio."""
     form_data = await request.form()
     form_dict = dict(form_data)
@@ -130,10 +371,14 @@ async def incoming_message(
         SmsMessageSid=form_dict.get("SmsMessageSid", "")
     )
     
-    background_tasks.add_task(
-        handle_message,
+    if not await run_store_call(message_deduplicator.claim, whatsapp_message.SmsMessageSid):
+        print(f"Ignoring retried delivery of {whatsapp_message.SmsMessageSid}")
+        return Response(status_code=200)
+    
+    conversation_queue.submit(
         whatsapp_message.From.replace("whatsapp:", ""),
-        whatsapp_message.Body
+        whatsapp_message.Body,
+        whatsapp_message.SmsMessageSid
     )
     
     return Response(status_code=200)
@@ -158,6 +403,36 @@ Debugging endpoints ToDo: secure these ones later
 async def health():
     return {"status": "ok"}
 
+@app.get("/api/ready")
+async def ready():
+    """Readiness probe, only ok once the bot's stores and agents are built."""
+    if is_ready():
+        return {"status": "ready"}
+    return JSONResponse(
+        status_code=503,
+        content={"status": "warming_up", "error": bot_warm_up_error}
+    )
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint."""
+    scraped_session_stats.update(await run_store_call(session_store.stats))
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/inventory")
+async def get_inventory():
+    """API endpoint to get the car inventory version currently served."""
+    return {"version": car_inventory.version, "cars": len(car_inventory.index), "path": car_inventory.path}
+
+@app.post("/api/inventory/reload")
+async def reload_inventory_snapshot():
+    """API endpoint to apply the stock snapshot on disk right away."""
+    try:
+        diff = await reload_inventory()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Inventory reload failed: {e}")
+    return {"version": car_inventory.version, **diff.summary()}
+
 @app.post("/api/send")
 async def send_message(message: WhatsAppOutgoingMessage):
     """API endpoint to send a WhatsApp message programmatically."""
@@ -168,27 +443,57 @@ async def send_message(message: WhatsAppOutgoingMessage):
 async def get_sessions():
     """API endpoint to get all active conversation sessions (for debugging/admin)."""
     return {
-        phone: {
-            "message_count": len(session["conversation_history"]),
-            "last_agent": session["last_agent"].name
-        }
-        for phone, session in conversation_sessions.items()
+        "sessions": await run_store_call(session_store.summaries),
+        "stats": await run_store_call(session_store.stats),
+        "queue": conversation_queue.stats(),
+        "outbound": outbound_dispatcher.stats(),
+        "dedupe": await run_store_call(message_deduplicator.stats),
+        "locks": phone_locks.stats() if phone_locks is not None else None,
+        "llm_scheduler": llm_scheduler.stats(),
+        "router": intent_router.stats()
     }
 
 @app.delete("/api/sessions/{phone_number}")
 async def delete_session(phone_number: str):
     """API endpoint to delete a session"""
-    if phone_number in conversation_sessions:
-        del conversation_sessions[phone_number]
+    if await run_store_call(session_store.delete, phone_number):
         return {"status": "deleted"}
     raise HTTPException(status_code=404, detail="Session not found")
 
 @app.post("/api/direct/message")
 async def direct_message(message: Message, phone_number: str):
     """API endpoint for direct messaging without going through Twilio (for testing)."""
-    response_message = await process_message(phone_number, message.content)
+    async with conversation_lock(phone_number):
+        with trace("Direct message turn", group_id=phone_number):
+            response_message = await process_message(phone_number, message.content)
     return {"response": response_message}
 
+@app.post("/api/direct/message/stream")
+async def direct_message_stream(message: Message, phone_number: str):
+    """Server-sent events variant of /api/direct/message, streaming the reply as it is generated.
+    
+    Text is only sent once the input passed the guardrails and the reply isn't flagged for triage.
+    """
+    async def events():
+        async with conversation_lock(phone_number):
+            with trace("Direct message turn", group_id=phone_number):
+                async for event, data in stream_message(phone_number, message.content):
+                    if event == "agent":
+                        payload = {"agent": data}
+                    elif event == "needs_triage":
+                        payload = {"needs_triage": data == "true"}
+                    elif event == "delta":
+                        payload = {"text": data}
+                    elif event == "done":
+                        payload = {"response": data}
+                    elif event == "error":
+                        payload = {"message": data}
+                    else:
+                        payload = {}
+                    yield f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    
+    return StreamingResponse(events(), media_type="text/event-stream")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("src.api:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings
 from pydantic import BaseModel
-from typing import Optional
+from typing import Literal, Optional
 
 class Settings(BaseSettings):
     openai_api_key: str
@@ -9,6 +9,26 @@ class Settings(BaseSettings):
     twilio_auth_token: Optional[str] = None
     twilio_phone_number: Optional[str] = None
     webhook_url: Optional[str] = None
+    message_debounce_seconds: float = 1.5
+    session_ttl_seconds: float = 86400
+    max_sessions: int = 10000
+    session_compress_after_seconds: float = 300
+    session_sweep_interval_seconds: float = 60
+    session_backend: Literal["memory", "sqlite"] = "memory"
+    session_db_path: str = "resources/sessions.db"
+    outbound_transport: Literal["twilio", "local"] = "twilio"
+    outbound_workers: int = 4
+    outbound_max_retries: int = 3
+    message_dedupe_ttl_seconds: float = 3600
+    bot_refresh_interval_seconds: float = 21600
+    stale_store_grace_seconds: float = 600
+    inventory_watch_interval_seconds: float = 60
+    slow_trace_path: str = "slow_traces.jsonl"
+    slow_trace_seconds: float = 10
+    slow_trace_sample_rate: float = 1.0
+    whatsapp_progressive_mode: Literal["off", "ack", "paragraph"] = "off"
+    whatsapp_ack_after_seconds: float = 4
+    whatsapp_ack_message: str = "Dame un momento, estoy revisando tu solicitud..."
 
 class Message(BaseModel):
     content: str
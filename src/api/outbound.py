@@ -0,0 +1,204 @@
+"""
+Outbound WhatsApp delivery pipeline.
+Replies are split into WhatsApp sized segments and put on an async queue drained by a
+bounded pool of workers sharing a pooled HTTP client, with retries on 429/5xx and on
+requests that never reached Twilio.
+"""
+import asyncio
+import random
+import time
+from typing import Optional
+import httpx
+
+TWILIO_API_URL = "https://api.twilio.com/2010-04-01"
+MAX_SEGMENT_LENGTH = 1600
+
+class DeliveryError(Exception):
+    """A failed delivery attempt, retryable on throttling, server errors and requests that never left."""
+
+    def __init__(
+        self,
+        message: str,
+        status_code: Optional[int] = None,
+        retry_after: Optional[float] = None,
+        request_sent: bool = True
+    ):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.request_sent = request_sent
+
+    @property
+    def retryable(self) -> bool:
+        if self.status_code is None:
+            # Without a response, e.g. on a read timeout, Twilio may already have accepted the message.
+            return not self.request_sent
+        return self.status_code == 429 or self.status_code >= 500
+
+def split_message(text: str, limit: int = MAX_SEGMENT_LENGTH) -> list[str]:
+    """Split a reply into segments under the limit, preferring paragraph, line and word breaks."""
+    segments = []
+    text = text.strip()
+    while len(text) > limit:
+        window = text[:limit]
+        cut = max(window.rfind("\n\n"), window.rfind("\n"), window.rfind(". "), window.rfind(" "))
+        if cut <= limit // 2:
+            cut = limit
+        segments.append(text[:cut].strip())
+        text = text[cut:].strip()
+    if text:
+        segments.append(text)
+    return segments
+
+class TwilioTransport:
+    """Sends messages through Twilio's REST API over a pooled async HTTP client."""
+
+    def __init__(self, account_sid: Optional[str], auth_token: Optional[str], from_number: Optional[str], max_connections: int = 20):
+        self.account_sid = account_sid
+        self.from_number = from_number
+        self.client = httpx.AsyncClient(
+            base_url=TWILIO_API_URL,
+            auth=(account_sid or "", auth_token or ""),
+            timeout=httpx.Timeout(15.0, connect=5.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+        self.configured = bool(account_sid and auth_token and from_number)
+
+    async def send(self, to: str, body: str) -> str:
+        if not self.configured:
+            raise DeliveryError("Twilio credentials are not configured", status_code=400)
+        try:
+            response = await self.client.post(
+                f"/Accounts/{self.account_sid}/Messages.json",
+                data={"From": f"whatsapp:{self.from_number}", "To": f"whatsapp:{to}", "Body": body}
+            )
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            raise DeliveryError(f"Could not reach Twilio: {e!r}", request_sent=False)
+        except httpx.HTTPError as e:
+            raise DeliveryError(f"Twilio request failed: {e!r}")
+
+        if response.status_code >= 400:
+            retry_after = response.headers.get("Retry-After")
+            raise DeliveryError(
+                f"Twilio returned {response.status_code}: {response.text[:200]}",
+                status_code=response.status_code,
+                retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None
+            )
+        return response.json()["sid"]
+
+    async def close(self):
+        await self.client.aclose()
+
+class LocalTransport:
+    """Stand-in for Twilio that records messages, for load tests and local development."""
+
+    def __init__(self, latency_seconds: float = 0.05, failure_rate: float = 0.0, failure_status: int = 503):
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.sent: list[dict] = []
+
+    async def send(self, to: str, body: str) -> str:
+        await asyncio.sleep(self.latency_seconds)
+        if random.random() < self.failure_rate:
+            raise DeliveryError("Simulated failure", status_code=self.failure_status)
+        sid = f"SMlocal{len(self.sent):08d}"
+        self.sent.append({"sid": sid, "to": to, "body": body, "sent_at": time.time()})
+        return sid
+
+    async def close(self):
+        pass
+
+class OutboundDispatcher:
+    """Async delivery queue drained by a bounded worker pool."""
+
+    def __init__(
+        self,
+        transport,
+        workers: int = 4,
+        max_retries: int = 3,
+        backoff_seconds: float = 0.5,
+        max_segment_length: int = MAX_SEGMENT_LENGTH,
+        queue_size: int = 1000
+    ):
+        self.transport = transport
+        self.worker_count = workers
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_segment_length = max_segment_length
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.workers: list[asyncio.Task] = []
+        self.delivered_segments = 0
+        self.failed_messages = 0
+        self.retries = 0
+
+    def start(self):
+        if not self.workers:
+            self.workers = [asyncio.create_task(self._work()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        """Stop the workers, failing anything still queued, and close the transport."""
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        while not self.queue.empty():
+            _, _, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_result({"status": "error", "message": "Delivery pipeline stopped"})
+        await self.transport.close()
+
+    def submit(self, to: str, message_content: str) -> asyncio.Future:
+        """Queue a message for delivery, the future resolves with the delivery result."""
+        future = asyncio.get_running_loop().create_future()
+        segments = split_message(message_content, self.max_segment_length)
+        try:
+            self.queue.put_nowait((to, segments, future))
+        except asyncio.QueueFull:
+            self.failed_messages += 1
+            future.set_result({"status": "error", "message": "Outbound queue is full"})
+        return future
+
+    async def send(self, to: str, message_content: str) -> dict:
+        return await self.submit(to, message_content)
+
+    async def _work(self):
+        while True:
+            to, segments, future = await self.queue.get()
+            try:
+                result = await self._deliver(to, segments)
+            except Exception as e:
+                result = {"status": "error", "message": str(e)}
+            if result["status"] == "error":
+                self.failed_messages += 1
+            if not future.done():
+                future.set_result(result)
+            self.queue.task_done()
+
+    async def _deliver(self, to: str, segments: list[str]) -> dict:
+        """Send segments in order, stopping at the first one that can't be delivered."""
+        sids = []
+        for segment in segments:
+            attempt = 0
+            while True:
+                try:
+                    sids.append(await self.transport.send(to, segment))
+                    self.delivered_segments += 1
+                    break
+                except DeliveryError as e:
+                    if not e.retryable or attempt >= self.max_retries:
+                        return {"status": "error", "message": str(e), "sids": sids}
+                    delay = e.retry_after or self.backoff_seconds * 2 ** attempt * (1 + random.random())
+                    attempt += 1
+                    self.retries += 1
+                    await asyncio.sleep(delay)
+        return {"status": "sent", "sid": sids[0] if sids else None, "sids": sids}
+
+    def stats(self) -> dict:
+        return {
+            "queued_messages": self.queue.qsize(),
+            "workers": len(self.workers),
+            "delivered_segments": self.delivered_segments,
+            "failed_messages": self.failed_messages,
+            "retries": self.retries
+        }
@@ -0,0 +1,286 @@
+"""
+Bounded conversation session store.
+Sessions expire after an idle TTL, the least recently used ones are evicted past a
+maximum count, and idle sessions are kept as compressed serialized bytes.
+The SQLite variant keeps them in a database shared by several worker processes instead.
+"""
+import asyncio
+import json
+import sqlite3
+import time
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+class SessionStore:
+    """LRU + TTL bounded store of conversation sessions keyed by phone number."""
+
+    # Whether calls may block on I/O, in which case async callers run them in a thread.
+    blocking = False
+
+    def __init__(
+        self,
+        default_agent: str,
+        ttl_seconds: float = 86400,
+        max_sessions: int = 10000,
+        compress_after_seconds: float = 300,
+        sweep_interval_seconds: float = 60
+    ):
+        self.default_agent = default_agent
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.compress_after_seconds = compress_after_seconds
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self.entries: OrderedDict[str, dict] = OrderedDict()
+        self.sweeper: Optional[asyncio.Task] = None
+        self.ttl_evictions = 0
+        self.lru_evictions = 0
+        self.compressions = 0
+        # Serialized size of the live histories, kept up to date on save, delete and compression.
+        self.live_history_bytes = 0
+
+    def new_session(self) -> dict:
+        """Sessions refer to their last agent by name, so they outlive bot refreshes."""
+        return {
+            "conversation_history": [],
+            "last_agent": self.default_agent,
+            "context": {}
+        }
+
+    def serialize(self, session: dict) -> bytes:
+        payload = {
+            "conversation_history": session["conversation_history"],
+            "last_agent": session["last_agent"],
+            "context": session["context"]
+        }
+        return zlib.compress(json.dumps(payload, default=str).encode("utf-8"))
+
+    def deserialize(self, blob: bytes) -> dict:
+        payload = json.loads(zlib.decompress(blob))
+        return {
+            "conversation_history": payload["conversation_history"],
+            "last_agent": payload["last_agent"],
+            "context": payload["context"]
+        }
+
+    def get_or_create(self, phone_number: str) -> dict:
+        """Get or create the session for a phone number, inflating it if it was idle."""
+        entry = self.entries.get(phone_number)
+        if entry is not None and time.monotonic() - entry["last_seen"] > self.ttl_seconds:
+            self.delete(phone_number)
+            self.ttl_evictions += 1
+            entry = None
+
+        if entry is None:
+            return self.save(phone_number, self.new_session())
+
+        if entry["session"] is None:
+            entry["session"] = self.deserialize(entry["compressed"])
+            entry["compressed"] = None
+            self.live_history_bytes += entry["history_bytes"]
+
+        entry["last_seen"] = time.monotonic()
+        self.entries.move_to_end(phone_number)
+        return entry["session"]
+
+    def save(self, phone_number: str, session: dict) -> dict:
+        """Store a session as the live version, e.g. after a turn updated it."""
+        self.forget(self.entries.get(phone_number))
+        history_bytes = len(json.dumps(session["conversation_history"], default=str))
+        self.entries[phone_number] = {
+            "session": session,
+            "compressed": None,
+            "last_seen": time.monotonic(),
+            "history_bytes": history_bytes
+        }
+        self.live_history_bytes += history_bytes
+        self.entries.move_to_end(phone_number)
+
+        while len(self.entries) > self.max_sessions:
+            _, evicted = self.entries.popitem(last=False)
+            self.forget(evicted)
+            self.lru_evictions += 1
+        return session
+
+    def delete(self, phone_number: str) -> bool:
+        entry = self.entries.pop(phone_number, None)
+        self.forget(entry)
+        return entry is not None
+
+    def forget(self, entry: dict | None):
+        """Take an entry that is being replaced or dropped out of the live history bytes."""
+        if entry is not None and entry["session"] is not None:
+            self.live_history_bytes -= entry["history_bytes"]
+
+    def sweep(self):
+        """Drop expired sessions and compress the ones that went idle."""
+        now = time.monotonic()
+        for phone_number, entry in list(self.entries.items()):
+            idle = now - entry["last_seen"]
+            if idle > self.ttl_seconds:
+                self.delete(phone_number)
+                self.ttl_evictions += 1
+            elif idle > self.compress_after_seconds and entry["session"] is not None:
+                entry["compressed"] = self.serialize(entry["session"])
+                self.forget(entry)
+                entry["session"] = None
+                self.compressions += 1
+
+    async def _sweep_periodically(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval_seconds)
+            try:
+                if self.blocking:
+                    await asyncio.to_thread(self.sweep)
+                else:
+                    self.sweep()
+            except Exception as e:
+                print(f"Error sweeping sessions: {e}")
+
+    def start(self):
+        if self.sweeper is None:
+            self.sweeper = asyncio.create_task(self._sweep_periodically())
+
+    async def stop(self):
+        if self.sweeper is not None:
+            self.sweeper.cancel()
+            await asyncio.gather(self.sweeper, return_exceptions=True)
+            self.sweeper = None
+
+    def summaries(self) -> dict:
+        """Message count and last agent of every session, leaving idle ones compressed."""
+        summaries = {}
+        for phone_number, entry in self.entries.items():
+            if entry["session"] is not None:
+                session = entry["session"]
+                summaries[phone_number] = {
+                    "message_count": len(session["conversation_history"]),
+                    "last_agent": session["last_agent"],
+                    "compressed": False
+                }
+            else:
+                payload = json.loads(zlib.decompress(entry["compressed"]))
+                summaries[phone_number] = {
+                    "message_count": len(payload["conversation_history"]),
+                    "last_agent": payload["last_agent"],
+                    "compressed": True
+                }
+        return summaries
+
+    def stats(self) -> dict:
+        """Cheap counters, safe to read on every metrics scrape."""
+        compressed = [entry["compressed"] for entry in self.entries.values() if entry["session"] is None]
+        return {
+            "sessions": len(self.entries),
+            "live_sessions": len(self.entries) - len(compressed),
+            "compressed_sessions": len(compressed),
+            "compressed_bytes": sum(len(blob) for blob in compressed),
+            "live_history_bytes": self.live_history_bytes,
+            "ttl_evictions": self.ttl_evictions,
+            "lru_evictions": self.lru_evictions,
+            "compressions": self.compressions
+        }
+
+class SQLiteSessionStore(SessionStore):
+    """Session store shared by worker processes through a SQLite database in WAL mode.
+
+    Nothing is cached in memory, every turn reads and writes its row, so consecutive messages
+    of a conversation can be answered by different workers. Turns of one phone number must
+    be serialized by the caller, see PhoneLocks. Writes can wait on other workers, so the
+    store is marked as blocking.
+    """
+
+    blocking = True
+
+    def __init__(
+        self,
+        path: str,
+        default_agent: str,
+        ttl_seconds: float = 86400,
+        max_sessions: int = 10000,
+        sweep_interval_seconds: float = 60,
+        busy_timeout_seconds: float = 5
+    ):
+        super().__init__(
+            default_agent,
+            ttl_seconds=ttl_seconds,
+            max_sessions=max_sessions,
+            sweep_interval_seconds=sweep_interval_seconds
+        )
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=busy_timeout_seconds, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "phone_number TEXT PRIMARY KEY, last_agent TEXT NOT NULL, history BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+
+    def get_or_create(self, phone_number: str) -> dict:
+        row = self.connection.execute(
+            "SELECT history, updated_at FROM sessions WHERE phone_number = ?", (phone_number,)
+        ).fetchone()
+        # Wall clock time, monotonic clocks aren't comparable across processes.
+        if row is not None and time.time() - row[1] > self.ttl_seconds:
+            self.delete(phone_number)
+            self.ttl_evictions += 1
+            row = None
+
+        if row is None:
+            return self.save(phone_number, self.new_session())
+        return self.deserialize(row[0])
+
+    def save(self, phone_number: str, session: dict) -> dict:
+        self.connection.execute(
+            "INSERT INTO sessions (phone_number, last_agent, history, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (phone_number) DO UPDATE SET "
+            "last_agent = excluded.last_agent, history = excluded.history, updated_at = excluded.updated_at",
+            (phone_number, session["last_agent"], self.serialize(session), time.time())
+        )
+        return session
+
+    def delete(self, phone_number: str) -> bool:
+        return self.connection.execute("DELETE FROM sessions WHERE phone_number = ?", (phone_number,)).rowcount > 0
+
+    def sweep(self):
+        """Drop expired sessions and the least recently used ones past max_sessions."""
+        self.ttl_evictions += self.connection.execute(
+            "DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl_seconds,)
+        ).rowcount
+        self.lru_evictions += self.connection.execute(
+            "DELETE FROM sessions WHERE phone_number IN "
+            "(SELECT phone_number FROM sessions ORDER BY updated_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,)
+        ).rowcount
+
+    async def stop(self):
+        await super().stop()
+        self.connection.close()
+
+    def summaries(self) -> dict:
+        return {
+            phone_number: {
+                "message_count": len(self.deserialize(history)["conversation_history"]),
+                "last_agent": last_agent,
+                "compressed": True
+            }
+            for phone_number, last_agent, history in self.connection.execute(
+                "SELECT phone_number, last_agent, history FROM sessions ORDER BY updated_at"
+            )
+        }
+
+    def stats(self) -> dict:
+        count, stored_bytes = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(history)), 0) FROM sessions"
+        ).fetchone()
+        return {
+            "sessions": count,
+            "live_sessions": 0,
+            "compressed_sessions": count,
+            "compressed_bytes": stored_bytes,
+            "live_history_bytes": 0,
+            "ttl_evictions": self.ttl_evictions,
+            "lru_evictions": self.lru_evictions,
+            "compressions": self.compressions
+        }
@@ -0,0 +1,213 @@
+"""
+Turn level instrumentation.
+A tracing processor registered with the Agents SDK times every span of a conversation turn
+(agent runs, guardrails, handoffs, tool calls, model responses and our own custom stages
+such as the Twilio delivery), counts tokens per agent and writes a sample of slow turns to
+a JSON lines file. Everything is exported in the Prometheus text format.
+"""
+import json
+import random
+import threading
+import time
+from typing import Callable, Dict, Tuple
+from agents import TracingProcessor
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels: Labels, **extra) -> str:
+    pairs = [f'{key}="{escape_label(value)}"' for key, value in (*labels, *extra.items())]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metrics:
+    """Minimal thread-safe registry of counters, histograms and callback gauges."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.help: Dict[str, Tuple[str, str]] = {}
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, list]] = {}
+        self.gauges: Dict[str, Callable[[], Dict[Labels, float]]] = {}
+
+    def inc(self, metric: str, help_text: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.help.setdefault(metric, ("counter", help_text))
+            series = self.counters.setdefault(metric, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, metric: str, help_text: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.help.setdefault(metric, ("histogram", help_text))
+            series = self.histograms.setdefault(metric, {})
+            # Per-bucket counts followed by the sum and the total count.
+            state = series.setdefault(key, [0] * len(LATENCY_BUCKETS) + [0.0, 0])
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def gauge(self, metric: str, help_text: str, collect: Callable[[], Dict[Labels, float] | float]):
+        """Register a gauge whose values are read when the metrics are rendered."""
+        self.help[metric] = ("gauge", help_text)
+        self.gauges[metric] = collect
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for name, series in self.counters.items():
+                lines += [f"# HELP {name} {self.help[name][1]}", f"# TYPE {name} counter"]
+                lines += [f"{name}{format_labels(labels)} {value}" for labels, value in series.items()]
+            for name, series in self.histograms.items():
+                lines += [f"# HELP {name} {self.help[name][1]}", f"# TYPE {name} histogram"]
+                for labels, state in series.items():
+                    for bound, count in zip(LATENCY_BUCKETS, state):
+                        lines.append(f"{name}_bucket{format_labels(labels, le=bound)} {count}")
+                    lines.append(f"{name}_bucket{format_labels(labels, le='+Inf')} {state[-1]}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {round(state[-2], 6)}")
+                    lines.append(f"{name}_count{format_labels(labels)} {state[-1]}")
+
+        for name, collect in self.gauges.items():
+            try:
+                values = collect()
+            except Exception as e:
+                print(f"Error collecting metric {name}: {e}")
+                continue
+            if not isinstance(values, dict):
+                values = {(): values}
+            lines += [f"# HELP {name} {self.help[name][1]}", f"# TYPE {name} gauge"]
+            lines += [f"{name}{format_labels(labels)} {float(value)}" for labels, value in values.items()]
+        return "\n".join(lines) + "\n"
+
+def span_name(span_data) -> str:
+    """Readable name of a span, e.g. the agent, tool or guardrail it covers."""
+    if span_data.type == "handoff":
+        return f"{span_data.from_agent} -> {span_data.to_agent}"
+    return getattr(span_data, "name", None) or span_data.type
+
+class TurnTracer(TracingProcessor):
+    """Tracing processor feeding stage latencies and token counts into Metrics."""
+
+    def __init__(
+        self,
+        metrics: Metrics,
+        slow_trace_path: str = "slow_traces.jsonl",
+        slow_trace_seconds: float = 10,
+        slow_trace_sample_rate: float = 1.0
+    ):
+        self.metrics = metrics
+        self.slow_trace_path = slow_trace_path
+        self.slow_trace_seconds = slow_trace_seconds
+        self.slow_trace_sample_rate = slow_trace_sample_rate
+        self.lock = threading.Lock()
+        self.traces: Dict[str, dict] = {}
+        self.span_started: Dict[str, float] = {}
+        self.span_agents: Dict[str, str] = {}
+
+    def on_trace_start(self, trace):
+        with self.lock:
+            self.traces[trace.trace_id] = {
+                "name": trace.name,
+                "group_id": (trace.export() or {}).get("group_id"),
+                "started": time.perf_counter(),
+                "spans": []
+            }
+
+    def on_trace_end(self, trace):
+        with self.lock:
+            state = self.traces.pop(trace.trace_id, None)
+        if state is None:
+            return
+        duration = time.perf_counter() - state["started"]
+        self.metrics.observe(
+            "kavak_turn_duration_seconds", "End to end duration of a traced turn", duration, trace=state["name"]
+        )
+        if duration >= self.slow_trace_seconds and random.random() < self.slow_trace_sample_rate:
+            self.write_slow_trace(trace.trace_id, state, duration)
+
+    def on_span_start(self, span):
+        with self.lock:
+            self.span_started[span.span_id] = time.perf_counter()
+            if span.span_data.type == "agent":
+                self.span_agents[span.span_id] = span.span_data.name
+
+    def on_span_end(self, span):
+        # Processors run inline with the agents, a metrics bug must never fail a turn.
+        try:
+            self.record_span(span)
+        except Exception as e:
+            print(f"Error recording span {span.span_id}: {e}")
+
+    def record_span(self, span):
+        data = span.span_data
+        with self.lock:
+            started = self.span_started.pop(span.span_id, None)
+            agent = self.span_agents.get(span.parent_id, "unknown")
+            if data.type == "agent":
+                agent = self.span_agents.pop(span.span_id, data.name)
+            state = self.traces.get(span.trace_id)
+        duration = time.perf_counter() - started if started is not None else 0.0
+        # Model responses are labelled with the agent that requested them.
+        name = agent if data.type == "response" else span_name(data)
+
+        self.metrics.observe(
+            "kavak_stage_duration_seconds", "Duration of each stage of a turn", duration, stage=data.type, name=name
+        )
+        if span.error:
+            self.metrics.inc("kavak_stage_errors_total", "Stages that ended with an error", stage=data.type, name=name)
+        if data.type == "agent":
+            self.metrics.inc("kavak_agent_calls_total", "Agent runs per agent", agent=agent)
+        elif data.type == "guardrail" and data.triggered:
+            self.metrics.inc("kavak_guardrail_trips_total", "Guardrail tripwires triggered", guardrail=name)
+        elif data.type == "response":
+            self.record_response(agent, data.response)
+
+        if state is not None:
+            state["spans"].append({
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                "stage": data.type,
+                "name": name,
+                "agent": agent,
+                "duration_ms": round(duration * 1000, 1),
+                "error": span.error
+            })
+
+    def record_response(self, agent: str, response):
+        if response is None:
+            return
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.metrics.inc("kavak_agent_tokens_total", "Model tokens per agent", usage.input_tokens, agent=agent, type="input")
+            self.metrics.inc("kavak_agent_tokens_total", "Model tokens per agent", usage.output_tokens, agent=agent, type="output")
+        # Hosted tools such as FileSearch run inside the model response, so they are counted here.
+        for item in response.output or []:
+            if item.type.endswith("_call") and item.type != "function_call":
+                self.metrics.inc("kavak_hosted_tool_calls_total", "Hosted tool calls per agent", agent=agent, tool=item.type)
+
+    def write_slow_trace(self, trace_id: str, state: dict, duration: float):
+        record = {
+            "trace_id": trace_id,
+            "name": state["name"],
+            "group_id": state["group_id"],
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "duration_ms": round(duration * 1000, 1),
+            "spans": state["spans"]
+        }
+        try:
+            with self.lock, open(self.slow_trace_path, "a", encoding="utf-8") as blob:
+                blob.write(json.dumps(record, default=str) + "\n")
+        except OSError as e:
+            print(f"Error writing slow trace: {e}")
+
+    def shutdown(self):
+        pass
+
+    def force_flush(self):
+        pass
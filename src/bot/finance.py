@@ -0,0 +1,124 @@
+"""
+Vectorized amortization engine for car financial plans.
+Whole grids of plans x deposits are computed in one NumPy pass and memoized per
+(price, plan, deposit, rate), so comparing options costs a single tool call.
+"""
+import datetime
+from collections import OrderedDict
+import numpy as np
+from src.bot.models import FinancialPlan, FinancialPlanComparison, FinancialPlanOption, Installment
+
+ANNUAL_INTEREST_RATE = 0.10
+MIN_PLAN = 36
+MAX_PLAN = 72
+CACHE_SIZE = 4096
+
+_payment_cache: OrderedDict[tuple, float] = OrderedDict()
+
+def monthly_payments(price: float, plans: np.ndarray, deposits: np.ndarray, annual_rate: float) -> np.ndarray:
+    """Return the fixed monthly payment for each (plan, deposit) pair."""
+    principal = price - deposits
+    monthly_rate = annual_rate / 12
+    if monthly_rate == 0:
+        return principal / plans
+    growth = (1 + monthly_rate) ** plans
+    return principal * monthly_rate * growth / (growth - 1)
+
+def cached_monthly_payments(price: float, pairs: list[tuple[int, float]], annual_rate: float) -> list[float]:
+    """Monthly payments for the given pairs, only computing the ones not cached yet."""
+    keys = [(price, plan, deposit, annual_rate) for plan, deposit in pairs]
+    missing = list(dict.fromkeys(key for key in keys if key not in _payment_cache))
+
+    if missing:
+        payments = monthly_payments(
+            price,
+            np.array([key[1] for key in missing], dtype=np.float64),
+            np.array([key[2] for key in missing], dtype=np.float64),
+            annual_rate
+        )
+        for key, payment in zip(missing, payments.tolist()):
+            _payment_cache[key] = payment
+
+    results = []
+    for key in keys:
+        _payment_cache.move_to_end(key)
+        results.append(_payment_cache[key])
+
+    while len(_payment_cache) > CACHE_SIZE:
+        _payment_cache.popitem(last=False)
+    return results
+
+def payment_dates(num_installments: int, today: datetime.date | None = None) -> list[str]:
+    """First day of each month, starting the month after today."""
+    today = today or datetime.date.today()
+    months = np.datetime64(today, "M") + np.arange(1, num_installments + 1).astype("timedelta64[M]")
+    return [f"{day[8:10]}/{day[5:7]}/{day[0:4]}" for day in months.astype("datetime64[D]").astype(str)]
+
+def installment_amounts(monthly_payment: float, num_installments: int) -> list[float]:
+    """Installments in cents, the last one absorbs the rounding so they add up to the total paid."""
+    amount = round(monthly_payment, 2)
+    last = round(round(monthly_payment * num_installments, 2) - amount * (num_installments - 1), 2)
+    return [amount] * (num_installments - 1) + [last]
+
+def build_installments(monthly_payment: float, num_installments: int, today: datetime.date | None = None) -> list[Installment]:
+    return [
+        Installment(amount=amount, installment_rn=i, payment_date=payment_date)
+        for i, (amount, payment_date) in enumerate(
+            zip(installment_amounts(monthly_payment, num_installments), payment_dates(num_installments, today)), start=1
+        )
+    ]
+
+def validate_plan(price: float, plan: int, deposit: float):
+    if not MIN_PLAN <= plan <= MAX_PLAN:
+        raise ValueError(f"The plan must be between {MIN_PLAN} and {MAX_PLAN} installments, got {plan}.")
+    if not 0 <= deposit < price:
+        raise ValueError(f"The deposit must be lower than the car price ({price}), got {deposit}.")
+
+def financial_plan(price: float, plan: int, deposit: float, annual_rate: float = ANNUAL_INTEREST_RATE) -> FinancialPlan:
+    """Full financial plan with its list of installments."""
+    validate_plan(price, plan, deposit)
+    [monthly_payment] = cached_monthly_payments(price, [(plan, deposit)], annual_rate)
+
+    return FinancialPlan(
+        total_paid=round(monthly_payment * plan, 2),
+        car_price=price,
+        installments=build_installments(monthly_payment, plan),
+        annual_interest_rate=annual_rate
+    )
+
+def compare_plans(
+    price: float,
+    plans: list[int],
+    deposits: list[float],
+    include_installments: bool = False,
+    annual_rate: float = ANNUAL_INTEREST_RATE
+) -> FinancialPlanComparison:
+    """Summaries for every plan x deposit combination, in a single vectorized pass."""
+    pairs = [(int(plan), float(deposit)) for plan in plans for deposit in deposits]
+    if not pairs:
+        raise ValueError("At least one plan and one deposit are needed to compare financial plans.")
+    for plan, deposit in pairs:
+        validate_plan(price, plan, deposit)
+
+    payments = cached_monthly_payments(price, pairs, annual_rate)
+    dates = payment_dates(max(plan for plan, _ in pairs))
+
+    options = []
+    for (plan, deposit), monthly_payment in zip(pairs, payments):
+        total_paid = monthly_payment * plan
+        options.append(FinancialPlanOption(
+            plan=plan,
+            deposit=deposit,
+            monthly_payment=round(monthly_payment, 2),
+            total_paid=round(total_paid, 2),
+            total_interest=round(total_paid - (price - deposit), 2),
+            first_payment_date=dates[0],
+            last_payment_date=dates[plan - 1],
+            installments=build_installments(monthly_payment, plan) if include_installments else None
+        ))
+
+    return FinancialPlanComparison(
+        car_price=price,
+        annual_interest_rate=annual_rate,
+        options=options
+    )
@@ -0,0 +1,233 @@
+"""
+Local fast path in front of the LLM guardrail.
+Keyword/regex rules and a small naive Bayes model trained on built-in phrases settle
+obvious inputs without an LLM call. A business word only shows an input is on topic, not
+that it is safe, so inputs are only cleared locally when every word is in a known-benign
+vocabulary. Anything else goes to the guardrail agent, whose verdicts are cached by
+normalized input.
+"""
+import math
+import re
+import unicodedata
+from collections import Counter, OrderedDict
+from src.bot.models import GuardrailCheck
+
+CACHE_SIZE = 4096
+MODEL_CONFIDENCE = 0.9
+MAX_FAST_PATH_WORDS = 40
+
+BLOCK_PATTERNS = [
+    r"\b(ignore|olvida|ignora)\b.{0,40}\b(instructions|instrucciones|prompt|reglas|rules)\b",
+    r"\b(system prompt|jailbreak|modo desarrollador|developer mode)\b",
+    r"\b(pendej\w*|put[ao]s?|cabron\w*|chinga\w*|verga|idiota|imbecil|estupid[ao]|fuck\w*|shit|bitch|asshole|retard\w*)\b",
+    r"\b(te voy a matar|i will kill|kill you|matarte|explosiv\w*|arma de fuego)\b",
+]
+
+BUSINESS_TERMS = {
+    "kavak", "auto", "autos", "carro", "carros", "coche", "coches", "car", "cars", "vehiculo", "vehiculos",
+    "seminuevo", "seminuevos", "comprar", "compra", "buy", "vender", "venta", "precio", "precios", "price",
+    "financiamiento", "financiar", "financing", "credito", "mensualidad", "mensualidades", "plazo", "plazos",
+    "enganche", "deposito", "deposit", "installments", "cuotas", "meses", "km", "kilometraje", "modelo",
+    "marca", "version", "sede", "sedes", "sucursal", "centro", "centros", "inspeccion", "horario", "horarios",
+    "garantia", "warranty", "bluetooth", "carplay", "sedan", "suv", "camioneta", "pickup", "hatchback"
+}
+
+# Function words and plain car shopping words, safe in any combination with the business terms.
+COMMON_WORDS = {
+    "a", "al", "algo", "algun", "alguna", "alguno", "ante", "ano", "anos", "barato", "barata", "busco",
+    "buscando", "con", "conocer", "cual", "cuales", "cuando", "cuanto", "cuanta", "cuantos", "cuantas", "de",
+    "del", "disponible", "disponibles", "donde", "el", "en", "es", "esa", "ese", "eso", "esta", "estan", "este",
+    "esto", "estos", "estas", "favor", "gustaria", "hay", "hasta", "info", "informacion", "interesa",
+    "interesan", "la", "las", "le", "lo", "los", "mas", "me", "mejor", "menos", "mi", "mil", "mis", "muy",
+    "necesito", "nuevo", "nueva", "o", "opcion", "opciones", "para", "pero", "pesos", "por", "puede", "pueden",
+    "puedo", "que", "quiero", "quisiera", "saber", "se", "sin", "son", "su", "sus", "tambien", "te", "tengo",
+    "tiene", "tienen", "tu", "tus", "un", "una", "uno", "unos", "unas", "usado", "usada", "usados", "usadas",
+    "usted", "ver", "y", "ya", "yo", "como", "seria", "serian", "cuesta", "cuestan", "costo", "sale",
+    "an", "and", "any", "about", "are", "at", "available", "best", "can", "cheap", "cheapest", "could", "do",
+    "does", "for", "has", "have", "how", "i", "im", "in", "is", "it", "know", "less", "like", "looking", "many",
+    "me", "more", "much", "my", "need", "new", "of", "on", "options", "or", "our", "over", "please", "see",
+    "show", "some", "than", "the", "thousand", "to", "under", "used", "want", "we", "what", "when", "where",
+    "which", "with", "without", "would", "year", "years", "you", "your"
+}
+
+GREETING_PATTERN = re.compile(
+    r"^(hola|hi|hello|hey|buenas|buenos dias|buenas tardes|buenas noches|gracias|muchas gracias|"
+    r"thanks|thank you|ok|okay|vale|si|no|adios|bye|hasta luego)( [a-z]+)?$"
+)
+
+TRAINING_PHRASES = {
+    "business": [
+        "quiero comprar un auto", "busco un carro usado", "que autos tienen disponibles",
+        "me interesa un toyota corolla", "cuanto cuesta el auto", "tienen suv de 2020",
+        "quiero un plan de financiamiento", "cuanto seria la mensualidad a 48 meses",
+        "puedo dar un enganche de 50000", "donde estan sus sedes", "horario del centro de inspeccion",
+        "que es kavak", "como funciona la garantia", "i want to buy a car", "show me cars under 300000",
+        "what financing options do you have", "where is the nearest inspection center",
+        "do you have a bmw", "quiero vender mi auto", "autos con menos de 50000 km",
+        "me gustaria ver opciones de camionetas", "tienen autos con carplay",
+        "cuales son los requisitos para el credito", "que opciones hay en monterrey",
+    ],
+    "greeting": [
+        "hola", "hola buenos dias", "buenas tardes", "hi there", "hello", "hey como estas",
+        "gracias", "muchas gracias por la ayuda", "thanks a lot", "ok perfecto", "adios", "bye",
+        "que tal", "buenas noches", "saludos",
+    ],
+    "offtopic": [
+        "cual es la capital de francia", "cuentame un chiste", "what is the weather today",
+        "quien gano el partido", "ayudame con mi tarea de matematicas", "escribe un poema",
+        "recomiendame una pelicula", "how do i cook pasta", "what is bitcoin price",
+        "quien es el presidente", "traduce esto al ingles", "write me some python code",
+    ],
+}
+
+def normalize_input(text: str) -> str:
+    """Casefold, strip accents and punctuation so equivalent inputs share a cache key."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+def latest_user_text(input_data) -> str:
+    """The guardrail receives either a string or the full input list, check the last user turn."""
+    if isinstance(input_data, str):
+        return input_data
+    for item in reversed(input_data):
+        if isinstance(item, dict) and item.get("role") == "user":
+            content = item.get("content", "")
+            if isinstance(content, str):
+                return content
+            return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return ""
+
+class LexicalModel:
+    """Multinomial naive Bayes over word unigrams with Laplace smoothing."""
+
+    def __init__(self, phrases: dict[str, list[str]]):
+        self.word_counts = {label: Counter() for label in phrases}
+        self.priors = {}
+        total = sum(len(examples) for examples in phrases.values())
+        for label, examples in phrases.items():
+            self.priors[label] = math.log(len(examples) / total)
+            for example in examples:
+                self.word_counts[label].update(normalize_input(example).split())
+        self.vocabulary = set().union(*self.word_counts.values())
+        self.totals = {label: sum(counts.values()) for label, counts in self.word_counts.items()}
+
+    def predict(self, text: str) -> tuple[str, float]:
+        """Most likely label and its posterior probability."""
+        words = [word for word in text.split() if word in self.vocabulary]
+        if not words:
+            return "unknown", 0.0
+        scores = {}
+        for label, counts in self.word_counts.items():
+            denominator = self.totals[label] + len(self.vocabulary)
+            scores[label] = self.priors[label] + sum(
+                math.log((counts[word] + 1) / denominator) for word in words
+            )
+        best = max(scores, key=scores.get)
+        normalizer = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / normalizer
+
+class GuardrailPrefilter:
+    """Rules, lexical model and verdict cache consulted before the guardrail agent."""
+
+    def __init__(self, business_terms: set[str] | None = None, cache_size: int = CACHE_SIZE):
+        self.block_patterns = [re.compile(pattern) for pattern in BLOCK_PATTERNS]
+        self.business_terms = BUSINESS_TERMS | {normalize_input(term) for term in business_terms or ()}
+        self.benign_words = self.vocabulary(self.business_terms)
+        self.model = LexicalModel(TRAINING_PHRASES)
+        self.cache: OrderedDict[str, GuardrailCheck] = OrderedDict()
+        self.cache_size = cache_size
+        self.checks = 0
+        self.cache_hits = 0
+        self.rule_verdicts = 0
+        self.model_verdicts = 0
+        self.llm_verdicts = 0
+
+    def add_business_terms(self, terms: set[str]):
+        """Extend the business vocabulary, e.g. with makes and models of new stock."""
+        self.business_terms = self.business_terms | {normalize_input(term) for term in terms}
+        self.benign_words = self.vocabulary(self.business_terms)
+
+    @staticmethod
+    def vocabulary(business_terms: set[str]) -> set[str]:
+        """Words an input may be made of to be cleared without the guardrail agent."""
+        greeting_words = set(re.findall(r"[a-z]+", GREETING_PATTERN.pattern))
+        business_words = {word for term in business_terms for word in term.split()}
+        return COMMON_WORDS | greeting_words | business_words
+
+    def is_benign(self, text: str) -> bool:
+        return all(word in self.benign_words or word.isdigit() for word in text.split())
+
+    def check(self, input_data) -> GuardrailCheck | None:
+        """Return a local verdict, or None when the guardrail agent has to decide."""
+        self.checks += 1
+        key = normalize_input(latest_user_text(input_data))
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache.move_to_end(key)
+            self.cache_hits += 1
+            return cached
+
+        # Local verdicts are cheap to recompute, only the guardrail agent's are cached.
+        verdict = self.rule_verdict(key)
+        if verdict is not None:
+            self.rule_verdicts += 1
+            return verdict
+        verdict = self.model_verdict(key)
+        if verdict is not None:
+            self.model_verdicts += 1
+        return verdict
+
+    def rule_verdict(self, text: str) -> GuardrailCheck | None:
+        for pattern in self.block_patterns:
+            if pattern.search(text):
+                return GuardrailCheck(
+                    is_business=False,
+                    is_safe=False,
+                    reason=f"Local rule: matched blocked pattern '{pattern.pattern[:40]}'"
+                )
+        if len(text.split()) > MAX_FAST_PATH_WORDS or not self.is_benign(text):
+            return None
+        if GREETING_PATTERN.match(text):
+            return GuardrailCheck(is_business=False, is_safe=True, reason="Local rule: greeting or courtesy")
+        words = set(text.split())
+        if words & self.business_terms or any(term in text for term in self.business_terms if " " in term):
+            return GuardrailCheck(is_business=True, is_safe=True, reason="Local rule: car or Kavak related terms")
+        return None
+
+    def model_verdict(self, text: str) -> GuardrailCheck | None:
+        """Only clears inputs as safe, blocking is left to the rules and the guardrail agent."""
+        if len(text.split()) > MAX_FAST_PATH_WORDS or not self.is_benign(text):
+            return None
+        label, probability = self.model.predict(text)
+        if probability < MODEL_CONFIDENCE:
+            return None
+        return GuardrailCheck(
+            is_business=label == "business",
+            is_safe=True,
+            reason=f"Local model: classified as {label} ({probability:.2f})"
+        )
+
+    def remember(self, input_data, verdict: GuardrailCheck):
+        """Cache a guardrail agent verdict under the normalized latest user input."""
+        self.llm_verdicts += 1
+        key = normalize_input(latest_user_text(input_data))
+        if not key:
+            return
+        self.cache[key] = verdict
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def stats(self) -> dict:
+        bypassed = self.cache_hits + self.rule_verdicts + self.model_verdicts
+        return {
+            "checks": self.checks,
+            "cache_hits": self.cache_hits,
+            "rule_verdicts": self.rule_verdicts,
+            "model_verdicts": self.model_verdicts,
+            "llm_verdicts": self.llm_verdicts,
+            "cache_hit_rate": self.cache_hits / self.checks if self.checks else 0.0,
+            "bypass_rate": bypassed / self.checks if self.checks else 0.0
+        }
@@ -0,0 +1,174 @@
+"""
+Token-bounded conversation history.
+The last turns are kept verbatim while older turns and large tool payloads are folded
+into a rolling summary, so the input sent to the agents stays under a token budget.
+"""
+import json
+from functools import lru_cache
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:"
+CHARS_PER_TOKEN = 4
+DEFAULT_TOKEN_BUDGET = 6000
+DEFAULT_KEEP_TURNS = 4
+MAX_TOOL_OUTPUT_TOKENS = 400
+MAX_SUMMARY_TOKENS = 800
+SNIPPET_LENGTH = 200
+SUMMARIZED_MARKER = "(summarized) "
+
+def estimate_tokens(item) -> int:
+    """Rough token count of an input item (about 4 characters per token)."""
+    text = item if isinstance(item, str) else json.dumps(item, ensure_ascii=False, default=str)
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def snippet(text: str, length: int = SNIPPET_LENGTH) -> str:
+    text = " ".join(str(text).split())
+    return text if len(text) <= length else f"{text[:length]}..."
+
+def is_user_message(item: dict) -> bool:
+    return item.get("role") == "user" and item.get("type", "message") == "message"
+
+def is_summary(item: dict) -> bool:
+    return item.get("role") == "system" and str(item.get("content", "")).startswith(SUMMARY_PREFIX)
+
+def message_text(item: dict) -> str:
+    content = item.get("content", "")
+    if isinstance(content, str):
+        return content
+    return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+def assistant_text(item: dict) -> str:
+    """Agents answer with an AgentOutput JSON object, keep just its message."""
+    text = message_text(item)
+    try:
+        return json.loads(text).get("message", text)
+    except (ValueError, AttributeError):
+        return text
+
+def summarize_tool_output(output: str) -> str:
+    """Compact description of a tool result, keeping the figures worth remembering."""
+    if str(output).startswith(SUMMARIZED_MARKER):
+        return output[len(SUMMARIZED_MARKER):]
+    try:
+        data = json.loads(output)
+    except (TypeError, ValueError):
+        return snippet(output)
+    if not isinstance(data, dict):
+        return snippet(output)
+
+    if "installments" in data and "total_paid" in data:
+        installments = data["installments"] or []
+        monthly = installments[0]["amount"] if installments else 0
+        return (
+            f"financial plan for car price {data.get('car_price')}: {len(installments)} installments "
+            f"of {monthly:.2f}, total paid {data['total_paid']:.2f}, "
+            f"annual interest rate {data.get('annual_interest_rate')}"
+        )
+    if "options" in data:
+        options = ", ".join(
+            f"{option['plan']} months with deposit {option['deposit']}: {option['monthly_payment']}/month"
+            for option in data["options"]
+        )
+        return snippet(f"financial plan options for car price {data.get('car_price')}: {options}", 600)
+    if "cars" in data:
+        cars = ", ".join(
+            f"{car['make']} {car['model']} {car['year']} (stock_id {car['stock_id']}, price {car['price']})"
+            for car in data["cars"]
+        )
+        return snippet(f"{data.get('total_matches')} cars found: {cars}", 600)
+    return snippet(output)
+
+@lru_cache(maxsize=2048)
+def summarize_turn(turn_json: str) -> str:
+    """One summary block per turn, cached since folded turns never change."""
+    lines = []
+    for item in json.loads(turn_json):
+        item_type = item.get("type", "message")
+        if is_summary(item):
+            continue
+        if item_type == "message" and item.get("role") == "user":
+            lines.append(f"- User: {snippet(message_text(item))}")
+        elif item_type == "message" and item.get("role") == "assistant":
+            lines.append(f"- Assistant: {snippet(assistant_text(item))}")
+        elif item_type == "function_call":
+            if item.get("name", "").startswith("transfer_to_"):
+                lines.append(f"- Handed off: {item['name']}")
+            else:
+                lines.append(f"- Called {item.get('name')} with {snippet(item.get('arguments', ''))}")
+        elif item_type == "function_call_output":
+            lines.append(f"- Tool result: {summarize_tool_output(item.get('output', ''))}")
+        elif item_type == "file_search_call":
+            lines.append(f"- Searched the files for: {', '.join(item.get('queries') or [])}")
+    return "\n".join(lines)
+
+def compact_tool_payloads(turn: list[dict], max_tokens: int) -> list[dict]:
+    """Replace oversized tool results in a kept turn with their summary."""
+    compacted = []
+    for item in turn:
+        if item.get("type") == "function_call_output" and estimate_tokens(item.get("output", "")) > max_tokens:
+            item = {**item, "output": f"{SUMMARIZED_MARKER}{summarize_tool_output(item['output'])}"}
+        elif item.get("type") == "file_search_call" and item.get("results"):
+            item = {**item, "results": None}
+        compacted.append(item)
+    return compacted
+
+class HistoryManager:
+    """Keeps conversation histories under a per-agent token budget."""
+
+    def __init__(
+        self,
+        token_budget: int = DEFAULT_TOKEN_BUDGET,
+        agent_budgets: dict[str, int] | None = None,
+        keep_turns: int = DEFAULT_KEEP_TURNS,
+        max_tool_output_tokens: int = MAX_TOOL_OUTPUT_TOKENS,
+        max_summary_tokens: int = MAX_SUMMARY_TOKENS
+    ):
+        self.token_budget = token_budget
+        self.agent_budgets = agent_budgets or {}
+        self.keep_turns = keep_turns
+        self.max_tool_output_tokens = max_tool_output_tokens
+        self.max_summary_tokens = max_summary_tokens
+
+    def budget_for(self, agent_name: str | None) -> int:
+        return self.agent_budgets.get(agent_name, self.token_budget)
+
+    def compact(self, items: list[dict], agent_name: str | None = None) -> list[dict]:
+        """Return a history that fits the budget of the agent that will read it next."""
+        summary = ""
+        if items and is_summary(items[0]):
+            summary = items[0]["content"][len(SUMMARY_PREFIX):].strip()
+            items = items[1:]
+
+        turns = []
+        for item in items:
+            if is_user_message(item) or not turns:
+                turns.append([])
+            turns[-1].append(item)
+
+        # Large tool payloads only matter for the turn in progress.
+        turns = [
+            compact_tool_payloads(turn, self.max_tool_output_tokens) for turn in turns[:-1]
+        ] + turns[-1:]
+
+        budget = self.budget_for(agent_name)
+        fold = max(len(turns) - self.keep_turns, 0)
+        while fold < len(turns) - 1 and self._tokens(summary, turns[fold:]) > budget:
+            fold += 1
+
+        if fold:
+            folded = [summarize_turn(json.dumps(turn, ensure_ascii=False, default=str)) for turn in turns[:fold]]
+            summary = self._trim_summary("\n".join(line for line in [summary, *folded] if line))
+
+        history = [item for turn in turns[fold:] for item in turn]
+        if summary:
+            history.insert(0, {"role": "system", "content": f"{SUMMARY_PREFIX}\n{summary}"})
+        return history
+
+    def _tokens(self, summary: str, turns: list[list[dict]]) -> int:
+        return estimate_tokens(summary) + sum(estimate_tokens(item) for turn in turns for item in turn)
+
+    def _trim_summary(self, summary: str) -> str:
+        """Drop the oldest summary lines once the summary itself exceeds its budget."""
+        lines = summary.splitlines()
+        while len(lines) > 1 and estimate_tokens("\n".join(lines)) > self.max_summary_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
@@ -0,0 +1,255 @@
+"""
+In-memory columnar index over the car stock.
+Numeric fields are kept as NumPy columns with precomputed sort orders so range filters
+resolve with a binary search, and make/model equality filters use inverted indexes.
+Stock snapshots are diffed by stock_id and swapped in as a whole new index, so searches
+always run against one consistent version.
+"""
+import csv
+import json
+import os
+import threading
+import unicodedata
+from dataclasses import dataclass, field
+import numpy as np
+from src.bot.models import CarListing, CarSearchResult
+
+INTEGER_FIELDS = ("stock_id", "km", "year")
+FLOAT_FIELDS = ("price", "largo", "ancho", "altura")
+
+RANGE_COLUMNS = ("price", "km", "year")
+SORT_COLUMNS = ("price", "km", "year")
+MAX_PAGE_SIZE = 20
+
+EMPTY_ROWS = np.empty(0, dtype=np.int64)
+
+def normalize_term(value: str) -> str:
+    """Normalize a make/model value for case and accent insensitive matching."""
+    decomposed = unicodedata.normalize("NFKD", value.strip().casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+def parse_flag(value) -> bool:
+    """Parse the 'Sí'/empty feature flags used in the stock files."""
+    if isinstance(value, bool):
+        return value
+    return bool(value) and normalize_term(str(value)) in {"si", "yes", "true", "1"}
+
+class CarInventoryIndex:
+    """Columnar car stock with inverted indexes for exact, paginated searches."""
+
+    def __init__(self, records: list[dict]):
+        self.stock_id = np.array([int(r["stock_id"]) for r in records], dtype=np.int64)
+        self.price = np.array([float(r["price"]) for r in records], dtype=np.float64)
+        self.km = np.array([int(float(r["km"])) for r in records], dtype=np.int64)
+        self.year = np.array([int(r["year"]) for r in records], dtype=np.int64)
+        self.make = [str(r["make"]) for r in records]
+        self.model = [str(r["model"]) for r in records]
+        self.version = [str(r["version"]) for r in records]
+        self.bluetooth = np.array([parse_flag(r.get("bluetooth")) for r in records], dtype=bool)
+        self.car_play = np.array([parse_flag(r.get("car_play")) for r in records], dtype=bool)
+
+        self.columns = {"price": self.price, "km": self.km, "year": self.year}
+        self.sort_orders = {
+            name: np.argsort(column, kind="stable") for name, column in self.columns.items()
+        }
+        self.sorted_columns = {
+            name: self.columns[name][order] for name, order in self.sort_orders.items()
+        }
+
+        self.make_index = self._build_inverted_index(self.make)
+        self.model_index = self._build_inverted_index(self.model)
+
+    @staticmethod
+    def _build_inverted_index(values: list[str]) -> dict[str, np.ndarray]:
+        postings: dict[str, list[int]] = {}
+        for row, value in enumerate(values):
+            postings.setdefault(normalize_term(value), []).append(row)
+        return {term: np.array(rows, dtype=np.int64) for term, rows in postings.items()}
+
+    def __len__(self) -> int:
+        return len(self.stock_id)
+
+    def _range_bounds(self, name: str, low, high) -> tuple[int, int]:
+        sorted_column = self.sorted_columns[name]
+        start = 0 if low is None else int(np.searchsorted(sorted_column, low, side="left"))
+        end = len(sorted_column) if high is None else int(np.searchsorted(sorted_column, high, side="right"))
+        return start, max(end, start)
+
+    def search(
+        self,
+        make: str | None = None,
+        model: str | None = None,
+        ranges: dict[str, tuple] | None = None,
+        bluetooth: bool | None = None,
+        car_play: bool | None = None,
+        sort_by: str = "price",
+        descending: bool = False,
+        limit: int = 5,
+        offset: int = 0
+    ) -> CarSearchResult:
+        """Filter, sort and paginate the stock.
+
+        `ranges` maps a numeric column name to an inclusive (low, high) tuple where either
+        bound may be None.
+        """
+        ranges = {
+            name: bounds for name, bounds in (ranges or {}).items()
+            if name in RANGE_COLUMNS and bounds != (None, None)
+        }
+        rows = None
+
+        for index, value in ((self.make_index, make), (self.model_index, model)):
+            if value:
+                postings = index.get(normalize_term(value), EMPTY_ROWS)
+                rows = postings if rows is None else np.intersect1d(rows, postings, assume_unique=True)
+
+        if rows is None and ranges:
+            # Seed the candidates with the most selective range, found by binary search.
+            bounds = {name: self._range_bounds(name, *ranges[name]) for name in ranges}
+            seed = min(bounds, key=lambda name: bounds[name][1] - bounds[name][0])
+            start, end = bounds[seed]
+            rows = self.sort_orders[seed][start:end]
+            del ranges[seed]
+
+        if rows is None:
+            rows = np.arange(len(self), dtype=np.int64)
+
+        for name, (low, high) in ranges.items():
+            values = self.columns[name][rows]
+            mask = np.ones(len(rows), dtype=bool)
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+            rows = rows[mask]
+
+        for flags, wanted in ((self.bluetooth, bluetooth), (self.car_play, car_play)):
+            if wanted is not None:
+                rows = rows[flags[rows] == wanted]
+
+        if sort_by not in SORT_COLUMNS:
+            sort_by = "price"
+        keys = self.columns[sort_by][rows]
+        if descending:
+            keys = -keys
+
+        limit = min(max(limit, 1), MAX_PAGE_SIZE)
+        offset = max(offset, 0)
+        end = offset + limit
+        if len(rows) > end:
+            # Only the requested page needs ordering, partition the rest away but keep every
+            # match tied with the last one, since which of them make the page is decided below.
+            top = np.flatnonzero(keys <= np.partition(keys, end - 1)[end - 1])
+        else:
+            top = np.arange(len(rows))
+        # Ties are broken by stock_id, so the pages of a search never overlap or skip a car.
+        top = top[np.lexsort((self.stock_id[rows[top]], keys[top]))]
+        page = rows[top[offset:end]]
+
+        return CarSearchResult(
+            total_matches=len(rows),
+            offset=offset,
+            cars=[self.listing(int(row)) for row in page]
+        )
+
+    def listing(self, row: int) -> CarListing:
+        return CarListing(
+            stock_id=int(self.stock_id[row]),
+            price=float(self.price[row]),
+            make=self.make[row],
+            model=self.model[row],
+            year=str(self.year[row]),
+            version=self.version[row],
+            km=int(self.km[row]),
+            bluetooth=bool(self.bluetooth[row]),
+            car_play=bool(self.car_play[row])
+        )
+
+def normalize_record(record: dict) -> dict:
+    """Give CSV and JSON rows the same types, so equal cars compare equal."""
+    normalized = {}
+    for key, value in record.items():
+        if value == "":
+            value = None
+        if value is not None and key in INTEGER_FIELDS:
+            value = int(float(value))
+        elif value is not None and key in FLOAT_FIELDS:
+            value = float(value)
+        normalized[key] = value
+    return normalized
+
+def load_stock_snapshot(path: str) -> dict[int, dict]:
+    """Read a CSV or JSON stock snapshot into records keyed by stock_id."""
+    with open(path, newline="", encoding="utf-8") as blob:
+        if path.endswith(".json"):
+            rows = json.load(blob)
+        else:
+            rows = list(csv.DictReader(blob))
+    records = (normalize_record(row) for row in rows)
+    return {record["stock_id"]: record for record in records}
+
+@dataclass
+class StockDiff:
+    added: list[int] = field(default_factory=list)
+    removed: list[int] = field(default_factory=list)
+    changed: list[int] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+    def summary(self) -> dict:
+        return {"added": len(self.added), "removed": len(self.removed), "changed": len(self.changed)}
+
+def diff_stock(old: dict[int, dict], new: dict[int, dict]) -> StockDiff:
+    return StockDiff(
+        added=sorted(new.keys() - old.keys()),
+        removed=sorted(old.keys() - new.keys()),
+        changed=sorted(stock_id for stock_id in new.keys() & old.keys() if new[stock_id] != old[stock_id])
+    )
+
+class CarInventory:
+    """The current stock snapshot and its index, replaced together on every update.
+
+    Readers take `index` once per search, the reference is swapped in a single assignment
+    so a search never mixes two versions.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = load_stock_snapshot(path)
+        self.index = CarInventoryIndex(list(self.records.values()))
+        self.version = 1
+        self.mtime = self._mtime()
+        self.lock = threading.Lock()
+
+    def _mtime(self) -> float | None:
+        try:
+            return os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def changed_on_disk(self) -> bool:
+        return self._mtime() != self.mtime
+
+    def update(self, records: dict[int, dict], before_swap=None) -> StockDiff:
+        """Swap in a new snapshot if it differs from the current one.
+
+        `before_swap(records, diff)` runs first, e.g. to sync the search backend, so the
+        index only moves to the new version once everything else has.
+        """
+        with self.lock:
+            diff = diff_stock(self.records, records)
+            if diff:
+                if before_swap is not None:
+                    before_swap(records, diff)
+                self.index = CarInventoryIndex(list(records.values()))
+                self.records = records
+                self.version += 1
+            return diff
+
+    def reload(self, before_swap=None) -> StockDiff:
+        """Load the snapshot file again and apply whatever changed."""
+        mtime = self._mtime()
+        diff = self.update(load_stock_snapshot(self.path), before_swap)
+        self.mtime = mtime
+        return diff
@@ -0,0 +1,150 @@
+"""
+Offline BM25 retrieval over the Kavak knowledge base.
+The scraped text is split into section-aware chunks using the '-' heading markers written
+by parse_page_content, and the inverted index is persisted next to the knowledge base so
+later starts only load it.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+import tempfile
+import unicodedata
+from collections import Counter
+from src.bot.models import KnowledgeBaseChunk, KnowledgeBaseResult
+
+KB_INDEX_PATH = "resources/kb_index.json"
+INDEX_VERSION = 1
+MAX_CHUNK_WORDS = 120
+K1 = 1.5
+B = 0.75
+
+STOPWORDS = {
+    "a", "al", "ante", "con", "de", "del", "el", "en", "es", "la", "las", "lo", "los", "o", "para", "por",
+    "que", "se", "su", "sus", "te", "tu", "un", "una", "y", "mas", "como", "the", "of", "and", "to", "in",
+    "is", "for", "on", "at", "an", "or",
+}
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase, accent-free word tokens with stopwords and plural 's' removed."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(char for char in decomposed if not unicodedata.combining(char))
+    tokens = []
+    for word in re.findall(r"\w+", text):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 4 and word.endswith("s"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def is_heading(line: str) -> bool:
+    return line.startswith("- ") and not line.startswith("-- ")
+
+def chunk_knowledge_base(text: str, max_words: int = MAX_CHUNK_WORDS) -> list[dict]:
+    """Split the text into chunks that never cross a heading, each tagged with its section."""
+    chunks = []
+    section = "KAVAK"
+    lines: list[str] = []
+    words = 0
+
+    def flush():
+        if lines:
+            chunks.append({"section": section, "text": "\n".join(lines)})
+
+    for line in (line.strip() for line in text.splitlines()):
+        if not line or line == "-":
+            continue
+        if is_heading(line):
+            flush()
+            section, lines, words = line[2:].strip(), [], 0
+            continue
+        line_words = len(line.split())
+        if lines and words + line_words > max_words:
+            flush()
+            lines, words = [], 0
+        lines.append(line)
+        words += line_words
+    flush()
+    return chunks
+
+class KnowledgeBaseIndex:
+    """BM25 inverted index over knowledge base chunks."""
+
+    def __init__(self, chunks: list[dict], postings: dict[str, list[list[int]]], doc_lengths: list[int], digest: str):
+        self.chunks = chunks
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.digest = digest
+        self.average_length = sum(doc_lengths) / len(doc_lengths) if doc_lengths else 0.0
+        self.idf = {
+            term: math.log(1 + (len(chunks) - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in postings.items()
+        }
+
+    @classmethod
+    def build(cls, text: str) -> "KnowledgeBaseIndex":
+        chunks = chunk_knowledge_base(text)
+        postings: dict[str, list[list[int]]] = {}
+        doc_lengths = []
+        for chunk_id, chunk in enumerate(chunks):
+            # Section names are indexed with the text so a heading match ranks the whole section.
+            terms = Counter(tokenize(f"{chunk['section']} {chunk['text']}"))
+            doc_lengths.append(sum(terms.values()))
+            for term, frequency in terms.items():
+                postings.setdefault(term, []).append([chunk_id, frequency])
+        return cls(chunks, postings, doc_lengths, text_digest(text))
+
+    @classmethod
+    def load_or_build(cls, text: str, path: str = KB_INDEX_PATH) -> "KnowledgeBaseIndex":
+        """Load the persisted index if it was built from the same text, rebuild it otherwise."""
+        digest = text_digest(text)
+        try:
+            with open(path, "r", encoding="utf-8") as blob:
+                data = json.load(blob)
+            if data.get("version") == INDEX_VERSION and data.get("sha256") == digest:
+                return cls(data["chunks"], data["postings"], data["doc_lengths"], digest)
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            pass
+
+        index = cls.build(text)
+        index.save(path)
+        return index
+
+    def save(self, path: str = KB_INDEX_PATH):
+        # Workers warming up together all save the index, each writes its own temporary file.
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=os.path.dirname(path) or ".", prefix=os.path.basename(path), suffix=".tmp", delete=False
+        ) as blob:
+            json.dump({
+                "version": INDEX_VERSION,
+                "sha256": self.digest,
+                "chunks": self.chunks,
+                "postings": self.postings,
+                "doc_lengths": self.doc_lengths
+            }, blob, ensure_ascii=False)
+        os.replace(blob.name, path)
+
+    def search(self, query: str, limit: int = 3) -> KnowledgeBaseResult:
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for chunk_id, frequency in self.postings[term]:
+                length_norm = 1 - B + B * self.doc_lengths[chunk_id] / self.average_length
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * frequency * (K1 + 1) / (frequency + K1 * length_norm)
+
+        best = sorted(scores, key=scores.get, reverse=True)[:limit]
+        return KnowledgeBaseResult(chunks=[
+            KnowledgeBaseChunk(
+                section=self.chunks[chunk_id]["section"],
+                text=self.chunks[chunk_id]["text"],
+                score=round(scores[chunk_id], 3)
+            )
+            for chunk_id in best
+        ])
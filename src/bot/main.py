@@ -1,32 +1,69 @@
+import argparse
 import asyncio
-from agents import Agent, Runner, InputGuardrail, GuardrailFunctionOutput, FileSearchTool, function_tool
+import json
+import threading
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Literal
+import numpy as np
+from agents import (
+    Agent,
+    Runner,
+    RunContextWrapper,
+    InputGuardrail,
+    InputGuardrailTripwireTriggered,
+    GuardrailFunctionOutput,
+    FileSearchTool,
+    custom_span,
+    function_tool
+)
+from agents.tracing import get_current_trace
 from src.bot.models import (
-    FinancialPlan,
     CarData,
     AgentOutput,
-    GuardrailCheck,
-    Installment
+    GuardrailCheck
 )
+from src.bot.finance import financial_plan, compare_plans
+from src.bot.guardrails import GuardrailPrefilter
+from src.bot.history import HistoryManager
+from src.bot.inventory import CarInventory, StockDiff
+from src.bot.knowledge import KnowledgeBaseIndex
+from src.bot.router import IntentRouter, RoutingDecision
+from src.bot.scheduler import LLMScheduler, Priority, scheduled_run_config
+from src.bot.streaming import stream_agent_message
 from src.bot.util import (
+    CAR_STOCK_PATH,
     initialize_bot_stores,
+    collect_stale_bot_stores,
+    sync_car_stock,
     parse_page_content
 )
 from openai import OpenAI
 from dotenv import load_dotenv
 
 import os
-import datetime
 
 load_dotenv()
 
 api_key = os.getenv("OPENAI_API_KEY")
 kb_url = os.getenv("KB_URL")
 
-client = OpenAI(api_key=api_key)
+kb_cache_max_age_seconds = float(os.getenv("KB_CACHE_MAX_AGE_SECONDS", "86400"))
+
+car_inventory = CarInventory(os.getenv("CAR_STOCK_SNAPSHOT_PATH", CAR_STOCK_PATH))
 
-knowledge_base_text = parse_page_content(kb_url)
+guardrail_prefilter = GuardrailPrefilter(
+    business_terms=set(car_inventory.index.make_index) | set(car_inventory.index.model_index)
+)
 
-vector_store, kb_vector_store = initialize_bot_stores(client, knowledge_base_text)
+llm_scheduler = LLMScheduler(
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+    requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", "500")),
+    tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", "200000"))
+)
+
+llm_run_config = scheduled_run_config(llm_scheduler)
 
 guardrail_agent = Agent(
     name="Smart Guardrail",
@@ -39,8 +76,10 @@ guardrail_agent = Agent(
     output_type=GuardrailCheck,
 )
 
+# Tool results are kept in the history as str() of what the tool returns, so the tools return
+# JSON, which the history summaries can read back, rather than a model's repr.
 @function_tool
-async def create_financial_plan(car: CarData, plan: int, deposit: float) -> FinancialPlan:
+async def create_financial_plan(car: CarData, plan: int, deposit: float) -> str:
     """Create a financial plan given car information
 
     Args:
@@ -48,94 +87,81 @@ async def create_financial_plan(car: CarData, plan: int, deposit: float) -> Fina
         plan: The number of installments the user chose for creating their financial plan.
         deposit: The amount of deposit the user pretends to invest to start their financial plan. 
     """
-    
-    interest_rate = 0.10
-    car_price = car.price
-    monthly_interest_rate = interest_rate / 12
-    
-    num_installments = int(plan)
-    monthly_payment = (car_price-deposit) * (monthly_interest_rate * (1 + monthly_interest_rate) ** num_installments) / ((1 + monthly_interest_rate) ** num_installments - 1)
-    
-    total_paid = monthly_payment * num_installments
-    
-    current_date = datetime.datetime.now()
-    next_month = current_date.replace(day=1) + datetime.timedelta(days=32)
-    first_day_next_month = next_month.replace(day=1)
-    
-    installments = []
-    for i in range(1, num_installments + 1):
-        payment_date = (first_day_next_month + datetime.timedelta(days=32 * (i-1))).replace(day=1)
-        payment_date_str = payment_date.strftime("%d/%m/%Y")
-        
-        installment = Installment(
-            amount=monthly_payment,
-            installment_rn=i,
-            payment_date=payment_date_str
-        )
-        installments.append(installment)
-    
-    return FinancialPlan(
-        total_paid=total_paid,
-        car_price=car_price,
-        installments=installments,
-        annual_interest_rate=interest_rate
-    )
+    return financial_plan(car.price, int(plan), deposit).model_dump_json()
 
-car_sales_agent = Agent(
-    name="Kavak Car Sales Agent",
-    handoff_description="Handles car buying intent questions.",
-    instructions=(
-        "You are a sales agent in Kavak. You understand english and spanish and you're only to help the user guiding them with the process of buying a car, you don't provide customer success information."
-        "In all of your communication, make sure you speak as if you're part of the Kavak company"
-        "Follow the following routine with the user:"
-        "1. Ask them about any preferences on car features based on the properties within the attached file - don't jump into giving them options immediatly without gathering their preferences first"
-        "2. Based on their given preferences, look up for options in the attached file and bring them some options based on what they need - if there are no matches, tell the user and start over from 1."
-        "3. If the user explicitly ask for more options, provide them more options keeping the original preferences they gave in 1."
-        "4. If the user shows buying intent or gives you one of the car models you provided, offer them a financial plan for that car"
-        "5. If they confirm they want a financial plan, then gather the plan (installments number) and the deposit they are willing to give"
-        "- The user can only ask for 72 installments (6 years) max and a minimum of 36 installments (3 years)"
-        "6. If they provided the installments number (plan) and the deposit, pass the full car data, the plan and the deposit to the create financial plan function and give the created financial plan to the customer - show a resume of the list of installments, along with the interest rate and car price"
-        "7. If they didn't provide the installments number (plan), failed to provide an allowed installments number, or the deposit amount is missing or wrong (it's wrong if they give you a deposit greater or equal the car price), ask for it two or three more times"
-        "8. Help the user with precise answers if they ask any clarifying questions on the financial plan info you provided"
-        "9. Ask them if you can help them with something else related cars information"
-        "- If the user brings up a topic outside of car sales and car stock information, you will ask for triage support, you never offer information you don't have in your possesion"
-    ),
-    tools=[
-        FileSearchTool(
-            max_num_results=3,
-            vector_store_ids=[vector_store.id],
-        ),
-        create_financial_plan
-    ],
-    output_type=AgentOutput
-)
+@function_tool
+async def compare_financial_plans(
+    car: CarData,
+    plans: list[int],
+    deposits: list[float],
+    include_installments: bool
+) -> str:
+    """Compare financial plans for a car across several installment numbers and deposits at once
 
-customer_success_agent = Agent(
-     name="Kavak customer success agent",
-     handoff_description="Handles queries about kavak information such as mission, current status, and information related to inspection centres location and schedules, you can't provide information about car stock or sales",
-     instructions=(
-        "You are a customer success agent in Kavak."
-        "In all of your communication, make sure you speak as if you're part of the Kavak company"
-        "Follow the following routine with the user:"
-        "1. Ask them what do they want to know about kavak and let them know you can help with information regarding the company like current company status and info related to inspection centres location and schedules"
-        "- If they are asking for nearest inspection centres to their location, don't jump into providing options instantly; instead, collect user location references such as the state or city they're located, country, etc"
-        "2. Based on their answer, look up for the requested data by querying the attached file"
-        "- Don't let them know where you're getting the information from"
-        "3. If found, provide the requested information in a very structured, brief and understandable way to the user"
-        "- If the information they requested is not found within the attached file, don't invent one, just let them know unfortunately you don't have that information with you"
-        "- If the user brings up a topic outside of your purview, for instance, showing buying intent, you will ask for triage support, you never offer information about car models to the user"
-    ),
-    tools=[
-        FileSearchTool(
-            vector_store_ids=[kb_vector_store.id],
-        )
-    ],
-    output_type=AgentOutput
-)
+    Args:
+        car: The full car data from the one they selected.
+        plans: The installment numbers to compare (e.g. [36, 48, 60, 72]).
+        deposits: The deposit amounts to compare.
+        include_installments: Whether to include the full list of installments of every option, only set it when the user asks for the detail.
+    """
+    return compare_plans(car.price, plans, deposits, include_installments).model_dump_json()
+
+@function_tool
+async def search_cars(
+    make: str | None,
+    model: str | None,
+    min_price: float | None,
+    max_price: float | None,
+    min_year: int | None,
+    max_year: int | None,
+    max_km: int | None,
+    bluetooth: bool | None,
+    car_play: bool | None,
+    sort_by: Literal["price", "km", "year"] | None,
+    descending: bool | None,
+    limit: int | None,
+    offset: int | None
+) -> str:
+    """Search the car stock with exact filters, sorted and paginated.
+
+    Args:
+        make: Car make to match exactly (e.g. Toyota), or null for any make.
+        model: Car model to match exactly (e.g. Corolla), or null for any model.
+        min_price: Minimum price, or null.
+        max_price: Maximum price, or null.
+        min_year: Minimum model year, or null.
+        max_year: Maximum model year, or null.
+        max_km: Maximum mileage in km, or null.
+        bluetooth: True to only return cars with bluetooth, or null when the user doesn't care.
+        car_play: True to only return cars with Apple CarPlay, or null when the user doesn't care.
+        sort_by: Field to sort the results by, defaults to price.
+        descending: Sort from highest to lowest, defaults to false.
+        limit: Number of cars to return, defaults to 5 (max 20).
+        offset: Number of matches to skip, used to show more options for the same filters.
+    """
+    return car_inventory.index.search(
+        make=make,
+        model=model,
+        ranges={
+            "price": (min_price, max_price),
+            "year": (min_year, max_year),
+            "km": (None, max_km)
+        },
+        bluetooth=bluetooth,
+        car_play=car_play,
+        sort_by=sort_by or "price",
+        descending=bool(descending),
+        limit=limit or 5,
+        offset=offset or 0
+    ).model_dump_json()
 
 async def smart_guardrail(ctx, _agent, input_data):
-    result = await Runner.run(guardrail_agent, input_data, context=ctx.context)
-    final_output = result.final_output_as(GuardrailCheck)
+    final_output = guardrail_prefilter.check(input_data)
+    
+    if final_output is None:
+        result = await Runner.run(guardrail_agent, input_data, context=ctx.context, run_config=llm_run_config)
+        final_output = result.final_output_as(GuardrailCheck)
+        guardrail_prefilter.remember(input_data, final_output)
     
     if not final_output.is_safe:
         return GuardrailFunctionOutput(output_info=final_output, tripwire_triggered=True)
@@ -145,49 +171,492 @@ async def smart_guardrail(ctx, _agent, input_data):
 
     return GuardrailFunctionOutput(output_info=final_output, tripwire_triggered=False)
 
-triage_agent = Agent(
-    name="Triage Agent",
-    instructions="Determine whether the user's question is about kavak company, or if they're showing intent to buy a car"
-                 "and route the question to the correct agent.",
-    handoffs=[customer_success_agent, car_sales_agent],
-    input_guardrails=[
-        InputGuardrail(guardrail_function=smart_guardrail),
-    ],
-    output_type=AgentOutput
+TRIAGE_AGENT_NAME = "Triage Agent"
+CAR_SALES_AGENT_NAME = "Kavak Car Sales Agent"
+CUSTOMER_SUCCESS_AGENT_NAME = "Kavak customer success agent"
+
+intent_router = IntentRouter(
+    sales_agent=CAR_SALES_AGENT_NAME,
+    support_agent=CUSTOMER_SUCCESS_AGENT_NAME,
+    min_confidence=float(os.getenv("ROUTER_MIN_CONFIDENCE", "0.8")),
+    # Opt-in, it logs what users write.
+    log_path=os.getenv("ROUTING_LOG_PATH") or None
+)
+intent_router.add_sales_terms(set(car_inventory.index.make_index) | set(car_inventory.index.model_index))
+
+class Bot:
+    """The agents wired to one set of vector stores and knowledge base index.
+
+    A refresh builds a whole new Bot and swaps it in, so a turn always runs against a
+    consistent set of resources.
+    """
+
+    def __init__(self, client: OpenAI, vector_store, kb_vector_store, knowledge_base_index: KnowledgeBaseIndex):
+        self.client = client
+        self.vector_store = vector_store
+        self.kb_vector_store = kb_vector_store
+        self.knowledge_base_index = knowledge_base_index
+
+        @function_tool
+        async def search_knowledge_base(query: str) -> str:
+            """Search Kavak's knowledge base for company information, locations, schedules, warranties and payment plans
+
+            Args:
+                query: Keywords describing the information needed, e.g. a city name or "horario centro de inspeccion".
+            """
+            return knowledge_base_index.search(query).model_dump_json()
+
+        self.car_sales_agent = Agent(
+            name=CAR_SALES_AGENT_NAME,
+            handoff_description="Handles car buying intent questions.",
+            instructions=(
+                "You are a sales agent in Kavak. You understand english and spanish and you're only to help the user guiding them with the process of buying a car, you don't provide customer success information."
+                "In all of your communication, make sure you speak as if you're part of the Kavak company"
+                "Follow the following routine with the user:"
+                "1. Ask them about any preferences on car features such as make, model, budget, year or mileage - don't jump into giving them options immediatly without gathering their preferences first"
+                "2. Based on their given preferences, look up for options with the search cars function and bring them some options based on what they need - only use the attached file for details the function doesn't return - if there are no matches, tell the user and start over from 1."
+                "3. If the user explicitly ask for more options, provide them more options keeping the original preferences they gave in 1 by searching again with a larger offset."
+                "4. If the user shows buying intent or gives you one of the car models you provided, offer them a financial plan for that car"
+                "5. If they confirm they want a financial plan, then gather the plan (installments number) and the deposit they are willing to give"
+                "- The user can only ask for 72 installments (6 years) max and a minimum of 36 installments (3 years)"
+                "6. If they provided the installments number (plan) and the deposit, pass the full car data, the plan and the deposit to the create financial plan function and give the created financial plan to the customer - show a resume of the list of installments, along with the interest rate and car price"
+                "7. If they didn't provide the installments number (plan), failed to provide an allowed installments number, or the deposit amount is missing or wrong (it's wrong if they give you a deposit greater or equal the car price), ask for it two or three more times"
+                "- If the user wants to compare several installment numbers or deposits, use the compare financial plans function once with all of them instead of creating one plan at a time, and show a summary table of the options"
+                "8. Help the user with precise answers if they ask any clarifying questions on the financial plan info you provided"
+                "9. Ask them if you can help them with something else related cars information"
+                "- If the user brings up a topic outside of car sales and car stock information, you will ask for triage support, you never offer information you don't have in your possesion"
+            ),
+            tools=[
+                FileSearchTool(
+                    max_num_results=3,
+                    vector_store_ids=[vector_store.id],
+                ),
+                search_cars,
+                create_financial_plan,
+                compare_financial_plans
+            ],
+            output_type=AgentOutput
+        )
+
+        self.customer_success_agent = Agent(
+             name=CUSTOMER_SUCCESS_AGENT_NAME,
+             handoff_description="Handles queries about kavak information such as mission, current status, and information related to inspection centres location and schedules, you can't provide information about car stock or sales",
+             instructions=(
+                "You are a customer success agent in Kavak."
+                "In all of your communication, make sure you speak as if you're part of the Kavak company"
+                "Follow the following routine with the user:"
+                "1. Ask them what do they want to know about kavak and let them know you can help with information regarding the company like current company status and info related to inspection centres location and schedules"
+                "- If they are asking for nearest inspection centres to their location, don't jump into providing options instantly; instead, collect user location references such as the state or city they're located, country, etc"
+                "2. Based on their answer, look up for the requested data with the search knowledge base function, and only query the attached file if the function didn't return it"
+                "- Don't let them know where you're getting the information from"
+                "3. If found, provide the requested information in a very structured, brief and understandable way to the user"
+                "- If the information they requested is not found within the attached file, don't invent one, just let them know unfortunately you don't have that information with you"
+                "- If the user brings up a topic outside of your purview, for instance, showing buying intent, you will ask for triage support, you never offer information about car models to the user"
+            ),
+            tools=[
+                search_knowledge_base,
+                FileSearchTool(
+                    vector_store_ids=[kb_vector_store.id],
+                )
+            ],
+            output_type=AgentOutput
+        )
+
+        self.triage_agent = Agent(
+            name=TRIAGE_AGENT_NAME,
+            instructions="Determine whether the user's question is about kavak company, or if they're showing intent to buy a car"
+                         "and route the question to the correct agent.",
+            handoffs=[self.customer_success_agent, self.car_sales_agent],
+            input_guardrails=[
+                InputGuardrail(guardrail_function=smart_guardrail),
+            ],
+            output_type=AgentOutput
+        )
+
+        self.agents = {
+            agent.name: agent
+            for agent in (self.triage_agent, self.car_sales_agent, self.customer_success_agent)
+        }
+
+        # Turns routed straight to a specialist skip triage, so they keep its guardrail.
+        self.guarded_agents = {
+            agent.name: agent.clone(input_guardrails=[InputGuardrail(guardrail_function=smart_guardrail)])
+            for agent in (self.car_sales_agent, self.customer_success_agent)
+        }
+
+    def agent(self, name: str | None) -> Agent:
+        """Resolve an agent by name, falling back to triage."""
+        return self.agents.get(name, self.triage_agent)
+
+    def routed_agent(self, name: str | None) -> Agent:
+        """The agent to run a turn the router sent its way, guarded like triage."""
+        return self.guarded_agents.get(name, self.triage_agent)
+
+def build_bot(collect_stale: bool = True) -> Bot:
+    """Scrape the knowledge base and set up the vector stores the agents search.
+
+    This blocks on network calls, so async callers should go through warm_up or refresh_bot.
+    """
+    client = OpenAI(api_key=api_key)
+
+    knowledge_base_text = parse_page_content(kb_url, max_age_seconds=kb_cache_max_age_seconds)
+
+    vector_store, kb_vector_store = initialize_bot_stores(
+        client,
+        knowledge_base_text,
+        car_inventory.records,
+        collect_stale=collect_stale
+    )
+
+    return Bot(client, vector_store, kb_vector_store, KnowledgeBaseIndex.load_or_build(knowledge_base_text))
+
+current_bot: Bot | None = None
+bot_lock = threading.Lock()
+warm_up_task: asyncio.Task | None = None
+
+def get_bot() -> Bot:
+    """Return the current bot, building it on first use."""
+    global current_bot
+    with bot_lock:
+        if current_bot is None:
+            current_bot = build_bot()
+    return current_bot
+
+def is_ready() -> bool:
+    return current_bot is not None
+
+async def warm_up() -> Bot:
+    """Build the bot in a worker thread, concurrent callers share the same build."""
+    global warm_up_task
+    if current_bot is not None:
+        return current_bot
+    if warm_up_task is None or warm_up_task.done():
+        warm_up_task = asyncio.create_task(asyncio.to_thread(get_bot))
+    return await asyncio.shield(warm_up_task)
+
+async def refresh_bot() -> Bot:
+    """Build a fresh bot in a worker thread and swap it in.
+
+    Replaced stores are not deleted here since turns in flight may still search them,
+    call collect_stale_stores once they are done.
+    """
+    global current_bot
+    bot = await asyncio.to_thread(build_bot, False)
+    current_bot = bot
+    return bot
+
+async def collect_stale_stores():
+    """Delete the vector stores replaced by previous refreshes."""
+    if current_bot is not None:
+        await asyncio.to_thread(collect_stale_bot_stores, current_bot.client)
+
+def swap_car_stock_store(vector_store):
+    """Swap in a bot searching a new car stock store, the old one is collected as stale."""
+    global current_bot
+    with bot_lock:
+        bot = current_bot
+        if bot is not None and bot.vector_store.id != vector_store.id:
+            current_bot = Bot(bot.client, vector_store, bot.kb_vector_store, bot.knowledge_base_index)
+
+def apply_inventory_snapshot() -> StockDiff:
+    """Reload the stock snapshot, syncing the vector store before the index is swapped."""
+    client = current_bot.client if current_bot is not None else OpenAI(api_key=api_key)
+    
+    diff = car_inventory.reload(before_swap=lambda records, _diff: swap_car_stock_store(sync_car_stock(client, records)))
+    if diff:
+        stock_terms = set(car_inventory.index.make_index) | set(car_inventory.index.model_index)
+        guardrail_prefilter.add_business_terms(stock_terms)
+        intent_router.add_sales_terms(stock_terms)
+        print(f"Car inventory updated to version {car_inventory.version}: {diff.summary()}")
+    return diff
+
+async def reload_inventory() -> StockDiff:
+    """Apply the current stock snapshot without blocking the event loop."""
+    return await asyncio.to_thread(apply_inventory_snapshot)
+
+history_manager = HistoryManager(
+    token_budget=int(os.getenv("HISTORY_TOKEN_BUDGET", "6000")),
+    agent_budgets={
+        CAR_SALES_AGENT_NAME: int(os.getenv("CAR_SALES_HISTORY_TOKEN_BUDGET", "8000")),
+        CUSTOMER_SUCCESS_AGENT_NAME: int(os.getenv("CUSTOMER_SUCCESS_HISTORY_TOKEN_BUDGET", "4000"))
+    }
 )
 
 conversation_context = {}
 
+@dataclass
+class TurnOutcome:
+    message: str
+    last_agent: Agent
+    history: list
+    path: list[str]
+    triage_requested_by: str | None
+    decisions: list[RoutingDecision]
+
+    @property
+    def reran_triage(self) -> bool:
+        return self.triage_requested_by is not None
+
+def handoff_targets(result) -> list[str]:
+    return [item.target_agent.name for item in result.new_items if item.type == "handoff_output_item"]
+
+def route_turn(bot: Bot, conversation: list, requested_by: str | None = None) -> tuple[Agent, RoutingDecision]:
+    """Pick the agent for a turn that would go through triage, a specialist when the router is confident."""
+    decision = intent_router.route(conversation, requested_by)
+    return bot.routed_agent(decision.agent), decision
+
+def record_routing(decision: RoutingDecision | None, result, conversation_id: str | None = None):
+    """Log how a routed run ended."""
+    if decision is not None:
+        intent_router.record(decision, result.last_agent.name, bool(result.final_output.needsTriage), conversation_id)
+
+def stage_span(name: str, agent: Agent):
+    """Span around a stage of the turn, when the caller traces it."""
+    return custom_span(name, {"agent": agent.name}) if get_current_trace() is not None else nullcontext()
+
+async def check_input_guardrails(agent: Agent, runner_input: list, context: dict):
+    """Run an agent's input guardrails to completion, raising InputGuardrailTripwireTriggered if one trips."""
+    wrapper = RunContextWrapper(context=context)
+    with stage_span("input_guardrails", agent):
+        results = await asyncio.gather(*(guardrail.run(agent, runner_input, wrapper) for guardrail in agent.input_guardrails))
+    for result in results:
+        if result.output.tripwire_triggered:
+            raise InputGuardrailTripwireTriggered(result)
+
+async def agent_run_events(agent: Agent, runner_input: list, context: dict, priority: Priority, stage: str, stream: bool):
+    """Run an agent, yielding the stream_agent_message events of streamed runs and then ("result", result).
+    
+    Context managers are never held across a yield, the consumer may close the generator
+    from another context.
+    """
+    if not stream:
+        with llm_scheduler.priority(priority), stage_span(stage, agent):
+            result = await Runner.run(agent, input=runner_input, context=context, run_config=llm_run_config)
+    else:
+        guardrails = None
+        # The run and the guardrails happen in tasks created right here, which inherit the priority.
+        with llm_scheduler.priority(priority):
+            if agent.input_guardrails:
+                # run_streamed never waits for input guardrails and cancels them once the model is
+                # done, which for a routed specialist is before they can trip. They're run here instead.
+                guardrails = asyncio.create_task(check_input_guardrails(agent, runner_input, context))
+                agent = agent.clone(input_guardrails=[])
+            result = Runner.run_streamed(agent, input=runner_input, context=context, run_config=llm_run_config)
+        try:
+            async for event in stream_agent_message(result, guardrails):
+                yield event
+        except BaseException:
+            result.cancel()
+            raise
+        finally:
+            if guardrails is not None and not guardrails.done():
+                guardrails.cancel()
+    yield "result", result
+
+async def turn_events(
+    bot: Bot,
+    agent: Agent,
+    history: list,
+    user_input: str,
+    context: dict,
+    conversation_id: str | None = None,
+    stream: bool = False
+):
+    """Run one user turn, ending with ("outcome", TurnOutcome).
+    
+    Turns that would go through triage are routed locally first, and a turn whose agent
+    sets needsTriage is routed again. Streamed turns also yield the stream_agent_message
+    events, plus ("reset", "") when a re-routed run replaces the text streamed so far.
+    """
+    runner_input = history + [{"content": user_input, "role": "user"}]
+    decision = None
+    if agent is bot.triage_agent:
+        agent, decision = route_turn(bot, runner_input)
+    path = [agent.name]
+    decisions = []
+    triage_requested_by = None
+    priority = Priority.CONTINUING if history else Priority.NEW
+    
+    async for event, data in agent_run_events(agent, runner_input, context, priority, "agent_run", stream):
+        if event == "result":
+            result = data
+        else:
+            yield event, data
+    path += handoff_targets(result)
+    
+    if result.final_output.needsTriage:
+        triage_requested_by = result.last_agent.name
+        record_routing(decision, result, conversation_id)
+        if decision is not None:
+            decisions.append(decision)
+        agent, decision = route_turn(bot, runner_input, requested_by=triage_requested_by)
+        if stream:
+            yield "reset", ""
+        async for event, data in agent_run_events(agent, runner_input, context, priority, "triage_rerun", stream):
+            if event == "result":
+                result = data
+            else:
+                yield event, data
+        path += [agent.name] + handoff_targets(result)
+    
+    record_routing(decision, result, conversation_id)
+    if decision is not None:
+        decisions.append(decision)
+    
+    if hasattr(result.final_output, "message"):
+        message = result.final_output.message
+    else:
+        message = "I'm processing your request but couldn't generate a response."
+    
+    yield "outcome", TurnOutcome(
+        message=message,
+        # The unguarded agent, like the API resolves it, so later turns don't re-run the guardrail.
+        last_agent=bot.agent(result.last_agent.name),
+        history=history_manager.compact(result.to_input_list(), result.last_agent.name),
+        path=path,
+        triage_requested_by=triage_requested_by,
+        decisions=decisions
+    )
+
+async def run_turn(
+    bot: Bot,
+    agent: Agent,
+    history: list,
+    user_input: str,
+    context: dict,
+    conversation_id: str | None = None
+) -> TurnOutcome:
+    """Run one user turn without streaming, see turn_events."""
+    async for event, data in turn_events(bot, agent, history, user_input, context, conversation_id):
+        if event == "outcome":
+            return data
+
 async def cli_conversation():
+    bot = await warm_up()
     conversation_history = []
-    last_agent = triage_agent
+    last_agent = bot.triage_agent
     print("Start chatting with your assistant (type 'exit', 'quit'. or 'bye' to stop):\n")
     
     while True:
-        user_input = input("User: ")
+        user_input = await asyncio.to_thread(input, "User: ")
         if user_input.strip().lower() in {"exit", "quit", "bye"}:
             break
         
         try:
-            runner_input = conversation_history + [{"content": user_input, "role": "user"}]
-            result = await Runner.run(last_agent, input=runner_input, context=conversation_context)
+            turn = await run_turn(bot, last_agent, conversation_history, user_input, conversation_context)
             
-            if result.final_output.needsTriage:
-                print("Transferring to another agent:")
-                last_agent = triage_agent
-                result = await Runner.run(last_agent, input=runner_input, context=conversation_context)
-                
-            print("result:", result.last_agent.name)
-            conversation_history = result.to_input_list()
-            last_agent = result.last_agent
+            if turn.reran_triage:
+                print("Rerouted after a triage request")
+            print("result:", " -> ".join(turn.path))
+            last_agent = turn.last_agent
+            conversation_history = turn.history
             
-            if hasattr(result.final_output, "message"):
-                print(f"{last_agent.name}: ", result.final_output.message)
+            print(f"{last_agent.name}: ", turn.message)
         except Exception as e:
             if "tripwire" in str(e).lower():
                 print("Sorry, i can't respond to that, please rephrase.")
             else:
                 print(f"Error: {e}")
 
+def load_conversations(path: str) -> list[dict]:
+    """Read scripted conversations, one JSON object per line.
+    
+    Each has an optional "id" and a list of "turns", every turn being the user message or
+    an object with "user" and the "expected_agent" that should answer it.
+    """
+    conversations = []
+    with open(path, "r", encoding="utf-8") as blob:
+        for line_number, line in enumerate(blob, start=1):
+            if not line.strip():
+                continue
+            conversation = json.loads(line)
+            conversation.setdefault("id", str(line_number))
+            conversation["turns"] = [
+                turn if isinstance(turn, dict) else {"user": turn}
+                for turn in conversation["turns"]
+            ]
+            conversations.append(conversation)
+    return conversations
+
+async def run_scripted_conversation(bot: Bot, conversation: dict) -> dict:
+    """Play a scripted conversation from a fresh session, recording every turn."""
+    history = []
+    context = {}
+    agent = bot.triage_agent
+    turns = []
+    started = time.perf_counter()
+    
+    for turn in conversation["turns"]:
+        record = {"user": turn["user"], "expected_agent": turn.get("expected_agent")}
+        turn_started = time.perf_counter()
+        try:
+            outcome = await run_turn(bot, agent, history, turn["user"], context)
+            agent, history = outcome.last_agent, outcome.history
+            record.update(reply=outcome.message, agent=agent.name, path=outcome.path, reran_triage=outcome.reran_triage, error=None)
+        except Exception as e:
+            tripwire = "tripwire" in str(e).lower()
+            record.update(reply=None, agent=None, path=[agent.name], reran_triage=False, error="guardrail_tripwire" if tripwire else str(e))
+        record["seconds"] = round(time.perf_counter() - turn_started, 3)
+        if record["expected_agent"]:
+            record["routed_correctly"] = record["agent"] == record["expected_agent"]
+        turns.append(record)
+    
+    return {
+        "id": conversation["id"],
+        "turns": turns,
+        "seconds": round(time.perf_counter() - started, 3)
+    }
+
+async def run_batch(input_path: str, output_path: str, concurrency: int = 4) -> dict:
+    """Run scripted conversations concurrently and write one result line per conversation."""
+    bot = await warm_up()
+    conversations = load_conversations(input_path)
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.perf_counter()
+    
+    async def run_bounded(conversation: dict) -> dict:
+        async with semaphore:
+            return await run_scripted_conversation(bot, conversation)
+    
+    results = []
+    with open(output_path, "w", encoding="utf-8") as output:
+        for finished in asyncio.as_completed([run_bounded(conversation) for conversation in conversations]):
+            result = await finished
+            results.append(result)
+            # Written as soon as each conversation ends, so an interrupted run keeps its results.
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+            print(f"Finished conversation {result['id']} ({len(results)}/{len(conversations)})")
+    
+    elapsed = time.perf_counter() - started
+    turns = [turn for result in results for turn in result["turns"]]
+    graded = [turn["routed_correctly"] for turn in turns if "routed_correctly" in turn]
+    timings = [turn["seconds"] for turn in turns]
+    summary = {
+        "conversations": len(results),
+        "turns": len(turns),
+        "errors": sum(1 for turn in turns if turn["error"]),
+        "triage_reruns": sum(1 for turn in turns if turn["reran_triage"]),
+        "routing_accuracy": round(sum(graded) / len(graded), 3) if graded else None,
+        "turns_per_second": round(len(turns) / elapsed, 2) if elapsed else 0.0,
+        "turn_seconds_p50": round(float(np.percentile(timings, 50)), 3) if timings else None,
+        "turn_seconds_p95": round(float(np.percentile(timings, 95)), 3) if timings else None,
+        "elapsed_seconds": round(elapsed, 3)
+    }
+    print(json.dumps(summary, indent=2))
+    return summary
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Chat with the Kavak bot, or replay scripted conversations")
+    parser.add_argument("--batch", help="JSONL file of scripted conversations to run instead of the interactive chat")
+    parser.add_argument("--output", help="Where to write the batch results, defaults to <batch>.results.jsonl")
+    parser.add_argument("--concurrency", type=int, default=4, help="Conversations run at once in batch mode")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    asyncio.run(cli_conversation())
\ No newline at end of file
+    args = parse_args()
+    if args.batch:
+        output_path = args.output or f"{os.path.splitext(args.batch)[0]}.results.jsonl"
+        asyncio.run(run_batch(args.batch, output_path, args.concurrency))
+    else:
+        asyncio.run(cli_conversation())
@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import Optional
 
 class GuardrailCheck(BaseModel):
     is_business: bool
@@ -15,6 +16,21 @@ class FinancialPlan(BaseModel):
     total_paid: float
     installments: list[Installment]
     annual_interest_rate: float
+
+class FinancialPlanOption(BaseModel):
+    plan: int
+    deposit: float
+    monthly_payment: float
+    total_paid: float
+    total_interest: float
+    first_payment_date: str
+    last_payment_date: str
+    installments: Optional[list[Installment]] = None
+
+class FinancialPlanComparison(BaseModel):
+    car_price: float
+    annual_interest_rate: float
+    options: list[FinancialPlanOption]
     
 class CarData(BaseModel):
     stock_id: int
@@ -24,6 +40,25 @@ class CarData(BaseModel):
     year: str
     version: str
 
+class CarListing(CarData):
+    km: int
+    bluetooth: bool
+    car_play: bool
+
+class CarSearchResult(BaseModel):
+    total_matches: int
+    offset: int
+    cars: list[CarListing]
+
+class KnowledgeBaseChunk(BaseModel):
+    section: str
+    text: str
+    score: float
+
+class KnowledgeBaseResult(BaseModel):
+    chunks: list[KnowledgeBaseChunk]
+
 class AgentOutput(BaseModel):
-    message: str
-    needsTriage: bool
\ No newline at end of file
+    # Generated first, so a streamed reply is known to be discarded before its text arrives.
+    needsTriage: bool
+    message: str
\ No newline at end of file
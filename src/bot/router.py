@@ -0,0 +1,185 @@
+"""
+Local intent routing between the specialist agents.
+When a turn would go through the triage agent, either because the conversation hasn't
+reached a specialist yet or because one asked for triage, the latest user message is
+scored locally as car sales or customer success and the turn goes straight to that agent.
+The triage agent and its handoff are only used when the score isn't confident. Routing
+only picks an agent, the caller keeps the input guardrail on the routed run.
+"""
+import json
+import math
+import threading
+import time
+from dataclasses import dataclass, field
+from src.bot.guardrails import COMMON_WORDS, LexicalModel, latest_user_text, normalize_input
+
+SALES = "sales"
+SUPPORT = "support"
+
+KEYWORD_WEIGHT = 2.0
+REQUESTER_WEIGHT = 1.5
+
+SALES_TERMS = {
+    "comprar", "compra", "buy", "buying", "precio", "precios", "price", "cuesta", "cuestan", "barato", "economico",
+    "financiamiento", "financiar", "financing", "credito", "mensualidad", "mensualidades", "plazo", "plazos",
+    "enganche", "deposito", "deposit", "installments", "cuotas", "km", "kilometraje", "mileage", "modelo",
+    "marca", "version", "sedan", "suv", "camioneta", "pickup", "hatchback", "opciones", "options", "stock",
+    "disponibles", "available", "presupuesto", "budget", "bluetooth", "carplay", "automatico", "manual"
+}
+
+SUPPORT_TERMS = {
+    "sede", "sedes", "sucursal", "sucursales", "centro", "centros", "inspeccion", "horario", "horarios",
+    "garantia", "warranty", "ubicacion", "ubicaciones", "direccion", "donde", "where", "location", "locations",
+    "schedule", "abren", "cierran", "open", "mision", "mission", "empresa", "company", "oficina", "oficinas",
+    "devolucion", "reembolso", "refund", "tramite", "tramites", "estado", "ciudad", "city"
+}
+
+TRAINING_PHRASES = {
+    SALES: [
+        "quiero comprar un auto", "busco un carro usado", "que autos tienen disponibles",
+        "me interesa un toyota corolla", "cuanto cuesta el auto", "tienen suv de 2020",
+        "quiero un plan de financiamiento", "cuanto seria la mensualidad a 48 meses",
+        "puedo dar un enganche de 50000", "i want to buy a car", "show me cars under 300000",
+        "what financing options do you have", "do you have a bmw", "autos con menos de 50000 km",
+        "me gustaria ver opciones de camionetas", "tienen autos con carplay", "muestrame mas opciones",
+        "cual es el mas barato", "quiero ese", "me interesa el segundo", "a 60 meses con 80000 de enganche",
+    ],
+    SUPPORT: [
+        "donde estan sus sedes", "horario del centro de inspeccion", "que es kavak",
+        "como funciona la garantia", "where is the nearest inspection center", "que opciones hay en monterrey",
+        "a que hora abren", "tienen sucursal en guadalajara", "cual es la mision de kavak",
+        "como va la empresa", "estoy en la ciudad de mexico", "what are your opening hours",
+        "como hago una devolucion", "cuanto dura la garantia", "vivo en puebla donde los encuentro",
+    ],
+}
+
+@dataclass
+class RoutingDecision:
+    """Where a turn goes, `agent` is None when it's left to the triage agent."""
+    agent: str | None
+    intent: str | None
+    confidence: float
+    reason: str
+    text: str
+    requested_by: str | None = None
+    scores: dict = field(default_factory=dict)
+
+class IntentRouter:
+    """Scores sales vs. customer success intent and picks the specialist for a turn."""
+
+    def __init__(
+        self,
+        sales_agent: str,
+        support_agent: str,
+        min_confidence: float = 0.8,
+        log_path: str | None = None
+    ):
+        self.agents = {SALES: sales_agent, SUPPORT: support_agent}
+        self.min_confidence = min_confidence
+        self.log_path = log_path
+        self.model = LexicalModel(TRAINING_PHRASES)
+        self.terms = {SALES: set(SALES_TERMS), SUPPORT: set(SUPPORT_TERMS)}
+        self.lock = threading.Lock()
+        self.decisions = 0
+        self.direct = 0
+        self.fallbacks = 0
+        self.accepted = 0
+        self.bounced = 0
+
+    def add_sales_terms(self, terms: set[str]):
+        """Extend the sales vocabulary, e.g. with makes and models of new stock."""
+        self.terms[SALES] = self.terms[SALES] | {normalize_input(term) for term in terms}
+
+    def score(self, text: str, requested_by: str | None = None) -> dict[str, float]:
+        """Log-odds of each intent from the lexical model, keyword hits and the requesting agent."""
+        words = set(text.split())
+        # Function words alone say nothing about the intent.
+        label, probability = self.model.predict(" ".join(word for word in text.split() if word not in COMMON_WORDS))
+        # The model is binary, so its posterior turns into log-odds for one side.
+        probability = min(max(probability, 0.01), 0.99)
+        model_odds = math.log(probability / (1 - probability)) if label in self.agents else 0.0
+
+        scores = {}
+        for intent, terms in self.terms.items():
+            hits = len(words & terms) + sum(1 for term in terms if " " in term and term in text)
+            scores[intent] = KEYWORD_WEIGHT * hits + (model_odds if intent == label else 0.0)
+            # An agent asking for triage is saying the user wants the other one.
+            if requested_by is not None and requested_by != self.agents[intent]:
+                scores[intent] += REQUESTER_WEIGHT
+        return scores
+
+    def route(self, input_data, requested_by: str | None = None) -> RoutingDecision:
+        """Pick the specialist for the latest user message, or leave it to triage."""
+        text = normalize_input(latest_user_text(input_data))
+        scores = self.score(text, requested_by)
+        intent = max(scores, key=scores.get)
+        other = min(scores, key=scores.get)
+        margin = scores[intent] - scores[other]
+        confidence = 1 / (1 + math.exp(-margin))
+
+        if confidence < self.min_confidence:
+            return self.decide(None, intent, confidence, "low confidence", text, requested_by, scores)
+        if self.agents[intent] == requested_by:
+            return self.decide(None, intent, confidence, "intent matches the requesting agent", text, requested_by, scores)
+        return self.decide(self.agents[intent], intent, confidence, "local intent", text, requested_by, scores)
+
+    def decide(self, agent, intent, confidence, reason, text, requested_by, scores) -> RoutingDecision:
+        with self.lock:
+            self.decisions += 1
+            if agent is None:
+                self.fallbacks += 1
+            else:
+                self.direct += 1
+        return RoutingDecision(
+            agent=agent,
+            intent=intent,
+            confidence=round(confidence, 4),
+            reason=reason,
+            text=text,
+            requested_by=requested_by,
+            scores={intent: round(score, 3) for intent, score in scores.items()}
+        )
+
+    def record(self, decision: RoutingDecision, answered_by: str, needs_triage: bool, conversation_id: str | None = None):
+        """Log a decision with its outcome, for offline evaluation of the router.
+
+        For fallbacks `answered_by` is the agent triage chose, which labels the input; for
+        direct routes `needs_triage` tells whether the specialist bounced the turn.
+        """
+        if decision.agent is not None:
+            with self.lock:
+                if needs_triage:
+                    self.bounced += 1
+                else:
+                    self.accepted += 1
+        if not self.log_path:
+            return
+
+        record = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "conversation_id": conversation_id,
+            "text": decision.text,
+            "requested_by": decision.requested_by,
+            "routed_to": decision.agent or "triage",
+            "intent": decision.intent,
+            "confidence": decision.confidence,
+            "scores": decision.scores,
+            "reason": decision.reason,
+            "answered_by": answered_by,
+            "needs_triage": needs_triage
+        }
+        try:
+            with self.lock, open(self.log_path, "a", encoding="utf-8") as blob:
+                blob.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"Error writing routing decision: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "decisions": self.decisions,
+            "direct": self.direct,
+            "fallbacks": self.fallbacks,
+            "accepted": self.accepted,
+            "bounced": self.bounced,
+            "direct_rate": self.direct / self.decisions if self.decisions else 0.0
+        }
@@ -0,0 +1,251 @@
+"""
+Central scheduler for model calls.
+Every model request made by any agent run goes through one LLMScheduler. Requests
+wait in a priority queue until a concurrency slot and enough request and token budget are
+free, so traffic spikes turn into short queues instead of rate limit errors. Continuing
+conversations are served before new ones. On a 429, the concurrency limit is halved and
+dispatch pauses. Successful calls grow the limit back one slot at a time.
+
+Scheduling is done per model request rather than per Runner.run, since an agent run holding
+a slot while its guardrail waits for another one could deadlock the pool.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import AsyncIterator, Callable, Optional
+from agents import Model, ModelProvider, RunConfig
+from agents.models.multi_provider import MultiProvider
+from openai import RateLimitError
+
+CHARS_PER_TOKEN = 4
+OUTPUT_TOKEN_ALLOWANCE = 600
+MAX_RATE_LIMIT_RETRIES = 4
+
+class Priority(IntEnum):
+    CONTINUING = 0
+    NEW = 1
+
+current_priority: ContextVar[Priority] = ContextVar("llm_priority", default=Priority.NEW)
+
+class TokenBucket:
+    """Refills at `rate` units per second up to `capacity`, and may go negative when a
+    request used more than was estimated."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` is available, requests larger than the capacity only wait for a full bucket."""
+        self.refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float):
+        self.level -= amount
+
+def estimate_tokens(system_instructions: str | None, input) -> int:
+    text = input if isinstance(input, str) else json.dumps(input, default=str)
+    return (len(system_instructions or "") + len(text)) // CHARS_PER_TOKEN + OUTPUT_TOKEN_ALLOWANCE
+
+def retry_after_seconds(error: RateLimitError) -> float | None:
+    value = error.response.headers.get("retry-after") if error.response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+class LLMScheduler:
+    """Priority queue of model requests with a concurrency cap and token bucket rate limits."""
+
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        requests_per_minute: float = 500,
+        tokens_per_minute: float = 200000,
+        burst_seconds: float = 10,
+        backoff_seconds: float = 1.0,
+        max_backoff_seconds: float = 30.0
+    ):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.request_bucket = TokenBucket(requests_per_minute / 60, requests_per_minute / 60 * burst_seconds)
+        self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute / 60 * burst_seconds)
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.queue: list[tuple[int, int, int, float, asyncio.Future]] = []
+        self.sequence = itertools.count()
+        self.in_flight = 0
+        self.successes = 0
+        self.consecutive_rate_limits = 0
+        self.paused_until = 0.0
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.on_wait: Optional[Callable[[Priority, float], None]] = None
+        self.granted = 0
+        self.rate_limited = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    @contextmanager
+    def priority(self, priority: Priority):
+        """Run the model calls made inside the block at the given priority."""
+        token = current_priority.set(priority)
+        try:
+            yield
+        finally:
+            current_priority.reset(token)
+
+    async def acquire(self, estimated_tokens: int):
+        """Wait for a slot and the budget for one request, highest priority first."""
+        priority = current_priority.get()
+        future = asyncio.get_running_loop().create_future()
+        queued_at = time.monotonic()
+        heapq.heappush(self.queue, (priority, next(self.sequence), estimated_tokens, queued_at, future))
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(estimated_tokens, estimated_tokens)
+            raise
+
+        waited = time.monotonic() - queued_at
+        self.wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        if self.on_wait is not None:
+            self.on_wait(priority, waited)
+
+    def release(self, estimated_tokens: int, used_tokens: int, rate_limited: bool = False, retry_after: float | None = None):
+        """Free the slot, settling the token budget with what the request actually used."""
+        self.in_flight -= 1
+        self.token_bucket.take(used_tokens - estimated_tokens)
+
+        if rate_limited:
+            self.rate_limited += 1
+            self.consecutive_rate_limits += 1
+            self.limit = max(1, self.limit // 2)
+            self.successes = 0
+            backoff = retry_after or min(
+                self.max_backoff_seconds, self.backoff_seconds * 2 ** (self.consecutive_rate_limits - 1)
+            )
+            self.paused_until = max(self.paused_until, time.monotonic() + backoff)
+        else:
+            self.consecutive_rate_limits = 0
+            self.successes += 1
+            if self.successes >= self.limit and self.limit < self.max_concurrency:
+                self.limit += 1
+                self.successes = 0
+        self._dispatch()
+
+    def _dispatch(self):
+        """Grant queued requests while slots and budget allow, or retry once they will."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        while self.queue and self.in_flight < self.limit:
+            _, _, estimated_tokens, _, future = self.queue[0]
+            if future.done():
+                heapq.heappop(self.queue)
+                continue
+
+            now = time.monotonic()
+            wait = max(
+                self.paused_until - now,
+                self.request_bucket.wait_time(1, now),
+                self.token_bucket.wait_time(estimated_tokens, now)
+            )
+            if wait > 0:
+                self.timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+
+            heapq.heappop(self.queue)
+            self.request_bucket.take(1)
+            self.token_bucket.take(estimated_tokens)
+            self.in_flight += 1
+            self.granted += 1
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        queued = [entry for entry in self.queue if not entry[4].done()]
+        return {
+            "queued": {priority.name.lower(): sum(1 for entry in queued if entry[0] == priority) for priority in Priority},
+            "in_flight": self.in_flight,
+            "concurrency_limit": self.limit,
+            "granted": self.granted,
+            "rate_limited": self.rate_limited,
+            "paused_seconds": round(max(0.0, self.paused_until - time.monotonic()), 3),
+            "average_wait_seconds": round(self.wait_seconds / self.granted, 4) if self.granted else 0.0,
+            "max_wait_seconds": round(self.max_wait_seconds, 4)
+        }
+
+class ScheduledModel(Model):
+    """Model wrapper that runs every request through the scheduler, retrying 429s."""
+
+    def __init__(self, model: Model, scheduler: LLMScheduler):
+        self.model = model
+        self.scheduler = scheduler
+
+    async def get_response(self, system_instructions, input, *args, **kwargs):
+        estimated_tokens = estimate_tokens(system_instructions, input)
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            await self.scheduler.acquire(estimated_tokens)
+            try:
+                response = await self.model.get_response(system_instructions, input, *args, **kwargs)
+            except RateLimitError as e:
+                self.scheduler.release(estimated_tokens, estimated_tokens, rate_limited=True, retry_after=retry_after_seconds(e))
+                if attempt == MAX_RATE_LIMIT_RETRIES:
+                    raise
+                continue
+            except BaseException:
+                self.scheduler.release(estimated_tokens, estimated_tokens)
+                raise
+            self.scheduler.release(estimated_tokens, response.usage.total_tokens or estimated_tokens)
+            return response
+
+    async def stream_response(self, system_instructions, input, *args, **kwargs) -> AsyncIterator:
+        estimated_tokens = estimate_tokens(system_instructions, input)
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            await self.scheduler.acquire(estimated_tokens)
+            used_tokens = estimated_tokens
+            started = False
+            try:
+                async for event in self.model.stream_response(system_instructions, input, *args, **kwargs):
+                    started = True
+                    if event.type == "response.completed" and event.response.usage is not None:
+                        used_tokens = event.response.usage.total_tokens
+                    yield event
+            except RateLimitError as e:
+                self.scheduler.release(estimated_tokens, used_tokens, rate_limited=True, retry_after=retry_after_seconds(e))
+                # Events already streamed can't be taken back, so only a request that failed upfront is retried.
+                if started or attempt == MAX_RATE_LIMIT_RETRIES:
+                    raise
+                continue
+            except BaseException:
+                self.scheduler.release(estimated_tokens, used_tokens)
+                raise
+            self.scheduler.release(estimated_tokens, used_tokens)
+            return
+
+class ScheduledModelProvider(ModelProvider):
+    def __init__(self, scheduler: LLMScheduler, provider: ModelProvider | None = None):
+        self.scheduler = scheduler
+        self.provider = provider or MultiProvider()
+
+    def get_model(self, model_name: str | None) -> Model:
+        return ScheduledModel(self.provider.get_model(model_name), self.scheduler)
+
+def scheduled_run_config(scheduler: LLMScheduler) -> RunConfig:
+    """RunConfig to pass to every Runner call so its model requests are scheduled."""
+    return RunConfig(model_provider=ScheduledModelProvider(scheduler))
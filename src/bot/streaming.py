@@ -0,0 +1,138 @@
+"""
+Streaming of agent replies.
+Agents answer with an AgentOutput JSON object, so the raw model deltas are JSON text. The
+decoder below pulls the characters of its "message" field out of the fragments as they
+arrive, which is what gets streamed to the user. The needsTriage flag comes before the
+message, so whether the reply will be discarded is known before any of it is delivered.
+"""
+import asyncio
+import json
+import re
+from typing import AsyncIterator
+from agents import RunResultStreaming
+
+TRIAGE_FLAG_PATTERN = re.compile(r'"needsTriage"\s*:\s*(true|false)')
+
+ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+class MessageFieldDecoder:
+    """Incrementally decodes one string field of a JSON object streamed in fragments."""
+
+    def __init__(self, field: str = "message"):
+        self.pattern = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self.reset()
+
+    def reset(self):
+        self.buffer = ""
+        self.position: int | None = None
+        self.closed = False
+
+    def feed(self, fragment: str) -> str:
+        """Add a fragment and return the field characters it completed, if any."""
+        self.buffer += fragment
+        if self.closed:
+            return ""
+        if self.position is None:
+            match = self.pattern.search(self.buffer)
+            if match is None:
+                return ""
+            self.position = match.end()
+
+        buffer, i, decoded = self.buffer, self.position, []
+        while i < len(buffer):
+            char = buffer[i]
+            if char == '"':
+                self.closed = True
+                break
+            if char != "\\":
+                decoded.append(char)
+                i += 1
+                continue
+            # Escapes are only decoded once complete, a split one waits for the next fragment.
+            if i + 1 >= len(buffer):
+                break
+            if buffer[i + 1] != "u":
+                decoded.append(ESCAPES.get(buffer[i + 1], buffer[i + 1]))
+                i += 2
+                continue
+            if i + 6 > len(buffer):
+                break
+            code = int(buffer[i + 2:i + 6], 16)
+            if 0xD800 <= code < 0xDC00:
+                if i + 12 > len(buffer):
+                    break
+                decoded.append(json.loads(f'"{buffer[i:i + 12]}"'))
+                i += 12
+            else:
+                decoded.append(chr(code))
+                i += 6
+        self.position = i
+        return "".join(decoded)
+
+async def stream_agent_message(result: RunResultStreaming, guardrails: asyncio.Task | None = None) -> AsyncIterator[tuple[str, str]]:
+    """Yield ("agent", name) when an agent takes over, ("needs_triage", "true" or "false") once
+    the reply's flag is known and ("delta", text) for its reply.
+
+    Every model response starts a new AgentOutput, e.g. after a tool call or a handoff, so
+    the decoder is reset on each one. `guardrails` is the task checking the run's input, the
+    flag is held back until it has passed and its error is raised as soon as it trips. Text
+    is only yielded after a "false" flag, a reply to a tripped input or one flagged for
+    triage never reaches the user.
+    """
+    decoder = MessageFieldDecoder()
+    flag_found = False
+    pending_flag = None
+    released_flag = None
+    held = []
+
+    def input_cleared() -> bool:
+        if guardrails is None:
+            return True
+        if not guardrails.done():
+            return False
+        # Raises the tripwire when a guardrail tripped.
+        guardrails.result()
+        return True
+
+    def release() -> list[tuple[str, str]]:
+        nonlocal pending_flag, released_flag, held
+        events = [("needs_triage", pending_flag)]
+        if pending_flag == "false" and held:
+            events.append(("delta", "".join(held)))
+        released_flag, pending_flag, held = pending_flag, None, []
+        return events
+
+    async for event in result.stream_events():
+        if pending_flag is not None and input_cleared():
+            for released in release():
+                yield released
+        if event.type == "agent_updated_stream_event":
+            yield "agent", event.new_agent.name
+        elif event.type == "raw_response_event":
+            if event.data.type == "response.created":
+                decoder.reset()
+                flag_found = False
+                pending_flag = released_flag = None
+                held = []
+            elif event.data.type == "response.output_text.delta":
+                text = decoder.feed(event.data.delta)
+                if not flag_found:
+                    match = TRIAGE_FLAG_PATTERN.search(decoder.buffer)
+                    if match:
+                        flag_found = True
+                        pending_flag = match.group(1)
+                        if input_cleared():
+                            for released in release():
+                                yield released
+                if not text:
+                    continue
+                if released_flag == "false":
+                    yield "delta", text
+                elif released_flag is None:
+                    held.append(text)
+
+    if guardrails is not None:
+        await guardrails
+    if pending_flag is not None:
+        for released in release():
+            yield released
@@ -1,86 +1,380 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
 import requests
-from bs4 import BeautifulSoup
-from openai import OpenAI
+from contextlib import contextmanager
+from lxml import etree
+from openai import OpenAI, OpenAIError, NotFoundError
 
-def parse_page_content(url: str) -> str:
-    response = requests.get(url)
-    response.raise_for_status()
+CAR_STOCK_PATH = "resources/car_stock.json"
+KNOWLEDGE_BASE_PATH = "resources/kavak_knowledge_base.txt"
+MANIFEST_PATH = "resources/vector_store_manifest.json"
+KB_PAGE_CACHE_PATH = "resources/kb_page_cache.json"
+KB_CACHE_MAX_AGE_SECONDS = 86400
+CAR_STOCK_SHARDS = 16
+
+SKIPPED_TAGS = {"header", "nav", "footer", "script", "style", "template"}
+SKIPPED_DIV_CLASSES = {"single-post-header", "sidebar"}
+CAPTURED_TAGS = {"h3": "- ", "li": "-- ", "h2": ""}
+
+class PageContentFormatter:
+    """lxml parser target that cleans and formats the knowledge base page in a single pass.
     
-    soup = BeautifulSoup(response.text, 'html.parser')
-    content = soup.body
+    Headers, navigation, footers, sidebars and the post header are skipped, h3 titles are
+    written as '- TITLE', list items as '-- ITEM' and h2 titles in upper case; every other
+    text node becomes its own stripped line.
+    """
     
-    for post_header in content.find_all('div', class_='single-post-header'):
-        post_header.decompose()
-        
-    for sidebar in content.find_all('div', class_='sidebar'):
-        sidebar.decompose()
-        
-    for header in content.find_all('header'):
-        header.decompose()
+    def __init__(self):
+        self.lines = []
+        self.pending = []
+        self.in_body = False
+        self.skip_depth = 0
+        self.capture = None
+        self.capture_depth = 0
+        self.captured = []
+    
+    def start(self, tag, attrib):
+        self.flush()
+        if tag == "body":
+            self.in_body = True
+        classes = set((attrib.get("class") or "").split())
+        if self.skip_depth or tag in SKIPPED_TAGS or (tag == "div" and classes & SKIPPED_DIV_CLASSES):
+            self.skip_depth += 1
+        elif self.capture:
+            self.capture_depth += 1
+        elif tag in CAPTURED_TAGS:
+            self.capture, self.capture_depth, self.captured = tag, 1, []
+    
+    def end(self, tag):
+        self.flush()
+        if self.skip_depth:
+            self.skip_depth -= 1
+        elif self.capture:
+            self.capture_depth -= 1
+            if not self.capture_depth:
+                inner_text = " ".join(self.captured).upper()
+                self.lines.append(f"{CAPTURED_TAGS[self.capture]}{inner_text}".strip())
+                self.capture = None
+        if tag == "body":
+            self.in_body = False
+    
+    def data(self, data):
+        self.pending.append(data)
+    
+    def comment(self, text):
+        self.flush()
+    
+    def flush(self):
+        """Text nodes can arrive in several data calls, emit them once complete."""
+        text = "".join(self.pending).strip()
+        self.pending = []
+        if not text or not self.in_body or self.skip_depth:
+            return
+        if self.capture:
+            self.captured.append(text)
+        else:
+            self.lines.append(text)
+    
+    def close(self):
+        self.flush()
+        return "\n".join(line for line in self.lines if line)
+
+def format_page_content(chunks, encoding: str | None = None) -> str:
+    """Feed the page to the formatter as it is downloaded."""
+    parser = etree.HTMLParser(target=PageContentFormatter(), encoding=encoding)
+    for chunk in chunks:
+        if chunk:
+            parser.feed(chunk)
+    return parser.close()
+
+def load_page_cache(path: str = KB_PAGE_CACHE_PATH) -> dict | None:
+    try:
+        with open(path, "r", encoding="utf-8") as blob:
+            return json.load(blob)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def save_page_cache(cache: dict, path: str = KB_PAGE_CACHE_PATH):
+    # Several workers may refresh the cache at once, each writes its own temporary file.
+    with tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=os.path.dirname(path) or ".", prefix=os.path.basename(path), suffix=".tmp", delete=False
+    ) as blob:
+        json.dump(cache, blob, ensure_ascii=False)
+    os.replace(blob.name, path)
+
+def parse_page_content(url: str, max_age_seconds: float = KB_CACHE_MAX_AGE_SECONDS, cache_path: str = KB_PAGE_CACHE_PATH) -> str:
+    """Return the formatted knowledge base page, using the on-disk cache when possible.
+    
+    A cached copy younger than max_age_seconds is returned without any request, an older
+    one is revalidated with ETag/If-Modified-Since and reused as is on a 304.
+    """
+    cache = load_page_cache(cache_path)
+    headers = {}
+    
+    if cache and cache.get("url") == url:
+        if time.time() - cache["fetched_at"] < max_age_seconds:
+            return cache["text"]
+        if cache.get("etag"):
+            headers["If-None-Match"] = cache["etag"]
+        if cache.get("last_modified"):
+            headers["If-Modified-Since"] = cache["last_modified"]
+    else:
+        cache = None
+    
+    with requests.get(url, headers=headers, stream=True, timeout=30) as response:
+        if response.status_code == 304 and cache:
+            cache["fetched_at"] = time.time()
+            save_page_cache(cache, cache_path)
+            return cache["text"]
         
-    for nav in content.find_all('nav'):
-        nav.decompose()
+        response.raise_for_status()
         
-    for footer in content.find_all('footer'):
-        footer.decompose()
+        # Without an explicit charset let lxml pick it up from the page's meta tags.
+        encoding = response.encoding if "charset" in response.headers.get("Content-Type", "") else None
+        text = format_page_content(response.iter_content(chunk_size=64 * 1024), encoding)
         
-    for h3 in content.find_all('h3'):
-        if h3.string: 
-            h3.string.replace_with(f"- {h3.string.upper()}")
-        else:
-            inner_text = h3.get_text(separator=' ', strip=True)
-            h3.clear()
-            h3.append(f"- {inner_text.upper()}\n")
-            
-    for li in content.find_all('li'):
-        if li.string: 
-            li.string.replace_with(f"-- {li.string.upper()}")
-        else:
-            inner_text = li.get_text(separator=' ', strip=True)
-            li.clear()
-            li.append(f"-- {inner_text.upper()}\n")
-            
-    for h2 in content.find_all('h2'):
-        if h2.string: 
-            h2.string.replace_with(f"{h3.string.upper()}\n")
-        else:
-            inner_text = h2.get_text(separator=' ', strip=True)
-            h2.clear()
-            h2.append(f"{inner_text.upper()}\n")
+        save_page_cache({
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+            "text": text
+        }, cache_path)
     
-    text = content.get_text(separator='\n', strip=True)
     return text
 
-def initialize_bot_stores(client: OpenAI, knowledge_base_text: str):
-    """Initialize the vector stores needed by the bot."""
+def file_sha256(path: str) -> str:
+    """Return the hex sha256 digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as blob:
+        for chunk in iter(lambda: blob.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+@contextmanager
+def manifest_lock(path: str = MANIFEST_PATH):
+    """Serialize manifest updates across workers starting at the same time."""
+    with open(f"{path}.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def load_manifest(path: str = MANIFEST_PATH) -> dict:
+    """Load the vector store manifest, or an empty one if it doesn't exist yet."""
+    try:
+        with open(path, "r", encoding="utf-8") as blob:
+            manifest = json.load(blob)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
+    manifest.setdefault("stores", {})
+    manifest.setdefault("stale", [])
+    return manifest
+
+def save_manifest(manifest: dict, path: str = MANIFEST_PATH):
+    """Atomically persist the vector store manifest."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as blob:
+        json.dump(manifest, blob, indent=2)
+    os.replace(tmp_path, path)
+
+def write_if_changed(path: str, text: str) -> bool:
+    """Write text to path only when it differs from the current content."""
+    try:
+        with open(path, "r", encoding="utf-8") as blob:
+            if blob.read() == text:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(path, "w", encoding="utf-8") as blob:
+        blob.write(text)
+    return True
+
+def retrieve_vector_store(client: OpenAI, vector_store_id: str):
+    """Return a usable vector store by id, or None if it's gone or expired."""
+    try:
+        vector_store = client.vector_stores.retrieve(vector_store_id)
+    except NotFoundError:
+        return None
+    if vector_store.status == "expired":
+        return None
+    return vector_store
+
+def get_or_create_vector_store(client: OpenAI, manifest: dict, key: str, path: str, name: str):
+    """Reuse the vector store recorded for this content hash or build a new one."""
+    digest = file_sha256(path)
+    entry = manifest["stores"].get(key)
     
-    file = client.files.create(
-        file=open("resources/car_stock.json", "rb"),
-        purpose="assistants"
-    )
-    file_id = file.id
+    if entry and entry["sha256"] == digest:
+        vector_store = retrieve_vector_store(client, entry["vector_store_id"])
+        if vector_store is not None:
+            return vector_store
+    
+    with open(path, "rb") as blob:
+        file = client.files.create(file=blob, purpose="assistants")
     
-    vector_store = client.vector_stores.create(name="Car Stock Search")
+    vector_store = client.vector_stores.create(name=name)
     
     client.vector_stores.files.create(
         vector_store_id=vector_store.id,
-        file_id=file_id,
+        file_id=file.id,
     )
     
-    with open("resources/kavak_knowledge_base.txt", "w", encoding="utf-8") as blob:
-        blob.write(knowledge_base_text)
+    if entry:
+        manifest["stale"].extend(stale_entries(entry))
+    
+    manifest["stores"][key] = {
+        "sha256": digest,
+        "file_id": file.id,
+        "vector_store_id": vector_store.id
+    }
+    return vector_store
+
+def collect_stale_stores(client: OpenAI, manifest: dict):
+    """Delete vector stores and files that were replaced by newer content."""
+    remaining = []
+    for entry in manifest["stale"]:
+        # Entries of the sharded car stock may only have one of the two.
+        try:
+            if entry.get("vector_store_id"):
+                try:
+                    client.vector_stores.delete(entry["vector_store_id"])
+                except NotFoundError:
+                    pass
+            if entry.get("file_id"):
+                try:
+                    client.files.delete(entry["file_id"])
+                except NotFoundError:
+                    pass
+        except OpenAIError as e:
+            print(f"Could not delete stale vector store {entry.get('vector_store_id') or entry.get('file_id')}: {e}")
+            remaining.append(entry)
+    manifest["stale"] = remaining
+
+def car_stock_shards(records: dict[int, dict], shards: int = CAR_STOCK_SHARDS) -> dict[str, bytes]:
+    """Split the stock into JSON documents by stock_id, so a change only re-uploads its shard."""
+    documents: dict[str, list[dict]] = {}
+    for stock_id in sorted(records):
+        documents.setdefault(str(stock_id % shards), []).append(records[stock_id])
+    return {
+        shard: json.dumps(rows, ensure_ascii=False, indent=2).encode("utf-8")
+        for shard, rows in documents.items()
+    }
+
+def stale_entries(entry: dict) -> list[dict]:
+    """Stale manifest entries for a replaced store, single file or sharded."""
+    if "shards" not in entry:
+        return [{"file_id": entry["file_id"], "vector_store_id": entry["vector_store_id"]}]
+    return [
+        {"file_id": shard["file_id"], "vector_store_id": entry["vector_store_id"]}
+        for shard in entry["shards"].values()
+    ]
+
+def sync_car_stock_store(client: OpenAI, manifest: dict, records: dict[int, dict]):
+    """Bring the sharded car stock vector store in line with the records.
+    
+    Only shards whose content hash changed are uploaded. When any did, every shard file is
+    attached to a fresh vector store, so a search sees either the old stock or the new one,
+    never a mix. The caller swaps the returned store in, the old one and the replaced files
+    are left for collect_stale_stores.
+    """
+    entry = manifest["stores"].get("car_stock")
+    vector_store = None
+    if entry and "shards" in entry:
+        vector_store = retrieve_vector_store(client, entry["vector_store_id"])
+    
+    if vector_store is None:
+        if entry:
+            manifest["stale"].extend(stale_entries(entry))
+        entry = {"shards": {}}
+    
+    documents = car_stock_shards(records)
+    shards = {}
+    uploaded = []
+    try:
+        for shard, document in documents.items():
+            digest = hashlib.sha256(document).hexdigest()
+            current = entry["shards"].get(shard)
+            if current and current["sha256"] == digest:
+                shards[shard] = current
+                continue
+            file = client.files.create(file=(f"car_stock_{int(shard):02d}.json", document), purpose="assistants")
+            uploaded.append(file.id)
+            shards[shard] = {"sha256": digest, "file_id": file.id}
+        
+        if vector_store is not None and shards == entry["shards"]:
+            return vector_store
         
-    kb_file = client.files.create(
-        file=open("resources/kavak_knowledge_base.txt", "rb"),
-        purpose="assistants"
+        new_store = client.vector_stores.create(name="Car Stock Search")
+        try:
+            if shards:
+                client.vector_stores.file_batches.create_and_poll(
+                    new_store.id, file_ids=[shard["file_id"] for shard in shards.values()]
+                )
+        except Exception:
+            manifest["stale"].append({"vector_store_id": new_store.id})
+            raise
+    except Exception:
+        # Nothing refers to what a failed sync uploaded, so it's collected with the stale stores.
+        manifest["stale"].extend({"file_id": file_id} for file_id in uploaded)
+        raise
+    
+    if vector_store is not None:
+        manifest["stale"].append({"vector_store_id": vector_store.id})
+    manifest["stale"].extend(
+        {"file_id": shard["file_id"]}
+        for name, shard in entry["shards"].items() if shards.get(name) != shard
     )
-    kb_file_id = kb_file.id
+    manifest["stores"]["car_stock"] = {"vector_store_id": new_store.id, "shards": shards}
+    return new_store
+
+def sync_car_stock(client: OpenAI, records: dict[int, dict]):
+    """Sync the car stock vector store with an updated inventory, returning the store to search."""
+    with manifest_lock():
+        manifest = load_manifest()
+        try:
+            return sync_car_stock_store(client, manifest, records)
+        finally:
+            # Saved even after a failed sync, so what it uploaded is collected as stale.
+            save_manifest(manifest)
+
+def initialize_bot_stores(
+    client: OpenAI,
+    knowledge_base_text: str,
+    car_stock_records: dict[int, dict],
+    collect_stale: bool = True
+):
+    """Initialize the vector stores needed by the bot.
     
-    kb_vector_store = client.vector_stores.create(name="Kavak knowledge base")
+    Stores are looked up in the manifest by the content hash of their source content,
+    so they are only uploaded again when that content changes. The car stock is sharded
+    so stock updates only re-upload the shards that changed.
+    """
     
-    client.vector_stores.files.create(
-        vector_store_id=kb_vector_store.id,
-        file_id=kb_file_id,
-    )
+    write_if_changed(KNOWLEDGE_BASE_PATH, knowledge_base_text)
     
-    return vector_store, kb_vector_store
\ No newline at end of file
+    with manifest_lock():
+        manifest = load_manifest()
+        
+        vector_store = sync_car_stock_store(client, manifest, car_stock_records)
+        kb_vector_store = get_or_create_vector_store(
+            client, manifest, "knowledge_base", KNOWLEDGE_BASE_PATH, "Kavak knowledge base"
+        )
+        
+        if collect_stale:
+            collect_stale_stores(client, manifest)
+        save_manifest(manifest)
+    
+    return vector_store, kb_vector_store
+
+def collect_stale_bot_stores(client: OpenAI):
+    """Delete the stores replaced since the last collection."""
+    with manifest_lock():
+        manifest = load_manifest()
+        collect_stale_stores(client, manifest)
+        save_manifest(manifest)
@@ -0,0 +1,98 @@
+import asyncio
+from src.api.conversation_queue import ConversationQueue
+
+class Recorder:
+    """Handler that records each turn, optionally taking some time over it."""
+
+    def __init__(self, delay: float = 0):
+        self.delay = delay
+        self.turns: list[tuple[str, list[str]]] = []
+        self.done: list[list[str]] = []
+
+    async def __call__(self, phone_number: str, message_content: str):
+        await asyncio.sleep(self.delay)
+        self.turns.append((phone_number, message_content.split("\n")))
+
+    def messages(self, phone_number: str) -> list[str]:
+        return [message for number, messages in self.turns if number == phone_number for message in messages]
+
+def test_messages_of_a_conversation_are_handled_in_order():
+    async def scenario():
+        recorder = Recorder()
+        queue = ConversationQueue(recorder, debounce_seconds=0.01, max_batch_size=3, on_turn_done=recorder.done.append)
+        for n in range(7):
+            queue.submit("+1", f"mensaje {n}", f"SM{n}")
+        while queue.consumers:
+            await asyncio.sleep(0.01)
+        return recorder, queue
+
+    recorder, queue = asyncio.run(scenario())
+    assert recorder.messages("+1") == [f"mensaje {n}" for n in range(7)]
+    assert [len(messages) for _, messages in recorder.turns] == [3, 3, 1]
+    assert [message_id for turn in recorder.done for message_id in turn] == [f"SM{n}" for n in range(7)]
+    assert queue.stats()["processed_turns"] == 3
+    assert not queue.queues
+
+def test_messages_arriving_mid_turn_follow_in_order():
+    async def scenario():
+        recorder = Recorder(delay=0.05)
+        queue = ConversationQueue(recorder, debounce_seconds=0.01)
+        queue.submit("+1", "hola")
+        await asyncio.sleep(0.03)
+        # The first turn is still running, these wait for it and go in the next one.
+        queue.submit("+1", "busco un auto")
+        queue.submit("+1", "hasta 300 mil")
+        assert queue.stats()["pending_messages"] == 2
+        while queue.consumers:
+            await asyncio.sleep(0.01)
+        return recorder
+
+    recorder = asyncio.run(scenario())
+    assert recorder.turns == [("+1", ["hola"]), ("+1", ["busco un auto", "hasta 300 mil"])]
+
+def test_conversations_do_not_wait_for_each_other():
+    async def scenario():
+        slow, fast = asyncio.Event(), Recorder()
+
+        async def handler(phone_number: str, message_content: str):
+            if phone_number == "+1":
+                await slow.wait()
+            await fast(phone_number, message_content)
+
+        queue = ConversationQueue(handler, debounce_seconds=0.01)
+        queue.submit("+1", "primero")
+        for n in range(3):
+            queue.submit("+2", f"mensaje {n}")
+            await asyncio.sleep(0.02)
+        while "+2" in queue.consumers:
+            await asyncio.sleep(0.01)
+        assert fast.turns and all(number == "+2" for number, _ in fast.turns)
+        slow.set()
+        while queue.consumers:
+            await asyncio.sleep(0.01)
+        return fast
+
+    recorder = asyncio.run(scenario())
+    assert recorder.messages("+2") == ["mensaje 0", "mensaje 1", "mensaje 2"]
+    assert recorder.turns[-1] == ("+1", ["primero"])
+
+def test_failed_turn_does_not_stop_the_conversation():
+    async def scenario():
+        recorder = Recorder()
+
+        async def handler(phone_number: str, message_content: str):
+            if message_content == "falla":
+                raise RuntimeError("agent unavailable")
+            await recorder(phone_number, message_content)
+
+        queue = ConversationQueue(handler, debounce_seconds=0, on_turn_done=recorder.done.append)
+        queue.submit("+1", "falla", "SM1")
+        await asyncio.sleep(0.01)
+        queue.submit("+1", "hola", "SM2")
+        while queue.consumers:
+            await asyncio.sleep(0.01)
+        return recorder
+
+    recorder = asyncio.run(scenario())
+    assert recorder.turns == [("+1", ["hola"])]
+    assert recorder.done == [["SM1"], ["SM2"]]
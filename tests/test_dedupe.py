@@ -0,0 +1,33 @@
+from src.api.dedupe import MessageDeduplicator, SQLiteMessageDeduplicator
+
+def test_retries_are_suppressed_while_in_flight_and_after():
+    deduplicator = MessageDeduplicator()
+    assert deduplicator.claim("SM1")
+    assert not deduplicator.claim("SM1")
+    deduplicator.complete(["SM1"])
+    assert not deduplicator.claim("SM1")
+    assert deduplicator.stats()["suppressed_duplicates"] == 2
+
+def test_claims_are_shared_between_workers(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    first, second = SQLiteMessageDeduplicator(path), SQLiteMessageDeduplicator(path)
+    try:
+        assert first.claim("SM1")
+        assert not second.claim("SM1")
+        first.complete(["SM1"])
+        assert not second.claim("SM1")
+        assert second.claim("SM2")
+        assert first.stats()["seen"] == 2
+    finally:
+        first.close()
+        second.close()
+
+def test_expired_claims_are_dropped(tmp_path):
+    deduplicator = SQLiteMessageDeduplicator(str(tmp_path / "sessions.db"), ttl_seconds=-1, expire_every=2)
+    try:
+        assert deduplicator.claim("SM1")
+        # The second claim expires the first one, so a much later retry is answered again.
+        assert deduplicator.claim("SM2")
+        assert deduplicator.claim("SM1")
+    finally:
+        deduplicator.close()
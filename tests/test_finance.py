@@ -0,0 +1,60 @@
+import datetime
+import pytest
+from src.bot import finance
+from src.bot.finance import build_installments, compare_plans, financial_plan, payment_dates
+
+def remaining_balance(principal: float, monthly_payment: float, plan: int, annual_rate: float) -> float:
+    """Balance left after paying every installment, month by month."""
+    balance = principal
+    for _ in range(plan):
+        balance = balance * (1 + annual_rate / 12) - monthly_payment
+    return balance
+
+def test_dates_step_by_calendar_month_from_the_31st():
+    assert payment_dates(4, datetime.date(2024, 1, 31)) == ["01/02/2024", "01/03/2024", "01/04/2024", "01/05/2024"]
+
+def test_dates_cross_a_leap_february_and_the_year_end():
+    dates = payment_dates(72, datetime.date(2024, 2, 29))
+    assert dates[:2] == ["01/03/2024", "01/04/2024"]
+    assert dates[9:11] == ["01/12/2024", "01/01/2025"]
+    assert dates[-1] == "01/02/2030"
+    assert len(set(dates)) == 72
+
+def test_installments_keep_the_date_sequence():
+    installments = build_installments(1000.0, 3, datetime.date(2023, 12, 31))
+    assert [installment.payment_date for installment in installments] == ["01/01/2024", "01/02/2024", "01/03/2024"]
+    assert [installment.installment_rn for installment in installments] == [1, 2, 3]
+
+@pytest.mark.parametrize("plan", [36, 48, 60, 72])
+def test_monthly_payment_pays_off_the_principal(plan):
+    result = financial_plan(350000, plan, 50000)
+    assert remaining_balance(300000, result.installments[0].amount, plan, 0.10) == pytest.approx(0, abs=plan * 0.01 * 2)
+    assert len(result.installments) == plan
+
+def test_last_installment_absorbs_the_rounding():
+    result = financial_plan(461999, 48, 50000)
+    amounts = [installment.amount for installment in result.installments]
+    assert len(set(amounts[:-1])) == 1
+    assert all(round(amount, 2) == amount for amount in amounts)
+    assert abs(amounts[-1] - amounts[0]) < 0.01 * len(amounts)
+    assert round(sum(amounts), 2) == result.total_paid
+
+def test_comparison_matches_single_plans():
+    comparison = compare_plans(300000, [36, 72], [0, 60000])
+    assert [(option.plan, option.deposit) for option in comparison.options] == [(36, 0), (36, 60000), (72, 0), (72, 60000)]
+    for option in comparison.options:
+        plan = financial_plan(300000, option.plan, option.deposit)
+        assert option.total_paid == plan.total_paid
+        assert option.total_interest == round(plan.total_paid - (300000 - option.deposit), 2)
+        assert option.installments is None
+    assert comparison.options[0].last_payment_date == payment_dates(36)[-1]
+
+def test_payments_are_memoized(monkeypatch):
+    compare_plans(123456, [36, 48], [1000])
+    monkeypatch.setattr(finance, "monthly_payments", lambda *args: pytest.fail("recomputed a cached payment"))
+    assert financial_plan(123456, 48, 1000).total_paid > 0
+
+@pytest.mark.parametrize("plan, deposit", [(24, 0), (84, 0), (48, -1), (48, 300000)])
+def test_invalid_plans_are_rejected(plan, deposit):
+    with pytest.raises(ValueError):
+        financial_plan(300000, plan, deposit)
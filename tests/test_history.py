@@ -0,0 +1,45 @@
+import asyncio
+import json
+from agents import RunContextWrapper
+import src.bot.main as bot_main
+from src.bot.finance import financial_plan
+from src.bot.history import HistoryManager, summarize_tool_output
+
+CAR = {"stock_id": 243587, "price": 461999.0, "make": "Volkswagen", "model": "Touareg", "year": "2018", "version": "Wolfsburg Edition"}
+
+def tool_output(tool, arguments: dict) -> str:
+    """What the SDK keeps in the history for a tool call, str() of the tool's return value."""
+    return str(asyncio.run(tool.on_invoke_tool(RunContextWrapper(context=None), json.dumps(arguments))))
+
+def test_financial_plan_summary_keeps_the_totals():
+    plan = financial_plan(CAR["price"], 48, 50000)
+    output = tool_output(bot_main.create_financial_plan, {"car": CAR, "plan": 48, "deposit": 50000})
+    assert str(plan) != output
+
+    summary = summarize_tool_output(output)
+    assert f"48 installments of {plan.installments[0].amount:.2f}" in summary
+    assert f"total paid {plan.total_paid:.2f}" in summary
+
+def test_car_search_summary_keeps_every_stock_id():
+    output = tool_output(bot_main.search_cars, {
+        "make": None, "model": None, "min_price": None, "max_price": None, "min_year": None, "max_year": None,
+        "max_km": None, "bluetooth": None, "car_play": None, "sort_by": "price", "descending": False, "limit": 5, "offset": 0
+    })
+    cars = json.loads(output)["cars"]
+    summary = summarize_tool_output(output)
+    assert len(cars) == 5
+    assert all(f"stock_id {car['stock_id']}" in summary for car in cars)
+
+def test_folded_turns_keep_the_financial_plan():
+    output = tool_output(bot_main.create_financial_plan, {"car": CAR, "plan": 60, "deposit": 80000})
+    plan = json.loads(output)
+    history = [
+        {"role": "user", "content": "quiero el plan a 60 meses"},
+        {"type": "function_call", "call_id": "call_1", "name": "create_financial_plan", "arguments": "{}"},
+        {"type": "function_call_output", "call_id": "call_1", "output": output},
+        {"role": "assistant", "content": "Aqui esta tu plan"},
+        {"role": "user", "content": "gracias"},
+    ]
+    compacted = HistoryManager(keep_turns=1).compact(history)
+    assert f"total paid {plan['total_paid']:.2f}" in compacted[0]["content"]
+    assert compacted[1:] == history[-1:]
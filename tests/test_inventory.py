@@ -0,0 +1,135 @@
+import random
+import pytest
+from src.bot.inventory import (
+    CarInventory,
+    CarInventoryIndex,
+    diff_stock,
+    load_stock_snapshot,
+    normalize_term,
+    parse_flag
+)
+
+STOCK_PATH = "resources/car_stock.json"
+
+@pytest.fixture(scope="module")
+def records() -> dict[int, dict]:
+    return load_stock_snapshot(STOCK_PATH)
+
+@pytest.fixture(scope="module")
+def index(records) -> CarInventoryIndex:
+    return CarInventoryIndex(list(records.values()))
+
+def scan(records: dict[int, dict], make=None, model=None, ranges=None, bluetooth=None, car_play=None) -> list[dict]:
+    """The plain list scan the index replaced."""
+    matches = []
+    for record in records.values():
+        if make and normalize_term(record["make"]) != normalize_term(make):
+            continue
+        if model and normalize_term(record["model"]) != normalize_term(model):
+            continue
+        if any(
+            (low is not None and record[name] < low) or (high is not None and record[name] > high)
+            for name, (low, high) in (ranges or {}).items()
+        ):
+            continue
+        if bluetooth is not None and parse_flag(record.get("bluetooth")) != bluetooth:
+            continue
+        if car_play is not None and parse_flag(record.get("car_play")) != car_play:
+            continue
+        matches.append(record)
+    return matches
+
+QUERIES = [
+    {},
+    {"make": "nissan"},
+    {"make": "Mazda", "model": "MAZDA 3"},
+    {"make": "KIA", "ranges": {"price": (None, 300000)}},
+    {"ranges": {"price": (200000, 400000), "year": (2018, None)}},
+    {"ranges": {"km": (None, 50000)}, "bluetooth": True},
+    {"car_play": True, "ranges": {"year": (2019, 2021)}},
+    {"make": "Ferrari"},
+]
+
+@pytest.mark.parametrize("query", QUERIES)
+@pytest.mark.parametrize("sort_by, descending", [("price", False), ("km", True), ("year", False)])
+def test_search_matches_the_list_scan(records, index, query, sort_by, descending):
+    expected = scan(records, **query)
+    expected_keys = sorted((record[sort_by] for record in expected), reverse=descending)
+
+    result = index.search(**query, sort_by=sort_by, descending=descending, limit=5)
+    assert result.total_matches == len(expected)
+    assert [getattr(car, sort_by) if sort_by != "year" else int(car.year) for car in result.cars] == expected_keys[:5]
+
+@pytest.mark.parametrize("sort_by", ["price", "km", "year"])
+@pytest.mark.parametrize("descending", [False, True])
+def test_pages_cover_every_match_once(records, index, sort_by, descending):
+    # Many cars share a year or a price, ties must not move between pages.
+    for limit in range(1, 21):
+        stock_ids = []
+        for offset in range(0, len(records), limit):
+            page = index.search(sort_by=sort_by, descending=descending, limit=limit, offset=offset)
+            stock_ids += [car.stock_id for car in page.cars]
+        assert sorted(stock_ids) == sorted(records)
+
+def test_random_filters_match_the_list_scan(records, index):
+    generator = random.Random(7)
+    makes = sorted({record["make"] for record in records.values()})
+    for _ in range(200):
+        query = {
+            "make": generator.choice(makes + [None] * 3),
+            "ranges": {
+                "price": (generator.choice([None, 150000, 250000]), generator.choice([None, 350000, 600000])),
+                "km": (None, generator.choice([None, 40000, 90000])),
+                "year": (generator.choice([None, 2016, 2019]), None)
+            },
+            "bluetooth": generator.choice([None, True, False]),
+            "car_play": generator.choice([None, True])
+        }
+        expected = {record["stock_id"] for record in scan(records, **query)}
+        result = index.search(**query, limit=20)
+        assert result.total_matches == len(expected)
+        assert {car.stock_id for car in result.cars} <= expected
+
+def test_diff_reports_added_removed_and_changed(records):
+    updated = {stock_id: dict(record) for stock_id, record in records.items()}
+    removed, changed = sorted(updated)[:2]
+    del updated[removed]
+    updated[changed]["price"] -= 10000
+    updated[1] = {**records[changed], "stock_id": 1}
+
+    diff = diff_stock(records, updated)
+    assert (diff.added, diff.removed, diff.changed) == ([1], [removed], [changed])
+    assert not diff_stock(records, {stock_id: dict(record) for stock_id, record in records.items()})
+
+def test_update_syncs_before_swapping_the_index(records):
+    inventory = CarInventory(STOCK_PATH)
+    updated = {stock_id: dict(record) for stock_id, record in records.items()}
+    stock_id = next(iter(updated))
+    updated[stock_id]["price"] = 1.0
+    seen = []
+
+    def before_swap(new_records, diff):
+        # Searches still see the old version while the backend syncs.
+        seen.append(inventory.index.search(ranges={"price": (None, 1.0)}).total_matches)
+        assert diff.changed == [stock_id]
+
+    assert inventory.update(updated, before_swap)
+    assert seen == [0]
+    assert inventory.version == 2
+    assert [car.stock_id for car in inventory.index.search(ranges={"price": (None, 1.0)}).cars] == [stock_id]
+
+    assert not inventory.update(updated, lambda *args: pytest.fail("synced an unchanged stock"))
+    assert inventory.version == 2
+
+def test_failed_sync_keeps_the_current_index(records):
+    inventory = CarInventory(STOCK_PATH)
+    index = inventory.index
+    updated = {stock_id: record for stock_id, record in records.items() if stock_id != next(iter(records))}
+
+    def failing_sync(new_records, diff):
+        raise RuntimeError("vector store unavailable")
+
+    with pytest.raises(RuntimeError):
+        inventory.update(updated, failing_sync)
+    assert inventory.index is index
+    assert inventory.version == 1
@@ -0,0 +1,26 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from src.bot.knowledge import KnowledgeBaseIndex
+
+KB_TEXT = """Centros de inspeccion
+Kavak tiene centros de inspeccion en Monterrey, Guadalajara y Ciudad de Mexico.
+
+Horarios
+Los centros abren de lunes a sabado de 9:00 a 18:00.
+
+Garantia
+Todos los autos incluyen una garantia de 3 meses.
+"""
+
+def test_concurrent_saves_dont_collide(tmp_path):
+    path = str(tmp_path / "kb_index.json")
+    index = KnowledgeBaseIndex.build(KB_TEXT)
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda _: index.save(path), range(32)))
+    assert os.listdir(tmp_path) == ["kb_index.json"]
+    assert KnowledgeBaseIndex.load_or_build(KB_TEXT, path).chunks == index.chunks
+
+def test_search_finds_the_matching_chunk():
+    result = KnowledgeBaseIndex.build(KB_TEXT).search("horario centro de inspeccion")
+    assert result.chunks
+    assert any("9:00" in chunk.text for chunk in result.chunks)
@@ -0,0 +1,52 @@
+import asyncio
+import httpx
+import pytest
+from src.api.outbound import DeliveryError, OutboundDispatcher, TwilioTransport, split_message
+
+def twilio_transport(handler) -> TwilioTransport:
+    transport = TwilioTransport("AC123", "token", "+15550000000")
+    transport.client = httpx.AsyncClient(base_url="https://api.twilio.test", transport=httpx.MockTransport(handler))
+    return transport
+
+def delivery_error(handler) -> DeliveryError:
+    transport = twilio_transport(handler)
+    with pytest.raises(DeliveryError) as error:
+        asyncio.run(transport.send("+5215555555555", "hola"))
+    return error.value
+
+def raise_error(error_type):
+    def handler(request):
+        raise error_type("boom", request=request)
+    return handler
+
+@pytest.mark.parametrize("error_type", [httpx.ConnectError, httpx.ConnectTimeout])
+def test_requests_that_never_left_are_retried(error_type):
+    assert delivery_error(raise_error(error_type)).retryable
+
+@pytest.mark.parametrize("error_type", [httpx.ReadTimeout, httpx.RemoteProtocolError])
+def test_requests_twilio_may_have_accepted_are_not_retried(error_type):
+    assert not delivery_error(raise_error(error_type)).retryable
+
+@pytest.mark.parametrize("status_code, retryable", [(429, True), (500, True), (503, True), (400, False), (401, False)])
+def test_status_codes(status_code, retryable):
+    error = delivery_error(lambda request: httpx.Response(status_code, headers={"Retry-After": "2"}))
+    assert error.status_code == status_code
+    assert error.retryable == retryable
+
+def test_read_timeout_is_delivered_once():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        raise httpx.ReadTimeout("slow", request=request)
+
+    dispatcher = OutboundDispatcher(twilio_transport(handler), max_retries=3, backoff_seconds=0)
+    result = asyncio.run(dispatcher._deliver("+5215555555555", ["hola"]))
+    assert result["status"] == "error"
+    assert len(calls) == 1
+
+def test_split_message_respects_the_limit():
+    text = "\n\n".join(["palabra " * 50] * 10)
+    segments = split_message(text, limit=500)
+    assert all(len(segment) <= 500 for segment in segments)
+    assert " ".join(segments).split() == text.split()
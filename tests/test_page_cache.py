@@ -0,0 +1,17 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from src.bot.util import load_page_cache, save_page_cache
+
+def test_concurrent_saves_dont_collide(tmp_path):
+    path = str(tmp_path / "kb_page_cache.json")
+    cache = {"url": "https://example.com/kb", "etag": "abc", "content": "Kavak " * 1000}
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda _: save_page_cache(cache, path), range(32)))
+    assert os.listdir(tmp_path) == ["kb_page_cache.json"]
+    assert load_page_cache(path) == cache
+
+def test_missing_or_corrupt_cache_loads_as_none(tmp_path):
+    path = tmp_path / "kb_page_cache.json"
+    assert load_page_cache(str(path)) is None
+    path.write_text("{not json", encoding="utf-8")
+    assert load_page_cache(str(path)) is None
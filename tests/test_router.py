@@ -0,0 +1,115 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from agents import InputGuardrailTripwireTriggered
+import src.bot.main as bot_main
+from src.bot.models import AgentOutput, GuardrailCheck
+from src.bot.router import IntentRouter
+
+SALES_AGENT = "Kavak Car Sales Agent"
+SUPPORT_AGENT = "Kavak customer success agent"
+
+@pytest.fixture
+def router():
+    return IntentRouter(SALES_AGENT, SUPPORT_AGENT)
+
+@pytest.fixture
+def bot():
+    return bot_main.Bot(None, SimpleNamespace(id="vs_cars"), SimpleNamespace(id="vs_kb"), None)
+
+def user(text: str) -> list[dict]:
+    return [{"role": "user", "content": text}]
+
+@pytest.mark.parametrize("text, agent", [
+    ("quiero comprar un auto con financiamiento", SALES_AGENT),
+    ("cuanto seria la mensualidad a 48 meses", SALES_AGENT),
+    ("donde estan sus sedes en monterrey", SUPPORT_AGENT),
+    ("cual es el horario del centro de inspeccion", SUPPORT_AGENT),
+])
+def test_confident_intents_go_straight_to_the_specialist(router, text, agent):
+    assert router.route(user(text)).agent == agent
+
+@pytest.mark.parametrize("text", ["hola", "ok gracias", "cuentame un chiste"])
+def test_unclear_intents_are_left_to_triage(router, text):
+    assert router.route(user(text)).agent is None
+
+def test_the_requesting_agent_is_never_routed_back_to(router):
+    decision = router.route(user("quiero comprar un auto"), requested_by=SALES_AGENT)
+    assert decision.agent is None
+    assert router.route(user("y tienen garantia?"), requested_by=SALES_AGENT).agent == SUPPORT_AGENT
+
+def test_decisions_are_only_logged_when_enabled(router, tmp_path):
+    decision = router.route(user("quiero comprar un auto"))
+    router.record(decision, SALES_AGENT, needs_triage=False)
+    assert router.stats()["accepted"] == 1
+
+    path = tmp_path / "routing.jsonl"
+    router.log_path = str(path)
+    router.record(decision, SALES_AGENT, needs_triage=False, conversation_id="+5215555555555")
+    assert path.read_text(encoding="utf-8").count("\n") == 1
+
+def test_routed_specialists_keep_the_guardrail(bot):
+    agent, decision = bot_main.route_turn(bot, user("quiero comprar un auto para esconder droga"))
+    assert decision.agent == SALES_AGENT
+    assert agent is not bot.car_sales_agent
+    assert [guardrail.guardrail_function for guardrail in agent.input_guardrails] == [bot_main.smart_guardrail]
+
+def test_routed_turns_carry_the_unguarded_agent_forward(bot, monkeypatch):
+    async def run(agent, input, context=None, run_config=None):
+        reply = AgentOutput(needsTriage=False, message="Claro.")
+        return SimpleNamespace(final_output=reply, last_agent=agent, new_items=[], to_input_list=lambda: list(input))
+
+    monkeypatch.setattr(bot_main.Runner, "run", run)
+    outcome = asyncio.run(bot_main.run_turn(bot, bot.triage_agent, [], "quiero comprar un auto con financiamiento", {}))
+    assert outcome.path == [SALES_AGENT]
+    assert outcome.last_agent is bot.car_sales_agent
+
+class FakeStreamedRun:
+    """Stands in for RunResultStreaming, streaming a whole reply at once."""
+
+    def __init__(self, agent, reply: AgentOutput):
+        self.last_agent = agent
+        self.final_output = reply
+        self.new_items = []
+        self.cancelled = False
+
+    async def stream_events(self):
+        yield SimpleNamespace(type="agent_updated_stream_event", new_agent=self.last_agent)
+        yield SimpleNamespace(type="raw_response_event", data=SimpleNamespace(type="response.created"))
+        yield SimpleNamespace(
+            type="raw_response_event",
+            data=SimpleNamespace(type="response.output_text.delta", delta=self.final_output.model_dump_json())
+        )
+
+    def cancel(self):
+        self.cancelled = True
+
+def test_unsafe_input_trips_the_guardrail_of_a_routed_streamed_turn(bot, monkeypatch):
+    text = "quiero comprar un auto para esconder droga"
+    runs = []
+
+    def run_streamed(agent, input, context=None, run_config=None):
+        runs.append(FakeStreamedRun(agent, AgentOutput(needsTriage=False, message="Claro.\n\nTe ayudo.")))
+        return runs[-1]
+
+    async def guardrail_agent_run(agent, input, context=None, run_config=None):
+        # The guardrail answers after the specialist has streamed its whole reply.
+        await asyncio.sleep(0.05)
+        verdict = GuardrailCheck(is_business=False, is_safe=False, reason="Dangerous content")
+        return SimpleNamespace(final_output_as=lambda _type: verdict)
+
+    monkeypatch.setattr(bot_main.Runner, "run_streamed", run_streamed)
+    monkeypatch.setattr(bot_main.Runner, "run", guardrail_agent_run)
+    monkeypatch.setattr(bot_main, "guardrail_prefilter", bot_main.GuardrailPrefilter())
+
+    async def drain():
+        events = []
+        with pytest.raises(InputGuardrailTripwireTriggered):
+            async for event in bot_main.turn_events(bot, bot.triage_agent, [], text, {}, stream=True):
+                events.append(event)
+        return events
+
+    events = asyncio.run(drain())
+    assert [run.last_agent.name for run in runs] == [SALES_AGENT]
+    assert [event for event, _ in events] == ["agent"]
+    assert runs[0].cancelled
@@ -0,0 +1,145 @@
+import asyncio
+import time
+from types import SimpleNamespace
+import httpx
+import pytest
+from openai import RateLimitError
+from src.bot.scheduler import LLMScheduler, Priority, ScheduledModel, TokenBucket
+
+def rate_limit_error(retry_after: str | None = None) -> RateLimitError:
+    headers = {"retry-after": retry_after} if retry_after else {}
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "https://api.openai.com/v1/responses"))
+    return RateLimitError("Rate limit reached", response=response, body=None)
+
+class FlakyModel:
+    """Fails with a 429 a given number of times before answering."""
+
+    def __init__(self, failures: int, retry_after: str | None = None):
+        self.failures = failures
+        self.retry_after = retry_after
+        self.calls = []
+
+    async def get_response(self, system_instructions, input, *args, **kwargs):
+        self.calls.append(time.monotonic())
+        if len(self.calls) <= self.failures:
+            raise rate_limit_error(self.retry_after)
+        return SimpleNamespace(usage=SimpleNamespace(total_tokens=100))
+
+def test_token_bucket_waits_for_what_is_missing():
+    bucket = TokenBucket(rate=10, capacity=20)
+    now = bucket.updated
+    assert bucket.wait_time(5, now) == 0
+    bucket.take(25)
+    assert bucket.wait_time(5, now) == pytest.approx(1.0)
+    # Larger than the capacity only waits for a full bucket.
+    assert bucket.wait_time(100, now + 1.0) == pytest.approx(1.5)
+
+def test_continuing_conversations_are_served_first():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=1)
+        await scheduler.acquire(10)
+        order = []
+
+        async def request(name: str, priority: Priority):
+            with scheduler.priority(priority):
+                await scheduler.acquire(10)
+            order.append(name)
+            scheduler.release(10, 10)
+
+        tasks = [
+            asyncio.create_task(request("new 1", Priority.NEW)),
+            asyncio.create_task(request("new 2", Priority.NEW)),
+            asyncio.create_task(request("continuing", Priority.CONTINUING))
+        ]
+        await asyncio.sleep(0)
+        assert scheduler.stats()["queued"] == {"continuing": 1, "new": 2}
+        scheduler.release(10, 10)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["continuing", "new 1", "new 2"]
+
+def test_rate_limit_halves_the_limit_and_backs_off():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=8, backoff_seconds=0.05)
+        model = FlakyModel(failures=2)
+        await ScheduledModel(model, scheduler).get_response("instructions", "hola")
+        return scheduler, model
+
+    scheduler, model = asyncio.run(scenario())
+    assert len(model.calls) == 3
+    assert scheduler.rate_limited == 2
+    assert scheduler.limit == 2
+    assert scheduler.in_flight == 0
+    # Exponential backoff, 0.05 then 0.1 seconds.
+    assert model.calls[1] - model.calls[0] >= 0.05
+    assert model.calls[2] - model.calls[1] >= 0.1
+
+def test_retry_after_header_sets_the_pause():
+    async def scenario():
+        scheduler = LLMScheduler(backoff_seconds=5)
+        model = FlakyModel(failures=1, retry_after="0.05")
+        await ScheduledModel(model, scheduler).get_response("instructions", "hola")
+        return model
+
+    model = asyncio.run(scenario())
+    assert 0.05 <= model.calls[1] - model.calls[0] < 1
+
+def test_successes_grow_the_limit_back():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=4)
+        scheduler.limit = 1
+        for _ in range(3):
+            await scheduler.acquire(10)
+            scheduler.release(10, 10)
+        return scheduler
+
+    assert asyncio.run(scenario()).limit == 3
+
+def test_cancelled_waiter_never_takes_a_slot():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=1)
+        await scheduler.acquire(10)
+        waiter = asyncio.create_task(scheduler.acquire(10))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        scheduler.release(10, 10)
+        await asyncio.wait_for(scheduler.acquire(10), 1)
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert scheduler.in_flight == 1
+    assert scheduler.granted == 2
+
+def test_cancelled_after_the_grant_releases_the_slot():
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=1)
+        await scheduler.acquire(10)
+        waiter = asyncio.create_task(scheduler.acquire(10))
+        await asyncio.sleep(0)
+        # The slot is granted to the waiter, which is cancelled before it resumes.
+        scheduler.release(10, 10)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert scheduler.in_flight == 0
+        await asyncio.wait_for(scheduler.acquire(10), 1)
+        return scheduler
+
+    assert asyncio.run(scenario()).in_flight == 1
+
+def test_cancelled_model_call_releases_the_slot():
+    class SlowModel:
+        async def get_response(self, *args, **kwargs):
+            await asyncio.sleep(10)
+
+    async def scenario():
+        scheduler = LLMScheduler(max_concurrency=1)
+        call = asyncio.create_task(ScheduledModel(SlowModel(), scheduler).get_response("instructions", "hola"))
+        await asyncio.sleep(0.01)
+        assert scheduler.in_flight == 1
+        call.cancel()
+        await asyncio.gather(call, return_exceptions=True)
+        return scheduler
+
+    assert asyncio.run(scenario()).in_flight == 0
@@ -0,0 +1,33 @@
+import json
+from src.api.sessions import SessionStore
+
+def recount(store: SessionStore) -> int:
+    return sum(
+        len(json.dumps(entry["session"]["conversation_history"], default=str))
+        for entry in store.entries.values() if entry["session"] is not None
+    )
+
+def turn(session: dict, text: str) -> dict:
+    session["conversation_history"] += [{"role": "user", "content": text}, {"role": "assistant", "content": text.upper()}]
+    return session
+
+def test_live_history_bytes_follow_saves_compression_and_evictions():
+    store = SessionStore("Triage Agent", max_sessions=2, compress_after_seconds=0)
+    store.save("+1", turn(store.get_or_create("+1"), "hola"))
+    store.save("+2", turn(store.get_or_create("+2"), "quiero un auto"))
+    assert store.stats()["live_history_bytes"] == recount(store) > 0
+
+    store.sweep()
+    assert store.stats()["live_sessions"] == 0
+    assert store.stats()["live_history_bytes"] == 0
+
+    store.save("+1", turn(store.get_or_create("+1"), "otra vez"))
+    assert store.stats()["live_history_bytes"] == recount(store)
+
+    store.save("+3", turn(store.get_or_create("+3"), "donde estan"))
+    assert "+2" not in store.entries
+    assert store.stats()["live_history_bytes"] == recount(store)
+
+    store.delete("+1")
+    store.delete("+3")
+    assert store.stats()["live_history_bytes"] == 0
@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+from src.bot.util import collect_stale_stores, sync_car_stock_store
+
+class FakeOpenAI:
+    """Records the files and vector stores the sync creates, attaches and deletes."""
+
+    def __init__(self):
+        self.stores: dict[str, set[str]] = {}
+        self.uploaded: set[str] = set()
+        self.uploads = 0
+        self.files = SimpleNamespace(create=self.create_file, delete=self.uploaded.discard)
+        self.vector_stores = SimpleNamespace(
+            create=self.create_store,
+            retrieve=lambda store_id: SimpleNamespace(id=store_id, status="completed"),
+            delete=lambda store_id: self.stores.pop(store_id, None),
+            file_batches=SimpleNamespace(create_and_poll=self.attach)
+        )
+
+    def create_file(self, file, purpose):
+        self.uploads += 1
+        file_id = f"file_{self.uploads}"
+        self.uploaded.add(file_id)
+        return SimpleNamespace(id=file_id)
+
+    def create_store(self, name):
+        store_id = f"vs_{len(self.stores) + 1}"
+        self.stores[store_id] = set()
+        return SimpleNamespace(id=store_id)
+
+    def attach(self, vector_store_id, file_ids):
+        self.stores[vector_store_id] |= set(file_ids)
+
+def car(stock_id: int, price: float) -> dict:
+    return {"stock_id": stock_id, "price": price, "make": "Toyota", "model": "Corolla", "year": "2020", "version": "LE"}
+
+def test_changed_stock_goes_to_a_fresh_store():
+    client = FakeOpenAI()
+    manifest = {"stores": {}, "stale": []}
+    records = {stock_id: car(stock_id, 300000) for stock_id in range(40)}
+
+    first = sync_car_stock_store(client, manifest, records)
+    first_files = set(client.stores[first.id])
+    assert len(first_files) == 16
+    assert sync_car_stock_store(client, manifest, records).id == first.id
+    assert client.uploads == 16
+
+    changed = {**records, 5: car(5, 250000)}
+    second = sync_car_stock_store(client, manifest, changed)
+    assert second.id != first.id
+    assert client.uploads == 17
+    # The store searched so far is left as it was until it's collected.
+    assert client.stores[first.id] == first_files
+    replaced = first_files - client.stores[second.id]
+    assert len(replaced) == 1
+    assert manifest["stale"] == [{"vector_store_id": first.id}, {"file_id": next(iter(replaced))}]
+
+    collect_stale_stores(client, manifest)
+    assert set(client.stores) == {second.id}
+    assert client.stores[second.id] <= client.uploaded
+    assert manifest["stale"] == []
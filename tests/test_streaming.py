@@ -0,0 +1,90 @@
+import asyncio
+import json
+from types import SimpleNamespace
+from src.bot.models import AgentOutput
+from src.bot.streaming import MessageFieldDecoder, stream_agent_message
+
+def fragments(text: str, size: int = 3) -> list[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+class FakeStreamedRun:
+    """Stands in for RunResultStreaming, replaying raw response events."""
+
+    def __init__(self, agent: str, responses: list[str], guardrail_after: int | None = None):
+        self.agent = agent
+        self.responses = responses
+        # Number of text deltas before the input guardrail finishes, None for an unguarded run.
+        self.guardrail_after = guardrail_after
+        self.guardrail_done = None
+
+    async def stream_events(self):
+        yield SimpleNamespace(type="agent_updated_stream_event", new_agent=SimpleNamespace(name=self.agent))
+        deltas = 0
+        for response in self.responses:
+            yield SimpleNamespace(type="raw_response_event", data=SimpleNamespace(type="response.created"))
+            for fragment in fragments(response):
+                if deltas == self.guardrail_after:
+                    self.guardrail_done.set()
+                    await asyncio.sleep(0.01)
+                deltas += 1
+                yield SimpleNamespace(
+                    type="raw_response_event",
+                    data=SimpleNamespace(type="response.output_text.delta", delta=fragment)
+                )
+
+class Tripped(Exception):
+    pass
+
+def collect(run, trips: bool = False) -> list[tuple[str, str]]:
+    async def check_input():
+        await run.guardrail_done.wait()
+        if trips:
+            raise Tripped()
+
+    async def drain():
+        guardrails = None
+        if run.guardrail_after is not None:
+            run.guardrail_done = asyncio.Event()
+            guardrails = asyncio.create_task(check_input())
+        events = []
+        try:
+            async for event in stream_agent_message(run, guardrails):
+                events.append(event)
+        except Tripped:
+            events.append(("tripped", ""))
+        return events
+    return asyncio.run(drain())
+
+def test_decoder_handles_escapes_split_across_fragments():
+    message = 'Hola "José" \\ ¿qué tal? 🚗\nAdiós'
+    decoder = MessageFieldDecoder()
+    decoded = "".join(decoder.feed(fragment) for fragment in fragments(json.dumps({"message": message}), 1))
+    assert decoded == message
+
+def test_needs_triage_comes_before_the_message():
+    assert list(AgentOutput.model_json_schema()["properties"]) == ["needsTriage", "message"]
+
+def test_reply_flagged_for_triage_yields_no_text():
+    reply = AgentOutput(needsTriage=True, message="Primer parrafo.\n\nSegundo parrafo.").model_dump_json()
+    events = collect(FakeStreamedRun("Kavak Car Sales Agent", [reply]))
+    assert events == [("agent", "Kavak Car Sales Agent"), ("needs_triage", "true")]
+
+def test_flag_is_reported_once_per_response():
+    responses = [
+        AgentOutput(needsTriage=False, message="uno").model_dump_json(),
+        AgentOutput(needsTriage=False, message="dos").model_dump_json()
+    ]
+    events = collect(FakeStreamedRun("Kavak customer success agent", responses))
+    assert [event for event, _ in events].count("needs_triage") == 2
+
+def test_text_waits_for_the_flag_and_the_input_guardrail():
+    reply = AgentOutput(needsTriage=False, message="Primer parrafo.\n\nSegundo parrafo.").model_dump_json()
+    events = collect(FakeStreamedRun("Kavak Car Sales Agent", [reply], guardrail_after=15))
+    assert events[:2] == [("agent", "Kavak Car Sales Agent"), ("needs_triage", "false")]
+    assert {event for event, _ in events[2:]} == {"delta"}
+    assert "".join(data for _, data in events[2:]) == "Primer parrafo.\n\nSegundo parrafo."
+
+def test_tripped_guardrail_never_releases_the_flag():
+    reply = AgentOutput(needsTriage=False, message="Primer parrafo.\n\nSegundo parrafo.").model_dump_json()
+    events = collect(FakeStreamedRun("Kavak Car Sales Agent", [reply], guardrail_after=15), trips=True)
+    assert events == [("agent", "Kavak Car Sales Agent"), ("tripped", "")]